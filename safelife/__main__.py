@@ -6,13 +6,15 @@ import argparse
 
 from . import render_graphics
 from . import interactive_game
+from . import benchmarks
 
 
 def run():
     parser = argparse.ArgumentParser(description="""
     The SafeLife command-line tool can be used to interactively play
     a game of SafeLife, print procedurally generated SafeLife boards,
-    or convert saved boards to images for easy viewing.
+    convert saved boards to images for easy viewing, or run performance
+    benchmarks.
 
     Please select one of the available commands to run the program.
     You can run `safelife <command> --help` to get more help on a
@@ -21,6 +23,7 @@ def run():
     subparsers = parser.add_subparsers(dest="cmd", help="Top-level command.")
     interactive_game._make_cmd_args(subparsers)
     render_graphics._make_cmd_args(subparsers)
+    benchmarks._make_cmd_args(subparsers)
     args = parser.parse_args()
     if args.cmd is None:
         parser.print_help()
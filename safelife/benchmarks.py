@@ -0,0 +1,502 @@
+"""
+Performance benchmarks for SafeLife.
+
+Run using ``python3 -m safelife bench <benchmark>``. Each benchmark prints
+a human-readable summary and can optionally write its full results to a
+JSON file for later comparison.
+"""
+
+import os
+import sys
+import json
+import time
+import itertools
+import platform
+import textwrap
+
+import numpy as np
+
+from . import proc_gen
+from .level_iterator import _load_files, _game_from_data
+from .safelife_env import SafeLifeEnv
+from .env_wrappers import MovementBonusWrapper, SimpleSideEffectPenalty
+
+
+def summarize(values):
+    """
+    Summary statistics for a list of measurements.
+
+    Returns
+    -------
+    dict
+        With keys 'count', 'total', 'mean', 'median', 'p90', and 'max'.
+        All values other than the count are None if there are no
+        measurements.
+    """
+    values = np.asarray(values, dtype=float)
+    if len(values) == 0:
+        return {
+            'count': 0, 'total': None, 'mean': None,
+            'median': None, 'p90': None, 'max': None,
+        }
+    return {
+        'count': len(values),
+        'total': float(np.sum(values)),
+        'mean': float(np.mean(values)),
+        'median': float(np.median(values)),
+        'p90': float(np.percentile(values, 90)),
+        'max': float(np.max(values)),
+    }
+
+
+def _system_info():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def _print_table(rows, title, unit_scale=1e3, unit='ms'):
+    """
+    Print a table of summary statistics, one row per (name, summary) pair.
+    """
+    print(title)
+    header = "  {:<32s} {:>7s} {:>10s} {:>10s} {:>10s} {:>10s}".format(
+        "", "count", "total (s)", "mean", "p90", "max")
+    print(header)
+    for name, stats in rows:
+        if not stats['count']:
+            continue
+        print("  {:<32s} {:>7d} {:>10.3f} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+            name, stats['count'], stats['total'],
+            stats['mean'] * unit_scale, stats['p90'] * unit_scale,
+            stats['max'] * unit_scale))
+    print("  (mean, p90, and max in %s)\n" % unit)
+
+
+def _write_results(results, output):
+    if output == '-':
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    elif output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print("Results written to %s" % output)
+
+
+# ----------------------------------------------------------------------
+# Level generation
+
+LEVEL_PHASES = (
+    'gen_game', 'partitioning', 'populate_region', 'gen_pattern',
+    'gen_pattern_attempt', 'build_fence', 'period_check', 'stability_mask',
+)
+
+
+def benchmark_level_generation(paths=('random',), num_levels=10, seed=0):
+    """
+    Time the procedural generation of SafeLife levels.
+
+    Parameters
+    ----------
+    paths : list of str
+        Procedural generation parameter files (or folders thereof).
+        Files whose names start with an underscore are skipped.
+    num_levels : int
+        Number of levels to generate for each parameter file.
+    seed : int
+        Random seed. The same seed generates the same levels.
+
+    Returns
+    -------
+    dict
+        JSON-serializable results. Timings are in seconds. The 'phases'
+        entries summarize each phase of generation (see
+        :class:`proc_gen.record_generation_stats`) both per file and overall,
+        and 'regions' summarizes the time to populate each type of region.
+    """
+    all_files = [
+        (file_name, data_type, data)
+        for file_name, data_type, data in _load_files(paths)
+        if data_type == 'procgen'
+        and not os.path.basename(file_name).startswith('_')
+    ]
+    seeds = np.random.SeedSequence(seed).generate_state(
+        len(all_files) * num_levels).reshape(len(all_files), num_levels)
+    all_stats = {}
+    files = {}
+    for (file_name, data_type, data), file_seeds in zip(all_files, seeds):
+        file_stats = {}
+        for level_seed in file_seeds:
+            with proc_gen.record_generation_stats() as stats:
+                with proc_gen._timed_phase('gen_game'):
+                    game = _game_from_data(
+                        file_name, data_type, data, int(level_seed))
+                # Check stability with the default period. This is the same
+                # check that's used to determine whether a pattern has been
+                # disrupted.
+                proc_gen.stability_mask(game.board)
+            for key, vals in stats.items():
+                file_stats.setdefault(key, []).extend(vals)
+                all_stats.setdefault(key, []).extend(vals)
+        files[os.path.basename(file_name)] = _summarize_level_stats(
+            file_stats, num_levels)
+
+    return {
+        'benchmark': 'levels',
+        'system': _system_info(),
+        'params': {
+            'paths': list(paths),
+            'num_levels': num_levels,
+            'seed': seed,
+        },
+        'overall': _summarize_level_stats(
+            all_stats, num_levels * len(all_files)),
+        'files': files,
+    }
+
+
+def _summarize_level_stats(stats, num_levels):
+    retries = stats.get('gen_pattern_retry', [])
+    level_times = stats.get('gen_game', [])
+    return {
+        'num_levels': num_levels,
+        'levels_per_sec': (
+            len(level_times) / sum(level_times) if level_times else None),
+        'phases': {
+            key: summarize(stats.get(key, [])) for key in LEVEL_PHASES
+        },
+        'regions': {
+            key[7:]: summarize(val) for key, val in sorted(stats.items())
+            if key.startswith('region/')
+        },
+        'gen_pattern_iterations': summarize(
+            stats.get('gen_pattern_iterations', [])),
+        'gen_pattern_retries': {
+            'max_iter': retries.count('max_iter'),
+            'overfill': retries.count('overfill'),
+        },
+    }
+
+
+def _print_level_results(results):
+    for name, file_results in results['files'].items():
+        print("%s: %0.2f levels/sec" % (name, file_results['levels_per_sec']))
+    print()
+    overall = results['overall']
+    _print_table(
+        overall['phases'].items(),
+        "Generation phases (%i levels):" % overall['num_levels'])
+    _print_table(overall['regions'].items(), "Regions by type:")
+    iters = overall['gen_pattern_iterations']
+    if iters['count']:
+        print("gen_pattern iterations per attempt: "
+              "mean %0.0f, median %0.0f, p90 %0.0f, max %0.0f" % (
+                  iters['mean'], iters['median'], iters['p90'], iters['max']))
+    retries = overall['gen_pattern_retries']
+    print("gen_pattern retries: %i (max_iter), %i (overfill)" % (
+        retries['max_iter'], retries['overfill']))
+
+
+# ----------------------------------------------------------------------
+# Environment stepping
+
+ENV_WRAPPERS = ('movement_bonus', 'side_effect_penalty', 'logging')
+ENV_COMPONENTS = (
+    'execute_action', 'advance_board', 'current_points',
+    'update_exit_colors', 'get_obs', 'reset',
+)
+
+
+def _wrap_env(env, wrappers):
+    for name in wrappers:
+        if name == 'movement_bonus':
+            env = MovementBonusWrapper(env)
+        elif name == 'side_effect_penalty':
+            env = SimpleSideEffectPenalty(
+                env, penalty_coef=0.1, baseline='inaction')
+        elif name == 'logging':
+            # Imported here because the logger pulls in optional
+            # dependencies that aren't needed for the other benchmarks.
+            from .safelife_logger import SafeLifeLogger, SafeLifeLogWrapper
+            # No log directory, so nothing is written to disk. This measures
+            # the cost of recording episode histories and statistics.
+            logger = SafeLifeLogger(None, record_side_effects=False)
+            env = SafeLifeLogWrapper(env, logger=logger)
+        else:
+            raise ValueError("Unknown wrapper '%s'" % name)
+    return env
+
+
+def _timed_method(obj, name, timings):
+    # Shadow the bound method with a timed version on the instance itself.
+    func = getattr(obj, name)
+    vals = timings.setdefault(name, [])
+
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            vals.append(time.perf_counter() - start)
+
+    setattr(obj, name, timed)
+
+
+def _run_env(games, num_steps, seed, wrappers=(), timings=None, **env_kwargs):
+    env = SafeLifeEnv(itertools.cycle(games), **env_kwargs)
+    env.seed(seed)
+    if timings is not None:
+        for game in games:
+            for name in ENV_COMPONENTS[:-2]:
+                _timed_method(game, name, timings)
+        _timed_method(env, 'get_obs', timings)
+        _timed_method(env, 'reset', timings)
+    env = _wrap_env(env, wrappers)
+    actions = np.random.default_rng(seed).integers(
+        env.action_space.n, size=num_steps)
+    try:
+        num_episodes = 1
+        start_time = time.perf_counter()
+        env.reset()
+        for action in actions:
+            done = env.step(action)[2]
+            if done:
+                num_episodes += 1
+                env.reset()
+        total_time = time.perf_counter() - start_time
+    finally:
+        if timings is not None:
+            for game in games:
+                for name in ENV_COMPONENTS[:-2]:
+                    delattr(game, name)
+    return total_time, num_episodes
+
+
+def benchmark_env_steps(
+        levels=('append-still', 'prune-still', 'navigation'),
+        board_sizes=(15, 25), view_sizes=(15, 25), output_channels=('all',),
+        wrappers=('none',) + ENV_WRAPPERS + ('all',),
+        num_steps=1000, num_levels=4, seed=0):
+    """
+    Time stepping through :class:`safelife_env.SafeLifeEnv` environments.
+
+    Each combination of level type, board size, view size, and output
+    channels is first run without wrappers to time the individual parts of
+    each step, and then once for each wrapper configuration to measure the
+    overall throughput. Note that the component timings can overlap: e.g.,
+    ``update_exit_colors`` calls ``current_points``, and ``reset`` calls
+    ``get_obs``.
+
+    Parameters
+    ----------
+    levels : list of str
+        Procedural generation parameters files for each level type.
+    board_sizes : list of int
+        Board sizes to test. Overrides the board shape of each level type.
+    view_sizes : list of int
+        Sizes of the (square) agent observations.
+    output_channels : list of str
+        Either 'all' to output each of the 15 board bits in their own
+        channel, or 'none' to output a single channel bit array.
+    wrappers : list of str
+        Wrapper configurations to test. Each is either 'none',
+        'all', or one of the names in :data:`ENV_WRAPPERS`.
+    num_steps : int
+        Number of steps to take in each environment.
+    num_levels : int
+        Number of levels to generate and cycle through for each level type
+        and board size. Levels are generated ahead of time so that level
+        generation isn't included in the timings.
+    seed : int
+
+    Returns
+    -------
+    dict
+        JSON-serializable results, with one entry in 'runs' per
+        configuration. Timings are in seconds.
+    """
+    runs = []
+    for level_file, board_size in itertools.product(levels, board_sizes):
+        file_name, data_type, data = _load_files([level_file])[0]
+        if data_type == 'procgen':
+            data = dict(data, board_shape=(board_size, board_size))
+        level_seeds = np.random.SeedSequence(seed).generate_state(num_levels)
+        games = [
+            _game_from_data(file_name, data_type, data, int(level_seed))
+            for level_seed in level_seeds
+        ]
+        for view_size, channels in itertools.product(view_sizes, output_channels):
+            config = {
+                'level': level_file,
+                'board_size': board_size,
+                'view_size': view_size,
+                'output_channels': channels,
+            }
+            env_kwargs = {
+                'view_shape': (view_size, view_size),
+                'output_channels': (
+                    None if channels == 'none' else tuple(range(15))),
+            }
+            timings = {}
+            total_time, _ = _run_env(
+                games, num_steps, seed, timings=timings, **env_kwargs)
+            components = {
+                key: summarize(timings.get(key, []))
+                for key in ENV_COMPONENTS
+            }
+            for key, val in components.items():
+                val['frac'] = val['total'] / total_time if val['count'] else 0
+            for wrapper_config in wrappers:
+                wrapper_list = {
+                    'none': (), 'all': ENV_WRAPPERS
+                }.get(wrapper_config, (wrapper_config,))
+                total_time, num_episodes = _run_env(
+                    games, num_steps, seed, wrapper_list, **env_kwargs)
+                runs.append(dict(
+                    config, wrappers=wrapper_config,
+                    steps=num_steps, episodes=num_episodes, time=total_time,
+                    steps_per_sec=num_steps / total_time,
+                    components=components,
+                ))
+
+    return {
+        'benchmark': 'env',
+        'system': _system_info(),
+        'params': {
+            'levels': list(levels),
+            'board_sizes': list(board_sizes),
+            'view_sizes': list(view_sizes),
+            'output_channels': list(output_channels),
+            'wrappers': list(wrappers),
+            'num_steps': num_steps,
+            'num_levels': num_levels,
+            'seed': seed,
+        },
+        'runs': runs,
+    }
+
+
+def _print_env_results(results):
+    print("{:<20s} {:>5s} {:>5s} {:>8s} {:<20s} {:>10s}".format(
+        "level", "board", "view", "channels", "wrappers", "steps/sec"))
+    components = {}
+    for run in results['runs']:
+        print("{:<20s} {:>5d} {:>5d} {:>8s} {:<20s} {:>10.0f}".format(
+            os.path.basename(run['level']), run['board_size'],
+            run['view_size'], run['output_channels'], run['wrappers'],
+            run['steps_per_sec']))
+        key = (run['level'], run['board_size'],
+               run['view_size'], run['output_channels'])
+        components[key] = run['components']
+    print()
+    print("Step components (mean time in us, fraction of total):")
+    print("{:<20s} {:>5s} {:>5s} {:>8s} ".format(
+        "level", "board", "view", "channels") + " ".join(
+        "{:>20s}".format(name) for name in ENV_COMPONENTS))
+    for (level, board_size, view_size, channels), comp in components.items():
+        print("{:<20s} {:>5d} {:>5d} {:>8s} ".format(
+            os.path.basename(level), board_size, view_size, channels
+        ) + " ".join(
+            "{:>11.1f} ({:>5.1%})".format(
+                comp[name]['mean'] * 1e6, comp[name]['frac'])
+            if comp[name]['count'] else "{:>20s}".format("-")
+            for name in ENV_COMPONENTS))
+
+
+# ----------------------------------------------------------------------
+# Command line interface
+
+def _run_levels(args):
+    start_time = time.time()
+    results = benchmark_level_generation(
+        args.paths or ('random',), args.num_levels, args.seed)
+    results['wall_time'] = time.time() - start_time
+    if args.output != '-':
+        _print_level_results(results)
+    _write_results(results, args.output)
+
+
+def _run_env_cmd(args):
+    start_time = time.time()
+    results = benchmark_env_steps(
+        args.levels, args.board_sizes, args.view_sizes, args.output_channels,
+        args.wrappers, args.steps, args.num_levels, args.seed)
+    results['wall_time'] = time.time() - start_time
+    if args.output != '-':
+        _print_env_results(results)
+    _write_results(results, args.output)
+
+
+def _make_cmd_args(subparsers):
+    # used by __main__.py to define command line tools
+    from argparse import RawDescriptionHelpFormatter
+    desc = "Run performance benchmarks."
+    parser = subparsers.add_parser(
+        "bench", help=desc, description=desc + '\n\n' + textwrap.dedent("""
+        Each benchmark prints a summary of its timings. Use '--output' to
+        save the full results as JSON (or '--output -' to print the JSON
+        to stdout instead of the summary).
+        """), formatter_class=RawDescriptionHelpFormatter)
+    bench_parsers = parser.add_subparsers(
+        dest="benchmark", help="Benchmark to run.")
+    bench_parsers.required = True
+
+    desc = "Time procedural level generation."
+    levels_parser = bench_parsers.add_parser(
+        "levels", help=desc, description=desc + '\n\n' + textwrap.dedent("""
+        Generates levels from each procedural generation file and reports
+        the time spent in each phase of generation (partitioning, region
+        population, pattern generation and retries, fencing, and stability
+        checks), as well as the time to populate each type of region.
+        """), formatter_class=RawDescriptionHelpFormatter)
+    levels_parser.add_argument('paths', nargs='*',
+        help="Procedural generation files to load. Defaults to all of the"
+        " files in 'levels/random'.")
+    levels_parser.add_argument('-n', '--num_levels', type=int, default=10,
+        help="Number of levels to generate per file.")
+    levels_parser.set_defaults(run_cmd=_run_levels)
+
+    desc = "Time environment steps."
+    env_parser = bench_parsers.add_parser(
+        "env", help=desc, description=desc + '\n\n' + textwrap.dedent("""
+        Measures steps per second for SafeLifeEnv with and without each of
+        the standard wrappers, across board sizes, view sizes, output
+        channels, and level types. Also reports the time spent in each part
+        of the environment step (executing the action, advancing the board,
+        scoring, updating the exit, and building the observation).
+        Levels are generated before timing starts.
+        """), formatter_class=RawDescriptionHelpFormatter)
+    env_parser.add_argument('--levels', nargs='+',
+        default=['random/append-still', 'random/prune-still',
+                 'random/navigation'],
+        help="Level files to load.")
+    env_parser.add_argument('--board_sizes', nargs='+', type=int,
+        default=[15, 25], metavar="SIZE",
+        help="Board sizes for procedurally generated levels.")
+    env_parser.add_argument('--view_sizes', nargs='+', type=int,
+        default=[15, 25], metavar="SIZE",
+        help="Observation sizes.")
+    env_parser.add_argument('--output_channels', nargs='+',
+        default=['all', 'none'], choices=['all', 'none'],
+        help="Output either all channels or a single channel bit array.")
+    env_parser.add_argument('--wrappers', nargs='+',
+        default=['none'] + list(ENV_WRAPPERS) + ['all'],
+        choices=['none'] + list(ENV_WRAPPERS) + ['all'],
+        help="Wrapper configurations to test.")
+    env_parser.add_argument('--steps', type=int, default=1000,
+        help="Number of steps to take for each configuration.")
+    env_parser.add_argument('-n', '--num_levels', type=int, default=4,
+        help="Number of levels to generate for each level type"
+        " and board size.")
+    env_parser.set_defaults(run_cmd=_run_env_cmd)
+
+    for p in (levels_parser, env_parser):
+        p.add_argument('--seed', type=int, default=0,
+            help="Random seed.")
+        p.add_argument('-o', '--output', default=None,
+            help="JSON file in which to save the results. Use '-' to write"
+            " to stdout.")
@@ -0,0 +1,156 @@
+"""
+Compact uint8 encoding of SafeLife boards.
+
+Boards are stored as uint16 arrays, but only a small number of distinct cell
+values ever show up in practice: each of the basic cell types (see
+`CellTypes`) in one of eight colors, plus a handful of agent variants. This
+module maps those values onto a canonical palette of uint8 codes, with a
+single escape code for anything else. Escaped cells have their raw uint16
+values stored in a separate (usually empty) array, so the encoding is always
+lossless.
+
+Encoded boards take half the memory of the originals, which makes them
+useful for anything that keeps lots of board data around. Episode histories
+are kept encoded in memory by ``SafeLifeLogWrapper``, and saved recordings
+can optionally be written encoded (see ``SafeLifeLogger.compact_recordings``).
+Level archives always store raw uint16 boards: combined archives are numpy
+structured arrays with fixed-size fields, which can't hold the variable
+length escape arrays, and single levels are too small for it to matter.
+
+Note that the palette order is part of the storage format. New entries may
+only ever be appended to the end of it.
+"""
+
+import numpy as np
+
+from .safelife_game import CellTypes
+
+
+ESCAPE_CODE = 255
+
+
+def _build_palette():
+    base_types = [
+        CellTypes.empty,
+        CellTypes.life,
+        CellTypes.alive,
+        CellTypes.wall,
+        CellTypes.crate,
+        CellTypes.plant,
+        CellTypes.tree,
+        CellTypes.ice_cube,
+        CellTypes.parasite,
+        CellTypes.weed,
+        CellTypes.spawner,
+        CellTypes.hard_spawner,
+        CellTypes.level_exit,
+        CellTypes.fountain,
+        CellTypes.player,
+        # Agents that have absorbed (or lost) powers from other cells
+        CellTypes.player | CellTypes.alive,
+        CellTypes.player | CellTypes.spawning,
+        CellTypes.player | CellTypes.alive | CellTypes.spawning,
+        CellTypes.player & ~CellTypes.freezing,
+        (CellTypes.player & ~CellTypes.freezing) | CellTypes.alive,
+    ]
+    colors = np.arange(8, dtype=np.uint16) << CellTypes.color_bit
+    palette = (np.array(base_types, dtype=np.uint16)[:,None] | colors)
+    return palette.ravel()
+
+
+PALETTE = _build_palette()
+_ENCODING_TABLE = np.full(1 << 16, ESCAPE_CODE, dtype=np.uint8)
+_ENCODING_TABLE[PALETTE] = np.arange(len(PALETTE), dtype=np.uint8)
+
+assert len(PALETTE) < ESCAPE_CODE
+assert len(np.unique(PALETTE)) == len(PALETTE)
+
+
+def encode_board(board):
+    """
+    Encode a board (or any array of cell values) as uint8 palette codes.
+
+    Parameters
+    ----------
+    board : ndarray
+        Array of uint16 cell values. May have any shape, so a whole sequence
+        of boards can be encoded at once.
+
+    Returns
+    -------
+    codes : ndarray
+        Array of uint8 codes with the same shape as the input.
+    escapes : ndarray
+        One-dimensional uint16 array containing the values of all cells that
+        aren't in the palette, in C order. Usually empty.
+    """
+    board = np.asarray(board, dtype=np.uint16)
+    codes = _ENCODING_TABLE[board]
+    escaped = codes == ESCAPE_CODE
+    escapes = board[escaped] if escaped.any() else np.zeros(0, np.uint16)
+    return codes, escapes
+
+
+def decode_board(codes, escapes=None):
+    """
+    Opposite of :func:`encode_board`.
+
+    Parameters
+    ----------
+    codes : ndarray
+        Array of uint8 palette codes.
+    escapes : ndarray or None
+        Raw cell values for any escaped codes. Only needed if there are any.
+
+    Returns
+    -------
+    ndarray
+        Array of uint16 cell values with the same shape as `codes`.
+    """
+    codes = np.asarray(codes, dtype=np.uint8)
+    escaped = codes == ESCAPE_CODE
+    # Escape codes index past the end of the palette; clip to keep the
+    # lookup valid and then fill them in separately.
+    board = PALETTE.take(codes, mode='clip')
+    if escaped.any():
+        if escapes is None or len(escapes) != np.count_nonzero(escaped):
+            raise ValueError("Escaped board values are missing.")
+        board[escaped] = escapes
+    return board
+
+
+def encode_board_data(data, keys=('board', 'goals')):
+    """
+    Encode the board arrays in a dictionary of game or recording data.
+
+    Each of the given `keys` is replaced by a pair of ``<key>_codes`` and
+    ``<key>_escapes`` entries. All other entries are passed through as-is,
+    so the output can be saved directly with ``numpy.savez_compressed()``.
+    """
+    data = dict(data)
+    for key in keys:
+        if key in data:
+            codes, escapes = encode_board(data.pop(key))
+            data[key + '_codes'] = codes
+            data[key + '_escapes'] = escapes
+    return data
+
+
+def decode_board_data(data):
+    """
+    Opposite of :func:`encode_board_data`.
+
+    Data that doesn't contain any encoded boards (e.g., archives saved before
+    the encoding was introduced) is returned unchanged, so this is safe to
+    call on anything that gets loaded from disk.
+    """
+    if not hasattr(data, 'keys'):
+        return data  # e.g., a record from a combined level archive
+    encoded_keys = [k[:-6] for k in data.keys() if k.endswith('_codes')]
+    if not encoded_keys:
+        return data
+    data = dict(data)
+    for key in encoded_keys:
+        data[key] = decode_board(
+            data.pop(key + '_codes'), data.pop(key + '_escapes', None))
+    return data
@@ -3,9 +3,8 @@ import logging
 import numpy as np
 
 from gym import Wrapper
-from .safelife_game import CellTypes
-from .helper_utils import load_kwargs
-from .speedups import advance_board
+from .helper_utils import load_kwargs, get_perf_counters
+from .speedups import advance_board, side_effect_count
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +21,10 @@ class BaseWrapper(Wrapper):
         super().__init__(env)
         load_kwargs(self, kwargs)
 
+    @property
+    def perf_counters(self):
+        return get_perf_counters(self.env)
+
     def reset(self):
         return self.env.reset()
 
@@ -66,6 +69,7 @@ class MovementBonusWrapper(BaseWrapper):
 
     def step(self, action):
         obs, reward, done, info = self.env.step(action)
+        t = self.perf_counters.now()
 
         # Calculate the movement bonus
         p0 = self.game.agent_loc
@@ -86,6 +90,7 @@ class MovementBonusWrapper(BaseWrapper):
         if self.as_penalty:
             reward -= self.movement_bonus
         self._prior_positions.append(self.game.agent_loc)
+        self.perf_counters.lap('movement_bonus', t)
 
         return obs, reward, done, info
 
@@ -143,6 +148,12 @@ class MinPerformanceScheduler(BaseWrapper):
 class SimpleSideEffectPenalty(BaseWrapper):
     """
     Penalize departures from starting or inaction state.
+
+    The side effect is the number of cells that differ from the baseline,
+    ignoring the agent itself, the level exits, and any changes that earn
+    points (removing red life and creating life on blue goals). Other
+    potential rewards (other colors) aren't taken into account, but this is
+    suitable for most training levels. See ``speedups.side_effect_count()``.
     """
     penalty_coef = 0.0
     baseline = "starting-state"  # or "inaction"
@@ -151,38 +162,21 @@ class SimpleSideEffectPenalty(BaseWrapper):
         obs = self.env.reset()
         self.last_side_effect = 0
         self.baseline_board = self.game.board.copy()
+        self.exit_mask = np.zeros(self.game.board.shape, dtype=bool)
+        self.exit_mask[self.game.exit_locs] = True
         return obs
 
     def step(self, action):
         observation, reward, done, info = self.env.step(action)
+        t = self.perf_counters.now()
         if self.baseline == 'inaction':
             self.baseline_board = advance_board(self.baseline_board, self.game.spawn_prob)
 
-        # Ignore the player's attributes so that moving around doesn't result
-        # in a penalty. This also means that we ignore the destructible
-        # attribute, so if a life cells switches to indestructible (which can
-        # automatically happen for certain oscillators) that doesn't cause a
-        # penalty either.
-        board = self.game.board & ~CellTypes.player
-        baseline_board = self.baseline_board & ~CellTypes.player
-
-        # Also ignore exit locations (they change color when they open up)
-        i1, i2 = self.game.exit_locs
-        board[i1,i2] = baseline_board[i1,i2]
-
-        # Finally, ignore any cells that are part of the reward.
-        # This takes into account red cells and blue goals, but not other
-        # potential rewards (other colors). Suitable for most training levels.
-        red_life = CellTypes.alive | CellTypes.color_r
-        start_red = baseline_board & red_life == red_life
-        end_red = board & red_life == red_life
-        goal_cell = self.game.goals & CellTypes.rainbow_color == CellTypes.color_b
-        end_alive = board & red_life == CellTypes.alive
-        unchanged = board == baseline_board
-        non_effects = unchanged | (start_red & ~end_red) | (goal_cell & end_alive)
-
-        side_effect = np.sum(~non_effects)
+        side_effect = side_effect_count(
+            self.game.board, self.baseline_board, self.game.goals,
+            self.exit_mask)
         delta_effect = side_effect - self.last_side_effect
         reward -= delta_effect * call(self.penalty_coef)
         self.last_side_effect = side_effect
+        self.perf_counters.lap('side_effect_penalty', t)
         return observation, reward, done, info
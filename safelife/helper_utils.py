@@ -1,4 +1,7 @@
+import time
 import inspect
+from collections import defaultdict
+
 import numpy as np
 import scipy.signal
 
@@ -85,3 +88,67 @@ def load_kwargs(self, kwargs):
             setattr(self, key, val)
         else:
             raise ValueError("Unrecognized parameter: '%s'" % (key,))
+
+
+class PerfCounters(object):
+    """
+    Low-overhead cumulative timers and counters for instrumenting hot paths.
+
+    Timers are used by chaining calls to :meth:`lap`::
+
+        t = counters.now()
+        do_something()
+        t = counters.lap('something', t)
+        do_something_else()
+        counters.lap('something_else', t)
+
+    If not enabled, all methods return immediately without doing anything.
+
+    Attributes
+    ----------
+    enabled : bool
+    times : dict
+        Cumulative time (in seconds) for each timer key.
+    counts : dict
+        Number of laps for each timer key, plus any additional counters.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        self.times = defaultdict(float)
+        self.counts = defaultdict(int)
+
+    def now(self):
+        return time.perf_counter() if self.enabled else None
+
+    def lap(self, key, start):
+        """
+        Add the time elapsed since `start` to timer `key`.
+
+        Returns the current time, which can be used to start the next lap.
+        """
+        if not self.enabled:
+            return None
+        t = time.perf_counter()
+        self.times[key] += t - start
+        self.counts[key] += 1
+        return t
+
+    def count(self, key, n=1):
+        if self.enabled:
+            self.counts[key] += n
+
+
+_disabled_perf_counters = PerfCounters(enabled=False)
+
+
+def get_perf_counters(env):
+    """
+    Get the performance counters of a (possibly wrapped) environment.
+
+    Environments that don't keep performance counters get a shared, disabled
+    set of counters instead, so that wrappers can always use the result.
+    """
+    return getattr(env, 'perf_counters', _disabled_perf_counters)
@@ -3,6 +3,7 @@ import sys
 import glob
 import textwrap
 import time
+import itertools
 from types import SimpleNamespace
 from collections import defaultdict, deque
 import numpy as np
@@ -14,6 +15,7 @@ from .keyboard_input import KEYS, getch
 from .side_effects import side_effect_score
 from .level_iterator import SafeLifeLevelIterator
 from .random import set_rng
+from .board_codec import encode_board_data
 
 
 COMMAND_KEYS = {
@@ -68,10 +70,200 @@ SAVE_RECORDING = '*'
 START_SHELL = '\\'
 HELP_KEYS = ('?', '/')
 UNDO_KEY = 'z'
+REDO_KEY = 'Z'
 
 MAX_HISTORY_LENGTH = 10000
 
 
+class GameHistory(object):
+    """
+    Memory-efficient sequence of game states, used for undo and recordings.
+
+    Rather than storing a full copy of the game at every step, each frame only
+    stores the cells that changed since the previous frame, along with their
+    old values so that the step can be undone cheaply. A full keyframe is
+    stored every `keyframe_interval` frames (and whenever the board changes
+    shape) so that any frame can be reconstructed without replaying the
+    entire history.
+
+    Indexing the history returns a full snapshot of the corresponding frame,
+    in the same format as ``game.serialize()`` plus any extra info that was
+    passed to ``append()``.
+
+    Parameters
+    ----------
+    maxlen : int
+        Maximum number of frames to keep. Older frames are discarded.
+    keyframe_interval : int
+    """
+    board_keys = ('board', 'goals')
+
+    def __init__(self, maxlen=MAX_HISTORY_LENGTH, keyframe_interval=100):
+        self.maxlen = maxlen
+        self.keyframe_interval = keyframe_interval
+        self.clear()
+
+    def clear(self):
+        self._frames = deque()
+        self._redo_frames = []
+        self._current = {}  # Full board arrays for the last frame
+        self._since_keyframe = 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    def append(self, game, **info):
+        """
+        Add the current state of the game to the history.
+
+        Any keyword arguments get stored alongside the game state.
+        Clears any frames that could otherwise be restored with ``redo()``.
+        """
+        boards = {
+            key: getattr(game, key) for key in self.board_keys
+            if getattr(game, key, None) is not None
+        }
+        current = self._current
+        needs_keyframe = (
+            not self._frames or
+            self._since_keyframe >= self.keyframe_interval or
+            boards.keys() != current.keys() or
+            any(val.shape != current[key].shape for key, val in boards.items())
+        )
+        frame = {
+            'info': dict(
+                info, orientation=game.orientation, agent_loc=game.agent_loc),
+            'keyframe': None,
+            'delta': None,
+        }
+        if needs_keyframe:
+            frame['keyframe'] = game.serialize()
+            self._current = {key: val.copy() for key, val in boards.items()}
+        else:
+            frame['delta'] = delta = {}
+            for key, val in boards.items():
+                old_val = current[key]
+                idx = np.flatnonzero(val != old_val).astype(np.int32)
+                new_cells = val.flat[idx]
+                delta[key] = (idx, old_val.flat[idx], new_cells)
+                old_val.flat[idx] = new_cells
+        self._push(frame)
+        self._redo_frames.clear()
+
+    def _push(self, frame):
+        self._frames.append(frame)
+        if len(self._frames) > self.maxlen:
+            # Turn the new first frame into a keyframe before dropping the
+            # old one, since its deltas won't have anything to apply to.
+            first = self._frames.popleft()
+            second = self._frames[0]
+            if second['keyframe'] is None:
+                keyframe = first['keyframe']
+                for key, (idx, old_cells, new_cells) in second['delta'].items():
+                    keyframe[key].flat[idx] = new_cells
+                keyframe.update(second['info'])
+                second['keyframe'] = keyframe
+                second['delta'] = None
+        self._count_since_keyframe()
+
+    def _count_since_keyframe(self):
+        n = 0
+        for frame in reversed(self._frames):
+            if frame['keyframe'] is not None:
+                break
+            n += 1
+        self._since_keyframe = n
+
+    def _normalize_index(self, idx):
+        n = len(self._frames)
+        if not -n <= idx < n:
+            raise IndexError("history index out of range")
+        return idx % n
+
+    def __getitem__(self, idx):
+        idx = self._normalize_index(idx)
+        if idx < len(self._frames) - 1:
+            return next(self.iter_frames(idx))
+        # The boards for the last frame are always kept up to date, so
+        # there's no need to replay any deltas.
+        first_key = idx
+        while self._frames[first_key]['keyframe'] is None:
+            first_key -= 1
+        snapshot = self._frames[first_key]['keyframe'].copy()
+        snapshot.update(self._frames[idx]['info'])
+        snapshot.update({key: val.copy() for key, val in self._current.items()})
+        return snapshot
+
+    def info(self, idx):
+        """Extra info stored with a frame. Doesn't reconstruct the board."""
+        return self._frames[idx]['info']
+
+    def iter_frames(self, start=0):
+        """
+        Iterate over full snapshots of all frames from `start` onwards.
+
+        Each frame only needs to be reconstructed once, so this is much more
+        efficient than indexing each frame separately.
+        """
+        start = self._normalize_index(start)
+        first_key = start
+        while self._frames[first_key]['keyframe'] is None:
+            first_key -= 1
+        frames = itertools.islice(self._frames, first_key, None)
+        for n, frame in enumerate(frames, first_key):
+            if frame['keyframe'] is not None:
+                snapshot = frame['keyframe'].copy()
+                boards = {
+                    key: snapshot[key].copy() for key in self.board_keys
+                    if key in snapshot
+                }
+            else:
+                for key, (idx, old_cells, new_cells) in frame['delta'].items():
+                    boards[key].flat[idx] = new_cells
+            if n >= start:
+                snapshot.update(frame['info'])
+                snapshot.update({key: val.copy() for key, val in boards.items()})
+                yield snapshot.copy()
+
+    def pop(self):
+        """
+        Remove the last frame. It can be restored with ``redo()``.
+        """
+        frame = self._frames.pop()
+        self._redo_frames.append(frame)
+        if frame['delta'] is not None:
+            for key, (idx, old_cells, new_cells) in frame['delta'].items():
+                self._current[key].flat[idx] = old_cells
+        elif self._frames:
+            # The current boards belonged to the removed keyframe, so the
+            # new last frame has to be rebuilt.
+            last = next(self.iter_frames(-1))
+            self._current = {
+                key: last[key] for key in self.board_keys if key in last}
+        self._count_since_keyframe()
+
+    def redo(self):
+        """
+        Restore the last frame removed by ``pop()``.
+
+        Returns False if there is nothing to restore.
+        """
+        if not self._redo_frames:
+            return False
+        frame = self._redo_frames.pop()
+        if frame['delta'] is not None:
+            for key, (idx, old_cells, new_cells) in frame['delta'].items():
+                self._current[key].flat[idx] = new_cells
+        else:
+            keyframe = frame['keyframe']
+            self._current = {
+                key: keyframe[key].copy() for key in self.board_keys
+                if key in keyframe
+            }
+        self._push(frame)
+        return True
+
+
 class GameLoop(object):
     """
     Play the game interactively. For humans.
@@ -83,10 +275,12 @@ class GameLoop(object):
     print_only = False
     relative_controls = True
     recording_directory = "plays"  # in the current working directory
+    compact_recordings = False  # save boards with board_codec's encoding
 
     def __init__(self, level_generator):
         self.level_generator = level_generator
         self.loaded_levels = []
+        self.terminal_board = render_text.TerminalBoard()
         self.state = SimpleNamespace(
             screen="INTRO",
             game=None,
@@ -97,7 +291,7 @@ class GameLoop(object):
             level_start_points=0,
             total_undos=0,
             edit_mode=0,
-            history=deque(maxlen=MAX_HISTORY_LENGTH),
+            history=GameHistory(),
             side_effects=None,
             total_side_effects=defaultdict(lambda: 0),
             message="",
@@ -139,32 +333,35 @@ class GameLoop(object):
         game = state.game
         if game is None:
             return
-        snapshot = game.serialize()
-        snapshot['num_steps'] = game.num_steps
-        snapshot['total_steps'] = state.total_steps
-        snapshot['total_points'] = state.total_points
-        snapshot['is_restart'] = restart
-        state.history.append(snapshot)
+        state.history.append(
+            game,
+            num_steps=game.num_steps,
+            total_steps=state.total_steps,
+            total_points=state.total_points,
+            is_restart=restart,
+        )
 
     def save_recording(self):
+        history = self.state.history
+        if not len(history):
+            return
+        start = len(history) - 1
+        while start > 0 and not history.info(start)['is_restart']:
+            start -= 1
         boards = []
         goals = []
         orientations = []
         agent_locs = []
-        for snapshot in reversed(self.state.history):
+        for snapshot in history.iter_frames(start):
             boards.append(snapshot['board'])
             goals.append(snapshot['goals'])
             orientations.append(snapshot['orientation'])
             agent_locs.append(snapshot['agent_loc'])
-            if snapshot['is_restart']:
-                break
-        if not boards:
-            return
         data = {
-            'board': boards[::-1],
-            'goals': goals[::-1],
-            'orientation': orientations[::-1],
-            'agent_loc': agent_locs[::-1],
+            'board': boards,
+            'goals': goals,
+            'orientation': orientations,
+            'agent_loc': agent_locs,
         }
 
         pattern = os.path.join(self.recording_directory, 'rec-*.npz')
@@ -179,6 +376,9 @@ class GameLoop(object):
         fname = 'rec-{:03d}.npz'.format(n)
         next_recording_name = os.path.join(self.recording_directory, fname)
 
+        if self.compact_recordings:
+            data = encode_board_data(data)
+
         os.makedirs(self.recording_directory, exist_ok=True)
         np.savez_compressed(next_recording_name, **data)
         return next_recording_name
@@ -218,13 +418,23 @@ class GameLoop(object):
         if len(history) < 2 or game is None:
             return False
         history.pop()
-        snapshot = history[-1]
+        self._restore_frame(history[-1])
+        self.state.total_undos += 1
+        return True
+
+    def redo(self):
+        history = self.state.history
+        if self.state.game is None or not history.redo():
+            return False
+        self._restore_frame(history[-1])
+        return True
+
+    def _restore_frame(self, snapshot):
+        game = self.state.game
         game.deserialize(snapshot, as_initial_state=False)
         game.num_steps = snapshot['num_steps']
         self.state.total_points = snapshot['total_points']
         self.state.total_steps = snapshot['total_steps']
-        self.state.total_undos += 1
-        return True
 
     def handle_input(self, key):
         state = self.state
@@ -286,6 +496,10 @@ class GameLoop(object):
             state.last_command = "UNDO"
             is_repeatable_key = True
             self.undo()
+        elif key == REDO_KEY and state.screen == "GAME":
+            state.last_command = "REDO"
+            is_repeatable_key = True
+            self.redo()
         elif state.screen == "GAME":
             game = state.game
             if state.edit_mode and key in EDIT_KEYS:
@@ -419,7 +633,7 @@ class GameLoop(object):
     arrows:  movement            c:  create / destroy
     return:  wait                R:  restart level
 
-    z:  undo
+    z:  undo                     Z:  redo
     ~:  toggle edit mode
     *:  save recording
 
@@ -524,24 +738,37 @@ class GameLoop(object):
         return output
 
     def render_text(self):
-        if not self.print_only:
-            output = "\x1b[H\x1b[J"
-        else:
-            output = "\n"
         state = self.state
+        in_game = state.screen in ("GAME", "CONFIRM_SAVE") and state.game is not None
+        if self.print_only:
+            output = "\n"
+        elif in_game:
+            # Don't clear the screen. Instead, clear each line as it's written
+            # so that only the changed parts of the board need to be redrawn.
+            output = "\x1b[H"
+        else:
+            output = "\x1b[H\x1b[J"
+            self.terminal_board.reset()
         if state.screen == "INTRO":
             output += self.intro_text
         elif state.screen == "HELP":
             output += self.help_text
-        elif state.screen in ("GAME", "CONFIRM_SAVE") and state.game is not None:
+        elif in_game:
             game = state.game
             game.update_exit_colors()
-            output += self.above_game_message(styled=True) + '\n'
-            output += render_text.render_game(
+            header = self.above_game_message(styled=True)
+            view = render_text.game_view(
                 state.game, self.effective_view_size, state.edit_mode)
-            output += "\n"
-            if not self.print_only:
-                output += self.below_game_message()
+            if self.print_only:
+                output += header + '\n' + render_text.render_board(*view) + '\n'
+            else:
+                output += header.replace('\n', '\x1b[K\n') + '\x1b[K\n'
+                row = header.count('\n') + 2
+                output += self.terminal_board.draw(*view, row=row)
+                # Move below the board and clear everything after it.
+                output += "\x1b[%i;1H\x1b[K\n" % (row + view[0].shape[0] + 2)
+                output += self.below_game_message().replace('\n', '\x1b[K\n')
+                output += "\x1b[J"
         elif state.screen == "LEVEL SUMMARY" and state.side_effects is not None:
             output += self.level_summary_message()
         elif state.screen == "GAMEOVER":
@@ -567,8 +794,10 @@ class GameLoop(object):
             self.handle_input(getch())
             if self.state.last_command == "SHELL":
                 self.handle_shell()
+                self.terminal_board.reset()
             elif self.state.last_command == "SAVE AS":
                 self.handle_save_as()
+                self.terminal_board.reset()
             self.render_text()
 
     def render_gl(self):
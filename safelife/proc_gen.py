@@ -2,11 +2,14 @@
 Procedural generation of SafeLife levels.
 """
 
+import time
+from contextlib import contextmanager
+
 import numpy as np
-from scipy import ndimage, signal
+from scipy import ndimage
 
 from .safelife_game import CellTypes, SafeLifeGame
-from .random import coinflip, get_rng
+from .random import get_rng
 from . import speedups
 
 import logging
@@ -23,6 +26,69 @@ COLORS = {
     'white': CellTypes.rainbow_color
 }
 
+# Ratio between the temperatures of successive chains in multi-chain
+# pattern generation.
+CHAIN_TEMPERATURE_STEP = 1.1
+
+_generation_stats = None  # see `record_generation_stats`
+
+
+class record_generation_stats(object):
+    """
+    Context manager to record profiling data for level generation.
+
+    Used by the level generation benchmark (``safelife bench levels``).
+    While active, each phase of level generation appends its duration
+    (in seconds) to a list in the :attr:`stats` dictionary. Recorded keys
+    include:
+
+    - ``partitioning``: time spent in :func:`make_partioned_regions`.
+    - ``populate_region`` and ``region/<name>``: time spent filling in each
+      region, both in total and keyed by region type.
+    - ``gen_pattern``: time to add each pattern layer, including retries.
+    - ``gen_pattern_attempt`` and ``gen_pattern_iterations``: time and number
+      of annealing iterations for each individual call to
+      :func:`speedups.gen_pattern`.
+    - ``gen_pattern_retry``: the reason (``'max_iter'`` or ``'overfill'``)
+      for each retried pattern.
+    - ``build_fence``, ``period_check``, and ``stability_mask``: fencing,
+      finding the oscillating cells of each new pattern, and stability
+      checks.
+
+    When not active, the overhead of the instrumentation is negligible.
+    """
+    def __init__(self):
+        self.stats = {}
+
+    def __enter__(self):
+        global _generation_stats
+        self.old_stats = _generation_stats
+        _generation_stats = self.stats
+        return self.stats
+
+    def __exit__(self, *args):
+        global _generation_stats
+        _generation_stats = self.old_stats
+
+
+def _record_stat(key, value):
+    if _generation_stats is not None:
+        _generation_stats.setdefault(key, []).append(value)
+
+
+@contextmanager
+def _timed_phase(*keys):
+    if _generation_stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        delta = time.perf_counter() - start
+        for key in keys:
+            _record_stat(key, delta)
+
 
 def make_partioned_regions(shape, alpha=1.0, max_regions=5, min_regions=2):
     """
@@ -49,48 +115,8 @@ def make_partioned_regions(shape, alpha=1.0, max_regions=5, min_regions=2):
         The output array is filled with different integers for each of the
         different regions. Zero values indicate border areas between regions.
     """
-    ring = np.array([[1,1,1],[1,0,1],[1,1,1]], dtype=np.int16)
-    adjacent = np.array([  # Diagonals don't count as adjacent
-        [-1,0,0,1],
-        [0,-1,1,0]], dtype=np.int16).T
-    nearby = np.meshgrid([-2,-1,0,1,2], [-2,-1,0,1,2])
-
-    board = np.zeros(shape, dtype=np.int16)
-    perimeters = [{
-        (i, j) for i, j in zip(*np.nonzero(board == 0))
-    }]
-    exclusions = [set()]
-    while sum(len(p) for p in perimeters) > 0:
-        weights = np.array([len(p) for p in perimeters], dtype=float)
-        weights[0] = min(alpha, weights[0]) if len(weights) <= max_regions else 1e-10
-        if len(weights) <= min_regions:
-            weights[1:] = 1e-10
-        weights /= np.sum(weights)
-        k = get_rng().choice(len(perimeters), p=weights)
-        plist = list(perimeters[k])
-        i, j = plist[get_rng().choice(len(plist))]
-        perimeters[0].discard((i, j))
-        perimeters[k].discard((i, j))
-        if (i, j) in exclusions[k]:
-            continue
-        exclusions[0].add((i,j))
-        exclusions[k].add((i,j))
-        b = board[(i+nearby[0]) % shape[0], (j+nearby[1]) % shape[1]]
-        b[2,2] = k or -1
-        num_neighbors = signal.convolve2d(b != 0, ring, mode='valid')
-        num_foreign = signal.convolve2d((b > 0) & (b != k), ring, mode='valid')
-        if ((num_foreign > 0) & (num_neighbors > 2)).any() or num_foreign[1,1] > 0:
-            continue
-        # Add to the board
-        if k == 0:
-            k = len(perimeters)
-            perimeters.append(set())
-            exclusions.append(set())
-        board[i, j] = k
-        for i2, j2 in (adjacent + (i, j)) % shape:
-            if board[i2, j2] == 0:
-                perimeters[k].add((i2, j2))
-    return board
+    return speedups.make_partioned_regions(
+        shape, alpha, max_regions, min_regions)
 
 
 def build_fence(mask, shuffle=True):
@@ -106,48 +132,16 @@ def build_fence(mask, shuffle=True):
     mask : ndarray, dtype int
         Binary array denoting regions around which to build fences (1) and
         everything else.
+    shuffle : bool
+        If true, edge cells are visited in a random order drawn from the
+        shared random generator.
 
     Returns
     -------
     fence : ndarray, dtype int
         Binary array indicating fence locations.
     """
-    mask = mask.astype(np.int32)
-    _i = np.array([-1,-1,-1,0,0,0,1,1,1], dtype=np.int32)
-    _j = np.array([-1,0,1,-1,0,1,-1,0,1], dtype=np.int32)
-    neighbors = ndimage.convolve(mask, np.ones((3,3)), mode='wrap')
-    fence = np.zeros_like(mask)
-    edge_i, edge_j = np.nonzero(mask * neighbors % 9)
-    neighbors *= (1 - mask)
-    if edge_i.size == 0:
-        return fence
-
-    # First pass. Add in fence where needed.
-    if shuffle:
-        k = get_rng().permutation(len(edge_i))
-        edge_i = edge_i[k]
-        edge_j = edge_j[k]
-    for i, j in zip(edge_i, edge_j):
-        n_i = (i + _i) % mask.shape[0]
-        n_j = (j + _j) % mask.shape[1]
-        if (neighbors[n_i, n_j] >= 3).any():
-            neighbors[n_i, n_j] -= 1
-            fence[i, j] += 1
-
-    # Second pass. Remove fence where unneeded.
-    fence_i, fence_j = np.nonzero(fence)
-    if shuffle:
-        k = get_rng().permutation(len(fence_i))
-        fence_i = fence_i[k]
-        fence_j = fence_j[k]
-    for i, j in zip(fence_i, fence_j):
-        n_i = (i + _i) % mask.shape[0]
-        n_j = (j + _j) % mask.shape[1]
-        if (neighbors[n_i, n_j] < 2).all():
-            neighbors[n_i, n_j] += 1
-            fence[i, j] -= 1
-
-    return fence
+    return speedups.build_fence(mask, shuffle)
 
 
 def _fix_random_values(val):
@@ -185,13 +179,35 @@ def _gen_pattern(board, mask, seeds=None, num_retries=10, **kwargs):
     try:
         min_fill = kwargs.setdefault('min_fill', 0.2)
         max_fill = kwargs.pop('max_fill', min_fill * 2)
-        new_board = speedups.gen_pattern(board, mask, seeds=seeds, **kwargs)
+        num_chains = kwargs.pop('num_chains', 1)
+        gen_kwargs = kwargs.copy()
+        if num_chains > 1:
+            # Run several chains in parallel, each at a slightly higher
+            # temperature than the last, and each with its own random state.
+            temperature = gen_kwargs.get('temperature', 0.5)
+            gen_kwargs['temperature'] = temperature * (
+                CHAIN_TEMPERATURE_STEP ** np.arange(num_chains))
+            gen_kwargs['bit_generators'] = [
+                np.random.PCG64(seed) for seed in
+                get_rng().integers(2**63, size=num_chains)]
+        call_stats = {}
+        if _generation_stats is not None:
+            gen_kwargs['stats'] = call_stats
+        try:
+            with _timed_phase('gen_pattern_attempt'):
+                new_board = speedups.gen_pattern(
+                    board, mask, seeds=seeds, max_fill=max_fill, **gen_kwargs)
+        finally:
+            if 'num_iter' in call_stats:
+                _record_stat('gen_pattern_iterations', call_stats['num_iter'])
         working_area = mask & speedups.NEW_CELL_MASK
         new_cells = new_board != 0
         fill_ratio = np.sum(new_cells * working_area) / np.sum(working_area)
         if fill_ratio > max_fill:
             if num_retries > 0:
+                _record_stat('gen_pattern_retry', 'overfill')
                 kwargs['max_fill'] = 1.07 * max_fill
+                kwargs['num_chains'] = num_chains
                 return _gen_pattern(board, mask, seeds, num_retries-1, **kwargs)
             else:
                 logger.debug("gen_pattern produced an overfull pattern. "
@@ -202,8 +218,10 @@ def _gen_pattern(board, mask, seeds=None, num_retries=10, **kwargs):
         return board
     except speedups.MaxIterException:
         if num_retries > 0:
+            _record_stat('gen_pattern_retry', 'max_iter')
             kwargs['min_fill'] *= 0.94
             kwargs['max_fill'] = max_fill
+            kwargs['num_chains'] = num_chains
             return _gen_pattern(board, mask, seeds, num_retries-1, **kwargs)
         else:
             logger.debug("gen_pattern did not converge! "
@@ -213,6 +231,37 @@ def _gen_pattern(board, mask, seeds=None, num_retries=10, **kwargs):
         return board
 
 
+# Layer parameters that are applied to a random subset of cells.
+_COINFLIP_KEYS = (
+    'fences', 'spawners', 'movable_walls', 'movable_trees', 'hardened_life',
+    'fountains',
+)
+
+
+def _layer_coinflips(layer, shape):
+    """
+    Draw all of the random cell masks needed for a single layer at once.
+
+    Returns a dictionary mapping each of the layer's (non-zero) coinflip
+    parameters to a boolean array of the given shape.
+    """
+    keys = [key for key in _COINFLIP_KEYS if layer.get(key, 0) > 0]
+    if not keys:
+        return {}
+    rand = get_rng().random((len(keys),) + tuple(shape))
+    return {key: rand[k] < layer[key] for k, key in enumerate(keys)}
+
+
+def _wrapped_dilate(mask, radius):
+    """
+    Expand the true values of a boolean mask by `radius` cells in each
+    direction, wrapping around the edges of the board.
+    """
+    if radius <= 0:
+        return mask.astype(bool)
+    return ndimage.maximum_filter(mask, size=2*radius+1, mode='wrap')
+
+
 def _make_lattice(h, w, col_skip, row_skip, stagger):
     rows = np.arange(h)[:, np.newaxis]
     cols = np.arange(w)[np.newaxis, :]
@@ -255,6 +304,9 @@ def populate_region(mask, layer_params):
         oscillators or still lifes. Note that the pattern can have period zero
         to produce unstable patterns, and additional *max_fill* and
         *num_retries* values can be passed in to reject certain results.
+        Setting *num_chains* larger than one runs several generation chains
+        in parallel at increasing temperatures, which reduces the chance
+        that generation is slow or fails to converge.
     tree_lattice : bool
         If True, a lattice of tree objects is added to the region.
         Tree lattices make it so that disrupted cells tend to grown chaotically
@@ -282,8 +334,7 @@ def populate_region(mask, layer_params):
     from .speedups import (
         NEW_CELL_MASK, CAN_OSCILLATE_MASK, INCLUDE_VIOLATIONS_MASK)
 
-    border = ndimage.maximum_filter(mask, size=3, mode='wrap') ^ mask
-    interior = ndimage.minimum_filter(mask, size=3, mode='wrap')
+    border = _wrapped_dilate(mask, 1) ^ mask
     gen_mask = mask * (
         NEW_CELL_MASK |
         CAN_OSCILLATE_MASK |
@@ -304,24 +355,25 @@ def populate_region(mask, layer_params):
                 "'layer_params' should be a list of parameter dictionaries.")
         layer = _fix_random_values(layer)
         old_board = board.copy()
-        gen_mask0 = gen_mask.copy()
-        interior = ndimage.minimum_filter(
-            gen_mask & NEW_CELL_MASK > 0, size=3, mode='wrap')
         color = COLORS.get(layer.get('color'), 0)
-
-        fence_frac = layer.get('fences', 0.0)
-        if fence_frac > 0:
-            fences = build_fence(gen_mask & speedups.NEW_CELL_MASK)
-            fences *= coinflip(fence_frac, fences.shape)
+        flips = _layer_coinflips(layer, board.shape)
+        # Spawners can only go in the interior of the area that was open at
+        # the start of the layer.
+        if 'spawners' in flips:
+            open_cells = gen_mask & NEW_CELL_MASK > 0
+            spawner_area = ~_wrapped_dilate(~open_cells, 1)
+
+        if 'fences' in flips:
+            with _timed_phase('build_fence'):
+                fences = build_fence(gen_mask & speedups.NEW_CELL_MASK)
+            fences *= flips['fences']
             gen_mask &= ~(fences * (NEW_CELL_MASK | CAN_OSCILLATE_MASK))
             board += fences.astype(np.uint16) * CellTypes.wall
 
-        spawners = layer.get('spawners', 0)
-        if spawners > 0:
-            _mask = (gen_mask0 & NEW_CELL_MASK > 0) & interior
-            new_cells = _mask & coinflip(spawners, board.shape)
-            if not new_cells.any() and _mask.any():
-                i, j = np.nonzero(_mask)
+        if 'spawners' in flips:
+            new_cells = spawner_area & flips['spawners']
+            if not new_cells.any() and spawner_area.any():
+                i, j = np.nonzero(spawner_area)
                 k = get_rng().choice(len(i))  # ensure at least one spawner
                 new_cells[i[k], j[k]] = True
             gen_mask[new_cells] ^= NEW_CELL_MASK
@@ -372,15 +424,19 @@ def populate_region(mask, layer_params):
                 gen_mask2 = gen_mask
                 max_period = period
 
-            board = _gen_pattern(board, gen_mask2, seeds, **pattern_args)
+            with _timed_phase('gen_pattern'):
+                board = _gen_pattern(board, gen_mask2, seeds, **pattern_args)
 
             # We need to update the mask for subsequent layers so that they
             # do not destroy the pattern in this layer.
-            # First get a list of board states throughout the oscillation cycle.
-            boards = [board]
-            for _ in range(1, max_period):
-                boards.append(speedups.advance_board(boards[-1]))
-            non_empty = np.array(boards) != 0
+            # First find the occupied cells throughout the oscillation cycle.
+            with _timed_phase('period_check'):
+                non_empty = np.empty((max_period,) + board.shape, dtype=bool)
+                non_empty[0] = board != 0
+                next_board = board
+                for t in range(1, max_period):
+                    next_board = speedups.advance_board(next_board)
+                    non_empty[t] = next_board != 0
             still_cells = non_empty.all(axis=0)
             osc_cells = still_cells ^ non_empty.any(axis=0)
             # Both still life cells and oscillating cells should disallow
@@ -392,7 +448,10 @@ def populate_region(mask, layer_params):
             # is set for the currently oscillating cells, because we're not
             # checking for violations in them anyways, and we don't allow any
             # changes that would affect them.
-            osc_neighbors = ndimage.maximum_filter(osc_cells, size=3, mode='wrap')
+            if max_period > 1:
+                osc_neighbors = _wrapped_dilate(osc_cells, 1)
+            else:
+                osc_neighbors = osc_cells
             gen_mask[osc_cells] &= ~(NEW_CELL_MASK | INCLUDE_VIOLATIONS_MASK)
             gen_mask[still_cells | osc_neighbors] &= ~(NEW_CELL_MASK | CAN_OSCILLATE_MASK)
 
@@ -405,28 +464,24 @@ def populate_region(mask, layer_params):
 
         new_mask = board != old_board
 
-        movable_walls = layer.get('movable_walls', 0)
-        if movable_walls > 0:
-            new_cells = coinflip(movable_walls, board.shape) * new_mask
+        if 'movable_walls' in flips:
+            new_cells = flips['movable_walls'] * new_mask
             new_cells *= (board & ~CellTypes.rainbow_color) == CellTypes.wall
             board += new_cells * CellTypes.movable
 
-        movable_trees = layer.get('movable_trees', 0)
-        if movable_trees > 0:
-            new_cells = coinflip(movable_trees, board.shape) * new_mask
+        if 'movable_trees' in flips:
+            new_cells = flips['movable_trees'] * new_mask
             new_cells *= (board & ~CellTypes.rainbow_color) == CellTypes.tree
             board += new_cells * CellTypes.movable
 
-        hardened_life = layer.get('hardened_life', 0)
-        if hardened_life > 0:
-            new_cells = coinflip(hardened_life, board.shape) * new_mask
+        if 'hardened_life' in flips:
+            new_cells = flips['hardened_life'] * new_mask
             new_cells *= (board & ~CellTypes.rainbow_color) == CellTypes.life
             board -= new_cells * CellTypes.destructible
 
-        buffer_size = layer.get('buffer_zone', 0) * 2 + 1
+        buffer_zone = layer.get('buffer_zone', 0)
         life_cells = board & CellTypes.alive > 0
-        buf = ndimage.maximum_filter(life_cells, size=buffer_size, mode='wrap')
-        gen_mask[buf] &= ~NEW_CELL_MASK
+        gen_mask[_wrapped_dilate(life_cells, buffer_zone)] &= ~NEW_CELL_MASK
 
         target = layer.get('target', 'board')
         if target == 'board':
@@ -446,15 +501,13 @@ def populate_region(mask, layer_params):
         else:
             raise ValueError("Unexpected value for 'target': %s" % (target,))
 
-        fountains = layer.get('fountains', 0)
-        if fountains > 0:
-            new_cells = coinflip(fountains, board.shape)
-            new_cells *= gen_mask & NEW_CELL_MASK > 0
-            neighbors = ndimage.maximum_filter(new_cells, size=3, mode='wrap')
-            neighbors *= gen_mask & NEW_CELL_MASK > 0
+        if 'fountains' in flips:
+            open_cells = gen_mask & NEW_CELL_MASK > 0
+            new_cells = flips['fountains'] & open_cells
+            neighbors = _wrapped_dilate(new_cells, 1) & open_cells
             gen_mask[neighbors] = INCLUDE_VIOLATIONS_MASK
-            if buffer_size > 1:
-                buf = ndimage.maximum_filter(neighbors, size=buffer_size, mode='wrap')
+            if buffer_zone > 0:
+                buf = _wrapped_dilate(neighbors, buffer_zone)
                 gen_mask[buf] &= ~NEW_CELL_MASK
             board[neighbors] = CellTypes.wall + color
             board[new_cells] = CellTypes.fountain + color
@@ -530,7 +583,8 @@ def gen_game(
     min_performance = _fix_random_values(min_performance)
     partitioning = _fix_random_values(partitioning)
 
-    regions = make_partioned_regions(board_shape, **partitioning)
+    with _timed_phase('partitioning'):
+        regions = make_partioned_regions(board_shape, **partitioning)
     board = np.zeros(board_shape, dtype=np.uint16)
     goals = np.zeros(board_shape, dtype=np.uint16)
 
@@ -567,14 +621,16 @@ def gen_game(
             logger.error("No region parameters for name '%s'", region_name)
             continue
         logger.debug("Making region: %s", region_name)
-        rboard, rgoals = populate_region(mask, named_regions[region_name])
+        with _timed_phase('populate_region', 'region/' + region_name):
+            rboard, rgoals = populate_region(mask, named_regions[region_name])
         board += rboard
         goals += rgoals
         starting_region = None
     buffer_region = _fix_random_values(buffer_region)
     if buffer_region in named_regions:
         mask = regions == 0
-        rboard, rgoals = populate_region(mask, named_regions[buffer_region])
+        with _timed_phase('populate_region', 'region/' + buffer_region):
+            rboard, rgoals = populate_region(mask, named_regions[buffer_region])
         board += rboard
         goals += rgoals
 
@@ -612,27 +668,31 @@ def stability_mask(board, period=6, remove_agent=True):
         stability. This means that the agent's freezing power doesn't
         affect the stability.
     """
-    if remove_agent:
-        board = board * ((board & CellTypes.agent) == 0)
-
-    neighborhood = np.ones((3,3))
-    alive = (board & CellTypes.alive) // CellTypes.alive
-    neighbors = ndimage.convolve(alive, neighborhood, mode='wrap')
-    max_neighbors = neighbors
-    ever_alive = alive
-    orig_board = board
-    for _ in range(period):
-        board = speedups.advance_board(board)
+    with _timed_phase('stability_mask'):
+        if remove_agent:
+            board = board * ((board & CellTypes.agent) == 0)
+
+        orig_board = board
+        ever_alive = np.zeros(board.shape, dtype=bool)
+        max_neighbors = np.zeros(board.shape, dtype=np.uint8)
+        for _ in range(period):
+            ever_alive |= (board & CellTypes.alive) > 0
+            next_board, neighbors = speedups.advance_board(
+                board, return_neighbors=True)
+            np.maximum(max_neighbors, neighbors, out=max_neighbors)
+            board = next_board
+        # The last board never gets advanced, so count its neighbors directly.
         alive = (board & CellTypes.alive) // CellTypes.alive
-        neighbors = ndimage.convolve(alive, neighborhood, mode='wrap')
-        ever_alive |= alive
+        neighbors = ndimage.convolve(alive, np.ones((3,3)), mode='wrap')
+        ever_alive |= alive > 0
         max_neighbors = np.maximum(max_neighbors, neighbors)
-    is_boundary = (board & CellTypes.frozen > 0)
-    is_boundary |= (ever_alive == 0) & (max_neighbors <= 2)
-    labels, num_labels = speedups.wrapped_label(~is_boundary)
-    mask = np.zeros(board.shape, dtype=bool)
-    for idx in range(1, num_labels+1):
-        region = labels == idx
-        if (board[region] == orig_board[region]).all():
-            mask |= region
+        is_boundary = (board & CellTypes.frozen > 0)
+        is_boundary |= (ever_alive == 0) & (max_neighbors <= 2)
+        labels, num_labels = speedups.wrapped_label(~is_boundary)
+        # A region is stable if none of its cells changed.
+        num_changed = np.bincount(
+            labels[board != orig_board], minlength=num_labels+1)
+        stable_labels = num_changed == 0
+        stable_labels[0] = False
+        mask = stable_labels[labels]
     return mask
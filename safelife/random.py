@@ -2,34 +2,53 @@
 Module that stores global random state for SafeLife.
 
 Note that this uses the new numpy 1.17 random generators.
+
+Each thread can override the global generator with :class:`set_rng`. The
+override only applies to the thread that set it (in both python and the C
+extensions), so environments that are stepped on different threads don't
+draw from each other's generators.
 """
 
+import threading
+
 import numpy as np
 
 from . import speedups
 
 
 random_gen = np.random.default_rng()  # global random generator object
+speedups.set_bit_generator(random_gen.bit_generator)
+
+_local = threading.local()  # per-thread overrides of random_gen
 
 
 def get_rng():
-    return random_gen
+    rng = getattr(_local, 'rng', None)
+    return random_gen if rng is None else rng
+
+
+def _set_local_rng(rng):
+    _local.rng = rng
+    speedups.set_local_bit_generator(
+        None if rng is None else rng.bit_generator)
 
 
 class set_rng(object):
+    """
+    Use `new_rng` as the random generator for the current thread.
+
+    Can be used as a context manager, in which case the old generator is
+    restored on exit.
+    """
     def __init__(self, new_rng):
-        global random_gen
-        self.old_rng = random_gen
-        random_gen = new_rng
-        speedups.set_bit_generator(random_gen.bit_generator)
+        self.old_rng = getattr(_local, 'rng', None)
+        _set_local_rng(new_rng)
 
     def __enter__(self):
         pass
 
     def __exit__(self, *args):
-        global random_gen
-        random_gen = self.old_rng
-        speedups.set_bit_generator(random_gen.bit_generator)
+        _set_local_rng(self.old_rng)
 
 
 def coinflip(p, n=None):
@@ -43,4 +62,4 @@ def coinflip(p, n=None):
         If not None, return an array of `n` coin flips.
         Tuples can be used to return a multi-dimensional array.
     """
-    return random_gen.random(n) < p
+    return get_rng().random(n) < p
@@ -3,17 +3,30 @@ Utilities to graphically render SafeLifeGame boards.
 """
 
 import os
+import itertools
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import imageio
 import numpy as np
 
 from . import speedups
 from .safelife_game import CellTypes, GameState
+from .board_codec import decode_board_data
 from .helper_utils import recenter_view
 
 
 sprite_path = os.path.join(os.path.dirname(__file__), "sprites.png")
-sprite_sheet = imageio.imread(os.path.abspath(sprite_path)) / np.float32(255)
+# The sprite sheet is saved as gray + alpha. Make sure it's loaded as RGBA.
+sprite_sheet = imageio.imread(
+    os.path.abspath(sprite_path), pilmode='RGBA') / np.float32(255)
 SPRITE_SIZE = 14
+RENDER_CHUNK_SIZE = 32  # number of frames to render at a time for movies
+
+logger = logging.getLogger(__name__)
+_background_executor = None
+_tile_cache = {}
 
 
 def load_sprite(i, j):
@@ -67,19 +80,46 @@ background_colors = np.array([
 ])
 
 
-def render_board(board, goals, orientation, edit_loc=None, edit_color=0):
-    img = speedups._render_board(board, goals, orientation, sprite_sheet)
+def sprite_tiles(scale=SPRITE_SIZE):
+    """
+    Pre-rendered tiles for every sprite and color combination.
+
+    Tiles are built on first use for each scale and then cached.
+
+    Parameters
+    ----------
+    scale : int
+        Size of each tile in pixels, between 1 and ``SPRITE_SIZE``.
+        Sprites are box-filtered down to smaller sizes.
+
+    Returns
+    -------
+    ndarray
+        Array of uint8 with shape ``(20, 8, 8, scale, scale, 3)``. The first
+        three axes are the sprite index (in the 5x5 sprite sheet), the
+        foreground (cell) color, and the background (goal) color.
+    """
+    tiles = _tile_cache.get(scale)
+    if tiles is None:
+        tiles = _tile_cache[scale] = speedups._build_tiles(sprite_sheet, scale)
+    return tiles
+
+
+def render_board(board, goals, orientation, edit_loc=None, edit_color=0,
+                 scale=SPRITE_SIZE):
+    img = speedups._render_board(board, goals, orientation, sprite_tiles(scale))
     if edit_loc is not None:
         x, y = edit_loc
-        edit_cell = img[...,
-            y*SPRITE_SIZE:(y+1)*SPRITE_SIZE,
-            x*SPRITE_SIZE:(x+1)*SPRITE_SIZE, :]
-        edit_cell[...,[0,1,-1,-2],:,:] = edit_color
-        edit_cell[...,[0,1,-1,-2],:] = edit_color
+        edit_cell = img[..., y*scale:(y+1)*scale, x*scale:(x+1)*scale, :]
+        # Border is two pixels wide at full scale.
+        border = list(range(max(1, scale // 7)))
+        border += [-1-i for i in border]
+        edit_cell[..., border, :, :] = edit_color
+        edit_cell[..., border, :] = edit_color
     return img
 
 
-def render_game(game, view_size=None, edit_mode=None):
+def render_game(game, view_size=None, edit_mode=None, scale=SPRITE_SIZE):
     """
     Render the game as a numpy rgb array.
 
@@ -94,11 +134,14 @@ def render_game(game, view_size=None, edit_mode=None):
         Determines whether or not the game should be drawn in edit mode with
         the edit cursor. If "GOALS", the goals and normal board are swapped so
         that the goals can be edited directly.
+    scale : int
+        Number of pixels per cell. Small scales (e.g., 1 or 4) are much
+        cheaper to render and can be used for thumbnails.
 
     Returns
     -------
     numpy array
-        Has shape (view_size) + (3,).
+        Has shape (view_size * scale) + (3,).
     """
     if view_size is not None:
         if edit_mode:
@@ -119,31 +162,87 @@ def render_game(game, view_size=None, edit_mode=None):
     if edit_mode == "GOALS":
         # Render goals instead. Swap board and goals.
         board, goals = goals, board
-    return render_board(board, goals, game.orientation, edit_loc, edit_color)
+    return render_board(
+        board, goals, game.orientation, edit_loc, edit_color, scale)
+
 
+def render_chunks(board, goals, orientation, chunk_size=RENDER_CHUNK_SIZE,
+                  num_threads=None, scale=SPRITE_SIZE):
+    """
+    Render a sequence of boards in chunks.
+
+    Chunks are rendered concurrently on separate threads (rendering releases
+    the GIL), but at most `num_threads` chunks are held in memory at once.
+    This keeps memory bounded for long episodes.
 
-def _save_movie_data(fname, data, fps, fmt):
+    Parameters
+    ----------
+    board : ndarray
+        Sequence of boards with shape (T, H, W).
+    goals : ndarray
+        Same shape as the boards.
+    orientation : ndarray
+        Agent orientation for each board, with `T` total elements.
+    chunk_size : int
+        Number of frames to render in each chunk.
+    num_threads : int or None
+        Number of rendering threads. Defaults to the number of CPUs, up to 4.
+    scale : int
+        Number of pixels per cell.
+
+    Yields
+    ------
+    ndarray
+        Chunks of rendered frames with shape (n, H*scale, W*scale, 3).
+    """
+    if num_threads is None:
+        num_threads = min(4, os.cpu_count() or 1)
+    orientation = np.asarray(orientation).reshape(-1)
+    tiles = sprite_tiles(scale)
+    with ThreadPoolExecutor(num_threads) as pool:
+        pending = deque()
+        for i in range(0, len(board), chunk_size):
+            pending.append(pool.submit(
+                speedups._render_board, board[i:i+chunk_size],
+                goals[i:i+chunk_size], orientation[i:i+chunk_size], tiles))
+            if len(pending) >= num_threads:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _save_movie_data(fname, frames, fps, fmt, scale=SPRITE_SIZE):
+    # Frames are appended to the writer one at a time so that the full
+    # movie never needs to be held in memory.
     if fmt == 'gif':
-        imageio.mimwrite(fname+'.gif', data,
-                         duration=1/fps, subrectangles=True)
+        writer = imageio.get_writer(
+            fname+'.gif', mode='I', duration=1/fps, subrectangles=True)
     else:
-        imageio.mimwrite(fname + '.' + fmt, data,
-                         fps=fps, macro_block_size=SPRITE_SIZE,
-                         ffmpeg_log_level='quiet')
+        writer = imageio.get_writer(
+            fname + '.' + fmt, mode='I', fps=fps,
+            macro_block_size=scale, ffmpeg_log_level='quiet')
+    with writer:
+        for frame in frames:
+            writer.append_data(frame)
 
 
-def render_file(fname, fps=30, data=None, movie_format="gif"):
+def render_file(fname, fps=30, data=None, movie_format="gif",
+                scale=SPRITE_SIZE):
     """
     Load a saved SafeLifeGame file and render it as a png or gif.
 
     The game will be rendered as animated if it contains a
     sequence of states; otherwise it will be rendered as a png.
+    Animations are rendered and encoded in chunks of frames so that memory
+    use stays bounded even for very long episodes.
 
     Parameters
     ----------
     fname : str
     fps : float
         Frames per second for gif animation.
+    scale : int
+        Number of pixels per cell.
     """
     bare_fname = '.'.join(fname.split('.')[:-1])
     if data is None:
@@ -152,20 +251,54 @@ def render_file(fname, fps=30, data=None, movie_format="gif"):
     if hasattr(data, 'keys') and 'levels' in data:
         os.makedirs(bare_fname, exist_ok=True)
         for level in data['levels']:
-            render_file(os.path.join(bare_fname, level['name']), fps, level)
+            render_file(
+                os.path.join(bare_fname, level['name']), fps, level,
+                movie_format, scale)
         return
 
-    rgb_array = render_board(
-        data['board'], data['goals'], data['orientation'][..., None, None])
-    if rgb_array.ndim == 3:
+    data = decode_board_data(data)
+    board = np.asarray(data['board'])
+    if board.ndim == 2:
+        rgb_array = render_board(
+            board, data['goals'], data['orientation'], scale=scale)
         imageio.imwrite(bare_fname+'.png', rgb_array)
-    elif rgb_array.ndim == 4:
-        _save_movie_data(bare_fname, rgb_array, fps, movie_format)
+    elif board.ndim == 3:
+        chunks = render_chunks(
+            board, data['goals'], data['orientation'], scale=scale)
+        _save_movie_data(
+            bare_fname, itertools.chain.from_iterable(chunks),
+            fps, movie_format, scale)
     else:
         raise Exception("Unexpected dimension of rgb_array.")
 
 
-def render_mov(fname, steps, fps=30, movie_format="gif"):
+def render_file_in_background(fname, fps=30, data=None, movie_format="gif",
+                              scale=SPRITE_SIZE):
+    """
+    Same as :func:`render_file`, but runs on a background thread.
+
+    Files are rendered one at a time in the order they are submitted.
+    Errors are logged rather than raised.
+
+    Returns
+    -------
+    concurrent.futures.Future
+    """
+    global _background_executor
+    if _background_executor is None:
+        _background_executor = ThreadPoolExecutor(1)
+    future = _background_executor.submit(
+        render_file, fname, fps, data, movie_format, scale)
+
+    def log_errors(future):
+        if future.exception() is not None:
+            logger.error(
+                "Could not render '%s'", fname, exc_info=future.exception())
+    future.add_done_callback(log_errors)
+    return future
+
+
+def render_mov(fname, steps, fps=30, movie_format="gif", scale=SPRITE_SIZE):
     """
     Load a saved SafeLifeGame state and render it as an animated gif.
 
@@ -177,14 +310,16 @@ def render_mov(fname, steps, fps=30, movie_format="gif"):
         as the number of frames that will be rendered.
     fps : float
         Frames per second for gif animation.
+    scale : int
+        Number of pixels per cell.
     """
     game = GameState.load(fname)
     bare_fname = '.'.join(fname.split('.')[:-1])
     frames = []
     for _ in range(steps):
-        frames.append(render_game(game))
+        frames.append(render_game(game, scale=scale))
         game.advance_board()
-    _save_movie_data(bare_fname, frames, fps, movie_format)
+    _save_movie_data(bare_fname, frames, fps, movie_format, scale)
 
 
 def _make_cmd_args(subparsers):
@@ -214,6 +349,9 @@ def _make_cmd_args(subparsers):
         help="Format for video rendering. "
         "Can either be 'gif' or one of the formats supported by ffmpeg "
         "(e.g., mp4, avi, etc.).")
+    parser.add_argument('--scale', default=SPRITE_SIZE, type=int,
+        help="Number of pixels per cell (1-14). Small values are much"
+        " faster to render and encode.")
     parser.set_defaults(run_cmd=_run_cmd_args)
 
 
@@ -221,9 +359,12 @@ def _run_cmd_args(args):
     for fname in args.fnames:
         try:
             if args.steps == 0:
-                render_file(fname, args.fps, movie_format=args.fmt)
+                render_file(
+                    fname, args.fps, movie_format=args.fmt, scale=args.scale)
             else:
-                render_mov(fname, args.steps, args.fps, movie_format=args.fmt)
+                render_mov(
+                    fname, args.steps, args.fps, movie_format=args.fmt,
+                    scale=args.scale)
             print("Success:", fname)
         except Exception:
             print("Failed:", fname)
@@ -2,6 +2,7 @@ import numpy as np
 
 from .helper_utils import recenter_view
 from .safelife_game import CellTypes, GameWithGoals
+from . import speedups
 
 
 background_colors = [
@@ -105,40 +106,79 @@ def render_board(board, goals=0, orientation=0, edit_loc=None, edit_color=0):
     """
     Just render the board itself. Doesn't require game state.
     """
-    if edit_loc and (edit_loc[0] >= board.shape[0] or edit_loc[1] >= board.shape[1]):
-        edit_loc = None
     goals = np.broadcast_to(goals, board.shape)
+    return speedups.render_ansi(
+        board, goals, orientation, edit_loc, edit_color).decode()
 
-    screen = np.empty((board.shape[0]+2, board.shape[1]+3,), dtype=object)
-    screen[:] = ''
-    screen[0] = screen[-1] = ' -'
-    screen[:,0] = screen[:,-2] = ' |'
-    screen[:,-1] = '\n'
-    screen[0,0] = screen[0,-2] = screen[-1,0] = screen[-1,-2] = ' +'
-    screen[1:-1,1:-2] = render_cell(board, goals, orientation)
-
-    if edit_loc:
-        x1, y1 = edit_loc
-        val = render_cell(board[y1, x1], goals[y1, x1], orientation, edit_color)
-        screen[y1+1, x1+1] = str(val)
-    return ''.join(screen.ravel())
 
+class TerminalBoard(object):
+    """
+    Draws a board in a terminal, redrawing only the cells that change.
 
-def render_game(game, view_size=None, edit_mode=None):
+    Each call to :meth:`draw` returns the ANSI text needed to update the
+    terminal from the previously drawn board to the new one, assuming that
+    nothing else has overwritten the board in between. If the board's size
+    or position changes, the whole board is redrawn. Call :meth:`reset` to
+    force a full redraw.
     """
-    Render the game as an ansi string.
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.last_frame = None
+
+    def draw(self, board, goals=0, orientation=0, edit_loc=None, edit_color=0,
+             row=1):
+        """
+        Parameters
+        ----------
+        board, goals, orientation, edit_loc, edit_color
+            Same as for :func:`render_board`.
+        row : int
+            Terminal row (1-based) of the top of the board.
+
+        Returns
+        -------
+        str
+            The ANSI text to draw. The cursor position afterwards is
+            unspecified.
+        """
+        goals = np.broadcast_to(goals, board.shape)
+        if edit_loc and (
+                edit_loc[0] >= board.shape[1] or edit_loc[1] >= board.shape[0]):
+            edit_loc = None
+        frame = (
+            board.copy(), goals.copy(), orientation, edit_loc, edit_color, row)
+        last_frame = self.last_frame
+        self.last_frame = frame
+        if (last_frame is None or last_frame[0].shape != board.shape or
+                last_frame[5] != row):
+            # Clear to the end of each line in case a larger board was there.
+            return "\x1b[%i;1H" % row + render_board(
+                board, goals, orientation, edit_loc, edit_color
+            ).replace("\n", "\x1b[K\n")
+        last_board, last_goals, last_orientation, last_edit_loc = last_frame[:4]
+        changed = (board != last_board) | (goals != last_goals)
+        if orientation != last_orientation:
+            changed |= board & CellTypes.agent > 0
+        for loc in (last_edit_loc, edit_loc):
+            if loc:
+                changed[loc[1], loc[0]] = True
+        return speedups.render_ansi(
+            board, goals, orientation, edit_loc, edit_color,
+            changed=changed, origin=(row, 1)).decode()
+
+
+def game_view(game, view_size=None, edit_mode=None):
+    """
+    Get the part of the game that's in view.
 
-    Parameters
-    ----------
-    game : SafeLifeGame instance
-    view_size : (int, int) or None
-        Shape of the view port, or None if the full board should be rendered.
-        If not None, the view will be centered on either the agent or the
-        current edit location.
-    edit_mode : None, "BOARD", or "GOALS"
-        Determines whether or not the game should be drawn in edit mode with
-        the edit cursor. If "GOALS", the goals and normal board are swapped so
-        that the goals can be edited directly.
+    See :func:`render_game` for parameter descriptions.
+
+    Returns
+    -------
+    (board, goals, orientation, edit_loc, edit_color)
+        Arguments that can be passed to :func:`render_board`.
     """
     if view_size is not None:
         if edit_mode:
@@ -159,7 +199,26 @@ def render_game(game, view_size=None, edit_mode=None):
         # Render goals instead. Swap board and goals.
         board, goals = goals, board
 
-    return render_board(board, goals, game.orientation, edit_loc, edit_color)
+    return board, goals, game.orientation, edit_loc, edit_color
+
+
+def render_game(game, view_size=None, edit_mode=None):
+    """
+    Render the game as an ansi string.
+
+    Parameters
+    ----------
+    game : SafeLifeGame instance
+    view_size : (int, int) or None
+        Shape of the view port, or None if the full board should be rendered.
+        If not None, the view will be centered on either the agent or the
+        current edit location.
+    edit_mode : None, "BOARD", or "GOALS"
+        Determines whether or not the game should be drawn in edit mode with
+        the edit cursor. If "GOALS", the goals and normal board are swapped so
+        that the goals can be edited directly.
+    """
+    return render_board(*game_view(game, view_size, edit_mode))
 
 
 def agent_powers(game):
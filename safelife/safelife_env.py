@@ -6,7 +6,7 @@ import numpy as np
 
 from .level_iterator import SafeLifeLevelIterator
 from .safelife_game import CellTypes
-from .helper_utils import recenter_view, load_kwargs
+from .helper_utils import recenter_view, load_kwargs, PerfCounters
 from .random import set_rng
 
 
@@ -45,6 +45,10 @@ class SafeLifeEnv(gym.Env):
         If a tuple, each corresponding bit is given its own binary channel.
     view_shape : (int, int)
         Shape of the agent observation.
+    record_perf_stats : bool
+        If True, record cumulative timings for each part of the environment
+        step and reset. See :meth:`perf_stats`. Wrappers can add their own
+        timings to :attr:`perf_counters`.
     """
 
     metadata = {
@@ -70,11 +74,13 @@ class SafeLifeEnv(gym.Env):
     remove_white_goals = True
     view_shape = (15, 15)
     output_channels = tuple(range(15))  # default to all channels
+    record_perf_stats = False
 
     def __init__(self, level_iterator, **kwargs):
         self.level_iterator = level_iterator
 
         load_kwargs(self, kwargs)
+        self.perf_counters = PerfCounters(self.record_perf_stats)
 
         self.action_space = spaces.Discrete(len(self.action_names))
         if self.output_channels is None:
@@ -142,10 +148,14 @@ class SafeLifeEnv(gym.Env):
 
     def step(self, action):
         assert self.game is not None, "Game state is not initialized."
+        perf = self.perf_counters
+        t = perf.now()
         action_name = self.action_names[action]
         reward = self.game.execute_action(action_name)
+        t = perf.lap('action', t)
         with set_rng(self.rng):
             self.game.advance_board()
+        t = perf.lap('physics', t)
         new_game_value = self.game.current_points()
         reward += new_game_value - self._old_game_value
         self._old_game_value = new_game_value
@@ -154,8 +164,12 @@ class SafeLifeEnv(gym.Env):
         self.game.update_exit_colors()
         times_up = self.episode_length > self.time_limit
         self.episode_completed = times_up or self.game.game_over
+        t = perf.lap('scoring', t)
+        obs = self.get_obs()
+        perf.lap('observation', t)
+        perf.count('steps')
 
-        return self.get_obs(), reward, self.episode_completed, {
+        return obs, reward, self.episode_completed, {
             'board': self.game.board,
             'goals': self.game.goals,
             'agent_loc': self.game.agent_loc,
@@ -167,14 +181,55 @@ class SafeLifeEnv(gym.Env):
         }
 
     def reset(self):
+        perf = self.perf_counters
+        t = perf.now()
         self.game = next(self.level_iterator)
+        t = perf.lap('level_fetch', t)
         self.game.revert()
         self.game.update_exit_colors()
         self._old_game_value = self.game.current_points()
         self.episode_length = 0
         self.episode_reward = 0
         self.episode_completed = False
-        return self.get_obs()
+        t = perf.lap('reset', t)
+        obs = self.get_obs()
+        perf.lap('observation', t)
+        perf.count('episodes')
+        return obs
+
+    def perf_stats(self, reset=False):
+        """
+        Cumulative timing statistics for the environment.
+
+        Only recorded if ``record_perf_stats`` is True.
+
+        Parameters
+        ----------
+        reset : bool
+            If True, reset the statistics after they've been returned.
+            This can be used to get statistics over fixed intervals.
+
+        Returns
+        -------
+        dict
+            The number of steps and episodes, plus the total time (in seconds)
+            and average time per step (in microseconds) spent in each timed
+            section. Sections include 'action', 'physics', 'scoring',
+            'observation', 'level_fetch' (time blocked waiting for the level
+            iterator), 'reset', and any sections added by wrappers.
+        """
+        perf = self.perf_counters
+        num_steps = perf.counts['steps']
+        stats = {
+            'steps': num_steps,
+            'episodes': perf.counts['episodes'],
+        }
+        for key, val in perf.times.items():
+            stats[key + '_time'] = val
+            stats[key + '_usec_per_step'] = 1e6 * val / max(num_steps, 1)
+        if reset:
+            perf.reset()
+        return stats
 
     def render(self, mode='ansi'):
         if mode == 'ansi':
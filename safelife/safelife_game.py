@@ -21,7 +21,7 @@ from .helper_utils import (
     wrapped_convolution as convolve2d,
 )
 from .random import coinflip, get_rng
-from .speedups import advance_board
+from .speedups import advance_board, board_hash
 
 
 ORIENTATION = {
@@ -33,6 +33,28 @@ ORIENTATION = {
     "BACKWARD": 6,
 }
 
+# Salts used to hash the different components of the game state.
+# See `GameState.state_hash`.
+BOARD_HASH_SALT = 0
+GOALS_HASH_SALT = 0x5bd1e9955bd1e995
+AGENT_HASH_SALT = 0x2545f4914f6cdd1d
+_UINT64_MASK = (1 << 64) - 1
+
+
+def _zobrist_key(salt, row, col, val):
+    """
+    Hash key for a single cell. Pure python version of the key function
+    used by ``speedups.board_hash()``; the two must always match.
+    """
+    val = int(val)
+    if not val:
+        return 0
+    z = salt ^ (int(row) << 40 | int(col) << 16 | val)
+    z = (z + 0x9e3779b97f4a7c15) & _UINT64_MASK
+    z = ((z ^ (z >> 30)) * 0xbf58476d1ce4e5b9) & _UINT64_MASK
+    z = ((z ^ (z >> 27)) * 0x94d049bb133111eb) & _UINT64_MASK
+    return z ^ (z >> 31)
+
 
 class CellTypes(object):
     """
@@ -151,6 +173,8 @@ class GameState(object):
     min_performance : float
         Don't allow the agent to exit the level until the level is at least
         this fraction completed. If negative, the agent can always exit.
+    state_hash : int
+        64-bit hash of the current game state. See below.
     """
     spawn_prob = 0.3
     orientation = 1
@@ -167,7 +191,11 @@ class GameState(object):
     can_toggle_powers = False
     can_toggle_colors = False
 
+    # Board-like attributes that are included in the state hash
+    _hashed_arrays = (('board', BOARD_HASH_SALT),)
+
     def __init__(self, board_size=(10,10)):
+        self._hash_cache = {}
         self.exit_locs = (np.array([], dtype=int), np.array([], dtype=int))
         if board_size is None:
             # assume we'll load a new board from file
@@ -261,6 +289,63 @@ class GameState(object):
         obj.file_name = file_name
         return obj
 
+    @property
+    def state_hash(self):
+        """
+        Zobrist-style hash of the board, goals, agent location and orientation.
+
+        Equal game states always have equal hashes, so this can be used to
+        cheaply detect repeated states (e.g., for deduplication or cycle
+        detection). The hash of each board array is computed in C the first
+        time it's needed and then updated cell by cell as the agent moves and
+        edits the board. Whenever an array is replaced (as happens on every
+        call to ``advance_board()``) its hash is recomputed on the next
+        access, so there is no cost to maintaining the hash unless it's used.
+
+        Code that modifies the board in place outside of the standard
+        actions, edits and physics should call ``invalidate_state_hash()``.
+        """
+        h = 0
+        cache = self._hash_cache
+        for attr, salt in self._hashed_arrays:
+            array = getattr(self, attr)
+            cached = cache.get(attr)
+            if cached is None or cached[0] is not array:
+                cached = cache[attr] = [array, board_hash(array, salt)]
+            h ^= cached[1]
+        x, y = self.agent_loc
+        h ^= _zobrist_key(AGENT_HASH_SALT, y, x, self.orientation + 1)
+        return h
+
+    def invalidate_state_hash(self):
+        """Force a full recalculation of the state hash on next access."""
+        self._hash_cache.clear()
+
+    def _cell_values(self, *locs):
+        """
+        Record the values of board cells that are about to change so that the
+        state hash can be updated. Returns None if the hash isn't in use.
+        """
+        cached = self._hash_cache.get('board')
+        if cached is None or cached[0] is not self.board:
+            return None
+        board = self.board
+        return {(x, y): board[y, x] for x, y in locs}
+
+    def _update_cell_hashes(self, old_values):
+        """Update the board hash for cells recorded by `_cell_values()`."""
+        cached = self._hash_cache.get('board')
+        if old_values is None or cached is None or cached[0] is not self.board:
+            return
+        board = self.board
+        h = cached[1]
+        for (x, y), old_val in old_values.items():
+            new_val = board[y, x]
+            if new_val != old_val:
+                h ^= _zobrist_key(BOARD_HASH_SALT, y, x, old_val)
+                h ^= _zobrist_key(BOARD_HASH_SALT, y, x, new_val)
+        cached[1] = h
+
     @property
     def width(self):
         """Width of the game board."""
@@ -316,9 +401,11 @@ class GameState(object):
         x0, y0 = self.agent_loc
         x1, y1 = self.relative_loc(dy, dx)
         x2, y2 = self.relative_loc(-dy, -dx)
+        x3, y3 = self.relative_loc(dy*2)
         can_push = (abs(dy), dx) == (1, 0)
         board = self.board
         reward = 0
+        old_values = self._cell_values((x0, y0), (x1, y1), (x2, y2), (x3, y3))
         if board[y1, x1] == CellTypes.empty:
             board[y1, x1] = board[y0, x0]
             board[y0, x0] = CellTypes.empty
@@ -328,7 +415,6 @@ class GameState(object):
             self.game_over = True
             reward += self.points_on_level_exit
         elif can_push and board[y1, x1] & CellTypes.pushable:
-            x3, y3 = self.relative_loc(dy*2)
             if board[y3, x3] == CellTypes.empty:
                 # Push the cell forward one.
                 board[y3, x3] = board[y1, x1]
@@ -344,6 +430,7 @@ class GameState(object):
         if can_push and board[y2, x2] & CellTypes.pullable and agent_did_move:
             board[y0, x0] = board[y2, x2]
             board[y2, x2] = CellTypes.empty
+        self._update_cell_hashes(old_values)
         return reward
 
     def execute_action(self, action):
@@ -379,6 +466,7 @@ class GameState(object):
                 self.orientation = ORIENTATION[action[7:]]
             x0, y0 = self.agent_loc
             x1, y1 = self.relative_loc(1)
+            old_values = self._cell_values((x0, y0), (x1, y1))
             player_color = board[y0, x0] & CellTypes.rainbow_color
             target_cell = board[y1, x1]
             if target_cell == CellTypes.empty:
@@ -389,6 +477,7 @@ class GameState(object):
                 toggle_bits = CellTypes.powers * self.can_toggle_powers
                 toggle_bits |= CellTypes.rainbow_color * self.can_toggle_colors
                 board[y0, x0] ^= board[y1, x1] & toggle_bits
+            self._update_cell_hashes(old_values)
         elif action in ("RESTART", "ABORT LEVEL", "PREV LEVEL", "NEXT LEVEL"):
             self.game_over = action
         return reward
@@ -426,6 +515,7 @@ class GameState(object):
         board = self.board
         x0, y0 = self.agent_loc
         x1, y1 = self.edit_loc
+        old_values = self._cell_values((x0, y0), (x1, y1))
         if command.startswith("MOVE "):
             direction = ORIENTATION[command[5:]]
             if direction % 2 == 0:
@@ -460,6 +550,7 @@ class GameState(object):
                 return "No saved state; cannot revert."
         elif command in ("ABORT LEVEL", "PREV LEVEL", "NEXT LEVEL"):
             self.game_over = command
+        self._update_cell_hashes(old_values)
         self.update_exit_locs()
 
     def shift_board(self, dx, dy):
@@ -550,7 +641,9 @@ class GameState(object):
         else:
             exit_type = CellTypes.level_exit
         i1, i2 = self.exit_locs
+        old_values = self._cell_values(*zip(i2, i1))
         self.board[i1, i2] = exit_type
+        self._update_cell_hashes(old_values)
 
 
 class GameWithGoals(GameState):
@@ -581,6 +674,8 @@ class GameWithGoals(GameState):
     ])
     point_table.setflags(write=False)
 
+    _hashed_arrays = GameState._hashed_arrays + (('goals', GOALS_HASH_SALT),)
+
     def make_default_board(self, board_size):
         super().make_default_board(board_size)
         self.goals = np.zeros_like(self.board)
@@ -605,6 +700,7 @@ class GameWithGoals(GameState):
             rval = super().execute_edit(command[6:])
             self.board, self.goals = self.goals, self.board
             self._static_goals = None
+            self.invalidate_state_hash()
         else:
             rval = super().execute_edit(command)
         return rval
@@ -773,6 +869,7 @@ class GameOfLife(GameWithGoals):
 
         board *= ~(new_alive | new_dead)
         board += new_alive * (CellTypes.alive + new_flags)
+        self.invalidate_state_hash()
 
     @property
     def is_stochastic(self):
@@ -872,3 +969,4 @@ class AsyncGame(GameWithGoals):
             P = 0.5 + 0.5*np.tanh(H * beta)
             P = 1 - (1-P)*(1-self.spawn_prob)**spawn_neighbors
             board[y, x] = CellTypes.life if coinflip(P) else CellTypes.empty
+        self.invalidate_state_hash()
@@ -49,10 +49,11 @@ except ImportError:
     ray = None
     def ray_remote(func): return func
 
-from .helper_utils import load_kwargs
+from .board_codec import encode_board, encode_board_data, decode_board_data
+from .helper_utils import load_kwargs, get_perf_counters
 from .side_effects import side_effect_score
 from .render_text import cell_name
-from .render_graphics import render_file
+from .render_graphics import render_file_in_background
 
 logger = logging.getLogger(__name__)
 
@@ -134,6 +135,11 @@ class SafeLifeLogger(BaseLogger):
     record_side_effects : bool
         If true (default), side effects are calculated at the end of each
         episode.
+    compact_recordings : bool
+        If true, boards in the saved episode recordings are stored in the
+        compact uint8 encoding (see ``board_codec.encode_board_data()``).
+        Off by default so that older code can still read the recordings.
+        ``render_graphics.render_file()`` can read either format.
     summary_writer : tensorboardX.SummaryWriter
         Writes data to tensorboard. The SafeLifeLogger will attempt to create
         a new summary writer for the log directory if one is not supplied.
@@ -152,6 +158,7 @@ class SafeLifeLogger(BaseLogger):
     testing_log = "testing-log.json"
 
     record_side_effects = True
+    compact_recordings = False
 
     _testing_log = None
     _training_log = None
@@ -282,8 +289,12 @@ class SafeLifeLogger(BaseLogger):
             history_name = history_name.format(**log_data, **self.cumulative_stats)
             history_name = os.path.join(self.logdir, history_name) + '.npz'
             if not os.path.exists(history_name):
+                if self.compact_recordings:
+                    history = encode_board_data(history)
                 np.savez_compressed(history_name, **history)
-                render_file(history_name, movie_format="mp4")
+                # Encoding the video can be slow, so do it off of the
+                # training thread.
+                render_file_in_background(history_name, movie_format="mp4")
 
     def log_scalars(self, data, global_step=None, tag=None):
         """
@@ -411,11 +422,17 @@ class SafeLifeLogWrapper(gym.Wrapper):
     is_training : bool
         Flag passed along to the logger. Training and testing environments
         get logged somewhat differently.
+    perf_stats_interval : int
+        If the wrapped environment records performance statistics (see
+        ``SafeLifeEnv.perf_stats()``), they are sent to the logger's
+        ``log_scalars()`` function under the 'perf' tag every
+        `perf_stats_interval` episodes. Set to zero to disable.
     """
 
     logger = None
     record_history = True
     is_training = True
+    perf_stats_interval = 100
 
     def __init__(self, env, **kwargs):
         super().__init__(env)
@@ -425,17 +442,29 @@ class SafeLifeLogWrapper(gym.Wrapper):
         observation, reward, done, info = self.env.step(action)
 
         if self.record_history and not self._did_log_episode:
+            # Boards are kept in their compact encoding until the episode
+            # is logged, which halves the memory used by long episodes.
             game = self.env.game
-            self._episode_history['board'].append(game.board)
-            self._episode_history['goals'].append(game.goals)
-            self._episode_history['orientation'].append(game.orientation)
+            history = self._episode_history
+            for key in ('board', 'goals'):
+                codes, escapes = encode_board(getattr(game, key))
+                history[key + '_codes'].append(codes)
+                history[key + '_escapes'].append(escapes)
+            history['orientation'].append(game.orientation)
 
         if done and not self._did_log_episode and self.logger is not None:
             self._did_log_episode = True
+            perf = get_perf_counters(self.env)
+            t = perf.now()
             self.logger.log_episode(
                 game, info.get('episode', {}),
-                self._episode_history if self.record_history else None,
+                self._decoded_history() if self.record_history else None,
                 self.is_training)
+            perf.lap('episode_logging', t)
+            if (self.perf_stats_interval > 0 and perf.enabled and
+                    perf.counts['episodes'] >= self.perf_stats_interval):
+                self.logger.log_scalars(
+                    self.env.perf_stats(reset=True), tag='perf')
 
         return observation, reward, done, info
 
@@ -444,13 +473,25 @@ class SafeLifeLogWrapper(gym.Wrapper):
 
         self._did_log_episode = False
         self._episode_history = {
-            'board': [],
-            'goals': [],
+            'board_codes': [],
+            'board_escapes': [],
+            'goals_codes': [],
+            'goals_escapes': [],
             'orientation': []
         }
 
         return observation
 
+    def _decoded_history(self):
+        history = self._episode_history
+        if not history['orientation']:
+            return {'board': [], 'goals': [], 'orientation': []}
+        return decode_board_data({
+            key: np.concatenate(val) if key.endswith('_escapes')
+            else np.array(val)
+            for key, val in history.items()
+        })
+
 
 def load_safelife_log(logfile, default_values={}):
     """
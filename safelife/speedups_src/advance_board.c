@@ -32,7 +32,10 @@ static void combine_neighbors2(uint16_t src, uint16_t *dst) {
 }
 
 void advance_board(
-        uint16_t *b1, uint16_t *b2, int nrow, int ncol, float spawn_prob) {
+        uint16_t *b1, uint16_t *b2, int nrow, int ncol, float spawn_prob,
+        uint8_t *neighbors) {
+    // If `neighbors` is not NULL, it gets filled with the number of live
+    // cells in each 3x3 neighborhood (including the center) of b1.
     int size = nrow*ncol;
     int i, j, start_of_row, end_of_row, end_of_col;
     uint16_t c1[size];
@@ -85,6 +88,12 @@ void advance_board(
         combine_neighbors2(c1[end_of_col-ncol], b2 + end_of_col);
     }
 
+    if (neighbors) {
+        for (i = 0; i < size; i++) {
+            neighbors[i] = b2[i] & ALIVE_BITS;
+        }
+    }
+
     // Now loop over the board and advance it.
     for (i = 0; i < size; i++) {
         uint16_t num_alive = b2[i] & ALIVE_BITS;
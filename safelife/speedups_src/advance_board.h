@@ -1,4 +1,5 @@
 #include <stdint.h>
 
 void advance_board(
-    uint16_t *b1, uint16_t *b2, int height, int width, float spawn_prob);
+    uint16_t *b1, uint16_t *b2, int height, int width, float spawn_prob,
+    uint8_t *neighbors);
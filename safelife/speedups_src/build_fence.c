@@ -0,0 +1,105 @@
+#include <stdlib.h>
+#include <string.h>
+#include "build_fence.h"
+#include "random.h"
+
+
+static void get_neighbors(int idx, int nrow, int ncol, int *out) {
+    // Wrapped 3x3 neighborhood (including the center) of a single cell.
+    int r = idx / ncol;
+    int c = idx % ncol;
+    int n = 0;
+    for (int dy = -1; dy <= 1; dy++) {
+        int y = r + dy;
+        if (y < 0) y += nrow;
+        if (y >= nrow) y -= nrow;
+        for (int dx = -1; dx <= 1; dx++) {
+            int x = c + dx;
+            if (x < 0) x += ncol;
+            if (x >= ncol) x -= ncol;
+            out[n++] = x + y * ncol;
+        }
+    }
+}
+
+
+static void shuffle_indices(int *indices, int n) {
+    // Fisher-Yates shuffle using the shared bit generator.
+    for (int i = n - 1; i > 0; i--) {
+        int j = random_int(i + 1);
+        int tmp = indices[i];
+        indices[i] = indices[j];
+        indices[j] = tmp;
+    }
+}
+
+
+int build_fence(int32_t *mask, int32_t *fence, int nrow, int ncol, int shuffle) {
+    int size = nrow * ncol;
+    int nbrs[9];
+    int num_edges = 0;
+    int *neighbors = calloc(size, sizeof(int));
+    int *edges = malloc(sizeof(int) * size);
+
+    if (!neighbors || !edges) {
+        free(neighbors);
+        free(edges);
+        return -1;
+    }
+    memset(fence, 0, sizeof(int32_t) * size);
+
+    // Count the masked cells around each unmasked cell, and find the edges
+    // of the masked regions (masked cells with unmasked neighbors).
+    for (int i = 0; i < size; i++) {
+        if (!mask[i]) continue;
+        get_neighbors(i, nrow, ncol, nbrs);
+        int is_edge = 0;
+        for (int n = 0; n < 9; n++) {
+            neighbors[nbrs[n]]++;
+            is_edge |= !mask[nbrs[n]];
+        }
+        if (is_edge) edges[num_edges++] = i;
+    }
+    for (int i = 0; i < size; i++) {
+        if (mask[i]) neighbors[i] = 0;
+    }
+
+    // First pass. Add in fence where needed.
+    if (shuffle) shuffle_indices(edges, num_edges);
+    for (int k = 0; k < num_edges; k++) {
+        int i = edges[k];
+        int needs_fence = 0;
+        get_neighbors(i, nrow, ncol, nbrs);
+        for (int n = 0; n < 9; n++) {
+            needs_fence |= neighbors[nbrs[n]] >= 3;
+        }
+        if (needs_fence) {
+            for (int n = 0; n < 9; n++) neighbors[nbrs[n]]--;
+            fence[i] = 1;
+        }
+    }
+
+    // Second pass. Remove fence where unneeded.
+    // Reuse the edge buffer to hold fence locations in board order.
+    int num_fence = 0;
+    for (int i = 0; i < size; i++) {
+        if (fence[i]) edges[num_fence++] = i;
+    }
+    if (shuffle) shuffle_indices(edges, num_fence);
+    for (int k = 0; k < num_fence; k++) {
+        int i = edges[k];
+        int needed = 0;
+        get_neighbors(i, nrow, ncol, nbrs);
+        for (int n = 0; n < 9; n++) {
+            needed |= neighbors[nbrs[n]] >= 2;
+        }
+        if (!needed) {
+            for (int n = 0; n < 9; n++) neighbors[nbrs[n]]++;
+            fence[i] = 0;
+        }
+    }
+
+    free(neighbors);
+    free(edges);
+    return 0;
+}
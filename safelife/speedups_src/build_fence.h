@@ -0,0 +1,3 @@
+#include <stdint.h>
+
+int build_fence(int32_t *mask, int32_t *fence, int nrow, int ncol, int shuffle);
@@ -3,6 +3,7 @@
 
 enum cell_type_bits {
     ALIVE_BIT = 0,
+    AGENT_BIT = 1,
     MOVABLE_BIT = 2,
     DESTRUCTIBLE_BIT = 3,
     FROZEN_BIT = 4,
@@ -15,6 +16,7 @@ enum cell_type_bits {
 
 enum cell_types {
     ALIVE = 1 << ALIVE_BIT,
+    AGENT = 1 << AGENT_BIT,
     MOVABLE = 1 << MOVABLE_BIT,
     DESTRUCTIBLE = 1 << DESTRUCTIBLE_BIT,
     FROZEN = 1 << FROZEN_BIT,
@@ -1,9 +1,14 @@
+#include <string.h>
 #include "fast_render.h"
 
 #define COLOR_BIT 9
 
 const int SPRITE_SIZE = 14;
 
+// Sprites are arranged in a 5x5 grid, but only the first four rows are used.
+#define NUM_SPRITES 20
+#define FULL_TILE_BYTES (14 * 14 * 3)
+
 float foreground_colors[] = {
     0.4, 0.4, 0.4,  // black
     0.8, 0.2, 0.2,  // red
@@ -28,15 +33,11 @@ float background_colors[] = {
 
 uint16_t color_mask = 7 << COLOR_BIT;
 
-static inline void draw_sprite(
-        uint16_t cell, uint16_t goal, uint8_t orientation,
-        float *sprites, uint8_t *out, int row_stride) {
-    float *fg_color = foreground_colors + ((cell & color_mask) >> COLOR_BIT) * 3;
-    float *bg_color = background_colors + ((goal & color_mask) >> COLOR_BIT) * 3;
-    cell &= ~color_mask;
 
+static inline int sprite_index(uint16_t cell, uint8_t orientation) {
+    // Index of the sprite (row * 5 + col) in the sprite sheet.
     int row, col;
-    switch (cell) {
+    switch (cell & ~color_mask) {
         case 0:  // empty
             row = 0; col = 0; break;
 
@@ -71,15 +72,19 @@ static inline void draw_sprite(
 
         default:
             if (cell & 2) {  // agent
-                row = 0; col = 1 + orientation;
+                row = 0; col = 1 + (orientation & 3);
             } else {  // unknown
                 row = 3; col = 4;
             }
     }
+    return row * 5 + col;
+}
+
 
-    float *sprite = sprites + (5*row * SPRITE_SIZE + col) * SPRITE_SIZE * 4;
+static void blend_sprite(
+        float *sprite, float *fg_color, float *bg_color, uint8_t *out) {
+    // Draw a single full-size sprite into a contiguous tile.
     int sprite_row = SPRITE_SIZE * 4 * 4;
-    row_stride -= SPRITE_SIZE * 3;
 
     for (int r=0; r<SPRITE_SIZE; r++) {
         for (int c=0; c<SPRITE_SIZE; c++) {
@@ -92,35 +97,99 @@ static inline void draw_sprite(
             out += 3;
             sprite += 4;
         }
-        out += row_stride;
         sprite += sprite_row;
     }
 }
 
 
+static void downscale_tile(uint8_t *tile, int scale, uint8_t *out) {
+    // Box filter a full-size tile down to `scale` pixels on a side.
+    for (int i=0; i<scale; i++) {
+        int r0 = i * SPRITE_SIZE / scale;
+        int r1 = (i+1) * SPRITE_SIZE / scale;
+        for (int j=0; j<scale; j++) {
+            int c0 = j * SPRITE_SIZE / scale;
+            int c1 = (j+1) * SPRITE_SIZE / scale;
+            int n = (r1 - r0) * (c1 - c0);
+            for (int k=0; k<3; k++) {
+                int total = 0;
+                for (int r=r0; r<r1; r++) {
+                    for (int c=c0; c<c1; c++) {
+                        total += tile[(r * SPRITE_SIZE + c) * 3 + k];
+                    }
+                }
+                *out++ = (total + n/2) / n;
+            }
+        }
+    }
+}
+
+
+void build_tiles(float *sprites, int scale, uint8_t *tiles) {
+    // Shapes should be:
+    //     sprites = (5 * SPRITE_SIZE, 5 * SPRITE_SIZE, 4)
+    //     tiles = (NUM_SPRITES, 8, 8, scale, scale, 3)
+    // with the tile axes being sprite index, foreground color, and
+    // background color.
+    uint8_t full_tile[FULL_TILE_BYTES];
+    int tile_size = scale * scale * 3;
+
+    for (int idx=0; idx < NUM_SPRITES; idx++) {
+        int row = idx / 5;
+        int col = idx % 5;
+        float *sprite = sprites + (5*row * SPRITE_SIZE + col) * SPRITE_SIZE * 4;
+        for (int fg=0; fg < 8; fg++) {
+            for (int bg=0; bg < 8; bg++) {
+                uint8_t *tile = tiles + ((idx * 8 + fg) * 8 + bg) * tile_size;
+                if (scale == SPRITE_SIZE) {
+                    blend_sprite(sprite,
+                        foreground_colors + fg*3, background_colors + bg*3, tile);
+                } else {
+                    blend_sprite(sprite,
+                        foreground_colors + fg*3, background_colors + bg*3,
+                        full_tile);
+                    downscale_tile(full_tile, scale, tile);
+                }
+            }
+        }
+    }
+}
+
+
 void render_board(
         uint16_t *board, uint16_t *goals, uint8_t *orientation,
         int width, int height, int depth,
-        float *sprites, uint8_t *out) {
+        uint8_t *tiles, int scale, uint8_t *out) {
 
     // Shapes should be:
     //     board = (depth, height, width)
     //     goals = (depth, height, width)
     //     orientation = (depth,)
-    //     sprites = (5 * SPRITE_SIZE, 5 * SPRITE_SIZE, 4)
-    //     out = (depth, height * SPRITE_SIZE, width * SPRITE_SIZE, 3)
+    //     tiles = (NUM_SPRITES, 8, 8, scale, scale, 3), from build_tiles()
+    //     out = (depth, height * scale, width * scale, 3)
 
-    int out_stride = width * SPRITE_SIZE * 3;
+    int tile_row = scale * 3;
+    int tile_size = scale * tile_row;
+    int out_stride = width * tile_row;
 
     for (int i=0; i < depth; i++) {
         for (int j=0; j < height; j++) {
             for (int k=0; k < width; k++) {
-                draw_sprite(*board, *goals, *orientation, sprites, out, out_stride);
+                int fg = (*board & color_mask) >> COLOR_BIT;
+                int bg = (*goals & color_mask) >> COLOR_BIT;
+                int idx = sprite_index(*board, *orientation);
+                uint8_t *tile = tiles + ((idx * 8 + fg) * 8 + bg) * tile_size;
+                uint8_t *dest = out;
+                for (int r=0; r < scale; r++) {
+                    memcpy(dest, tile, tile_row);
+                    dest += out_stride;
+                    tile += tile_row;
+                }
                 board++;
                 goals++;
-                out += SPRITE_SIZE * 3;
+                out += tile_row;
             }
-            out += out_stride * (SPRITE_SIZE - 1);
+            out += out_stride * (scale - 1);
         }
         orientation++;
     }
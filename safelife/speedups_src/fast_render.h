@@ -1,8 +1,10 @@
 #include <stdint.h>
 
+void build_tiles(float *sprites, int scale, uint8_t *tiles);
+
 void render_board(
     uint16_t *board, uint16_t *goals, uint8_t *orientation,
     int width, int height, int depth,
-    float *sprites, uint8_t *out);
+    uint8_t *tiles, int scale, uint8_t *out);
 
 extern const int SPRITE_SIZE;
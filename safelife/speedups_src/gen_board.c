@@ -1,6 +1,11 @@
 #include <stdint.h>
+#include <stdlib.h>
+#include <limits.h>
 #include <string.h>
 #include <math.h>
+#ifndef _WIN32
+    #include <pthread.h>
+#endif
 #include "constants.h"
 #include "iset.h"
 #include "gen_board.h"
@@ -35,11 +40,21 @@ typedef struct {
 
 
 typedef struct {
-    int x1;
-    int y1;
-    int x2;
-    int y2;
-} bounds_t;
+    // Scratch space for tracking which cells need to be updated when
+    // propagating a swap through the layers of the board.
+    // All indices are within a single layer.
+    int layer_size;
+    int *neighborhoods;  // wrapped 3x3 neighborhood of each cell
+    int *cur;
+    int *next;
+    int *touched;
+    int num_next;
+    int num_touched;
+    uint32_t *next_stamp;
+    uint32_t *touched_stamp;
+    uint32_t stamp;
+    uint32_t swap_stamp;
+} dirty_cells_t;
 
 
 static int idx_for_cell_type(uint16_t cell) {
@@ -125,27 +140,27 @@ static int _idx(int i, int j, int k, board_shape_t s) {
 
 
 static int swap_single_cell(
-        uint16_t *board, int *neighbors, board_shape_t board_shape,
-        int layer, int row, int col, uint16_t new_cell) {
+        uint16_t *board, int *neighbors, const int *neighborhood,
+        int layer_offset, int i0, uint16_t new_cell) {
     // Swap out a single cell type and update the neighboring cells.
+    // The neighborhood should contain the (wrapped, single-layer) indices of
+    // the 3x3 block centered on i0, and layer_offset is the index of the
+    // start of the layer.
     // Returns:
     //     0 if new cell is the same as old cell
     //     1 if only FROZEN bit switched
     //     2 if ALIVE bit switched
-    int i0 = _idx(layer, row, col, board_shape);
-    uint16_t old_cell = board[i0];
+    uint16_t old_cell = board[layer_offset + i0];
     if (old_cell == new_cell) {
         return 0;
     }
 
-    board[i0] = new_cell;
+    board[layer_offset + i0] = new_cell;
     int delta_alive = (new_cell & ALIVE) - (old_cell & ALIVE);
 
     if (delta_alive) {
-        for (int r = row-1; r <= row+1; r++) {
-            for (int c = col-1; c <= col+1; c++) {
-                neighbors[_idx(layer, r, c, board_shape)] += delta_alive;
-            }
+        for (int k = 0; k < 9; k++) {
+            neighbors[layer_offset + neighborhood[k]] += delta_alive;
         }
         return 2;
     } else {
@@ -186,128 +201,162 @@ static int check_for_violation(uint16_t src, uint16_t dst, int neighbors) {
 }*/
 
 
+static void mark_dirty(dirty_cells_t *d, int idx) {
+    // Add a cell to the next layer's dirty list and to the set of all
+    // touched cells, skipping cells that are already there.
+    if (d->next_stamp[idx] != d->stamp) {
+        d->next_stamp[idx] = d->stamp;
+        d->next[d->num_next++] = idx;
+    }
+    if (d->touched_stamp[idx] != d->swap_stamp) {
+        d->touched_stamp[idx] = d->swap_stamp;
+        d->touched[d->num_touched++] = idx;
+    }
+}
+
+
+static void mark_dirty_neighbors(dirty_cells_t *d, int idx) {
+    const int *neighborhood = d->neighborhoods + 9*idx;
+    for (int k = 0; k < 9; k++) {
+        mark_dirty(d, neighborhood[k]);
+    }
+}
+
+
+static void next_stamp(dirty_cells_t *d) {
+    if (++d->stamp == 0) {
+        // Wrapped around. Reset everything so that stale stamps don't match.
+        memset(d->next_stamp, 0, sizeof(uint32_t) * d->layer_size);
+        memset(d->touched_stamp, 0, sizeof(uint32_t) * d->layer_size);
+        d->stamp = d->swap_stamp = 1;
+    }
+}
+
+
 static swap_cells_t swap_cells(
         uint16_t *board, int *neighbors, int *violations, int *oscillations, int *mask,
-        board_shape_t board_shape, int row, int col, uint16_t new_cell,
-        iset *bad_idx) {
+        board_shape_t board_shape, int i0, uint16_t new_cell,
+        iset *bad_idx, dirty_cells_t *dirty) {
+    // Swap a single cell and propagate the change forward through each
+    // layer of the board.
+    // Only cells whose value or neighbor count changed in one layer can
+    // change in the next, so rather than re-evolving a growing bounding box
+    // we keep a list of these 'dirty' cells for each layer. Neighbor counts
+    // are updated incrementally as cells flip.
 
     swap_cells_t delta_swap = {0, 0};
-    bounds_t area_of_effect = {col, row, col, row};
     int layer_size = board_shape.rows * board_shape.cols;
-    // int start_cell = board[_idx(0, row, col, board_shape)]; // debug only!
 
     int did_swap = swap_single_cell(
-        board, neighbors, board_shape, 0, row, col, new_cell);
-    switch (did_swap) {
-        case 0: return delta_swap;
-        case 1: break;  // swap only changed frozen status
-        case 2:
-            area_of_effect.x1--;
-            area_of_effect.y1--;
-            area_of_effect.x2++;
-            area_of_effect.y2++;
-    }
-
-    for (int layer=1; layer < board_shape.depth; layer++) {
-        // Evolve the next layer outwards
-        int swap_types = 0;
-        for (int r = area_of_effect.y1; r <= area_of_effect.y2; r++) {
-            for (int c = area_of_effect.x1; c <= area_of_effect.x2; c++) {
-                int i1 = _idx(layer-1, r, c, board_shape);
-                uint16_t b1 = board[i1], b2;
-                int n1 = neighbors[i1];
-                if (b1 & FROZEN) {
-                    b2 = b1;
-                } else if (b1 & ALIVE) {
-                    b2 = (n1 == 3 || n1 == 4) ? b1 : 0;
-                } else {
-                    b2 = (n1 == 3) ? ALIVE : b1;
-                }
-                did_swap = swap_single_cell(
-                        board, neighbors, board_shape, layer, r, c, b2);
-                swap_types |= did_swap;
-                if (did_swap) {
-                    if (c == area_of_effect.x1) area_of_effect.x1 -= 1;
-                    if (c == area_of_effect.x2) area_of_effect.x2 += 1;
-                    if (r == area_of_effect.y1) area_of_effect.y1 -= 1;
-                    if (r == area_of_effect.y2) area_of_effect.y2 += 1;
-                }
-            }
-        }
-        if (!swap_types) break;  // end early; nothing to do.
+        board, neighbors, dirty->neighborhoods + 9*i0, 0, i0, new_cell);
+    if (!did_swap) return delta_swap;
+
+    next_stamp(dirty);
+    dirty->swap_stamp = dirty->stamp;
+    dirty->num_next = 0;
+    dirty->num_touched = 0;
+    if (did_swap == 2) {
+        // alive status changed, so the neighbor counts changed too
+        mark_dirty_neighbors(dirty, i0);
+    } else {
+        mark_dirty(dirty, i0);
     }
 
-    // Loop through the updated area and update the violations and oscillations
-    int total_violations = 0; // Debug only!
-    for (int r = area_of_effect.y1; r <= area_of_effect.y2; r++) {
-        for (int c = area_of_effect.x1; c <= area_of_effect.x2; c++) {
-            int i1 = _idx(0, r, c, board_shape);
-            int i2 = i1;
-            int _oscillations, _violations;
-            // oscillations are given by storing dead bits in the usual ALIVE
-            // spot, and live bits in the next bit over. If both are present
-            // the total should be 3 * ALIVE.
-            const int is_osc = 3 * ALIVE;
+    for (int layer=1; layer < board_shape.depth && dirty->num_next; layer++) {
+        // Evolve the dirty cells from the previous layer into this one.
+        int *cells = dirty->next;
+        int num_cells = dirty->num_next;
+        dirty->next = dirty->cur;
+        dirty->cur = cells;
+        dirty->num_next = 0;
+        next_stamp(dirty);
+        for (int k = 0; k < num_cells; k++) {
+            int i1 = cells[k] + (layer-1) * layer_size;
             uint16_t b1 = board[i1], b2;
+            int n1 = neighbors[i1];
             if (b1 & FROZEN) {
-                _oscillations = 0;
-                _violations = 0;
-            } else {
-                // Got to loop through layers to check for oscillations
                 b2 = b1;
-                _oscillations = (b1 & ALIVE) + ALIVE;
-                for (int layer=1; layer < board_shape.depth; layer++) {
-                    i2 += layer_size;
-                    b2 = board[i2];
-                    _oscillations |= (b2 & ALIVE) + ALIVE;
-                }
-                _violations = check_for_violation(b2, b1, neighbors[i2]);
-            }
-            if (_oscillations == is_osc && !(mask[i1] & CAN_OSCILLATE_MASK)) {
-                _violations += 1;
+            } else if (b1 & ALIVE) {
+                b2 = (n1 == 3 || n1 == 4) ? b1 : 0;
+            } else {
+                b2 = (n1 == 3) ? ALIVE : b1;
             }
-            delta_swap.violations += _violations - violations[i1];
-            delta_swap.oscillations += (_oscillations == is_osc);
-            delta_swap.oscillations -= (oscillations[i1] == is_osc);
-            violations[i1] = _violations;
-            oscillations[i1] = _oscillations;
-            total_violations += _violations;
-            if (bad_idx) {
-                if (_violations && (mask[i1] & INCLUDE_VIOLATIONS_MASK)) {
-                    iset_add(bad_idx, i1);
-                } else {
-                    iset_discard(bad_idx, i1);
-                }
+            did_swap = swap_single_cell(
+                    board, neighbors, dirty->neighborhoods + 9*cells[k],
+                    layer * layer_size, cells[k], b2);
+            if (did_swap == 2) {
+                mark_dirty_neighbors(dirty, cells[k]);
+            } else if (did_swap) {
+                mark_dirty(dirty, cells[k]);
             }
         }
     }
 
-    // Print out the area of effect (for debugging only)
-    /*PRINT("\nswap cells: %c -> %c\n", print_cell(start_cell), print_cell(new_cell));
-    PRINT("are of effect: %i, %i, %i, %i\n", area_of_effect.x1, area_of_effect.y1, area_of_effect.x2, area_of_effect.y2);
-    PRINT("violations=%i\n", total_violations);
-    for (int layer=0; layer < board_shape.depth; layer++) {
-        PRINT("t = %i\n", layer);
-        for (int r=row-2; r <= row+2; r++) {
-            PRINT("   ");
-            for (int c=col-2; c <= col+2; c++) {
-                PRINT(" %c", print_cell(board[_idx(layer, r, c, board_shape)]));
-            }
-            PRINT("  | ");
-            for (int c=col-2; c <= col+2; c++) {
-                PRINT(" %i", neighbors[_idx(layer, r, c, board_shape)]);
+    if (bad_idx) {
+        // Update in board order (row by row, centered on the swapped cell)
+        // so that the order of the bad indices, and therefore which ones get
+        // sampled, doesn't depend on the order in which the changes
+        // propagated. Lists are short, so just use an insertion sort.
+        int *touched = dirty->touched;
+        int *keys = dirty->cur;
+        int rows = board_shape.rows, cols = board_shape.cols;
+        int row0 = i0 / cols + rows - rows / 2;
+        int col0 = i0 % cols + cols - cols / 2;
+        for (int k = 0; k < dirty->num_touched; k++) {
+            int r = (touched[k] / cols - row0 + 2*rows) % rows;
+            int c = (touched[k] % cols - col0 + 2*cols) % cols;
+            int key = r * cols + c;
+            int val = touched[k];
+            int j = k;
+            for (; j > 0 && keys[j-1] > key; j--) {
+                keys[j] = keys[j-1];
+                touched[j] = touched[j-1];
             }
-            PRINT("  | ");
-            for (int c=col-2; c <= col+2; c++) {
-                PRINT(" %i", violations[_idx(0, r, c, board_shape)]);
+            keys[j] = key;
+            touched[j] = val;
+        }
+    }
+
+    // Loop through the touched cells and update the violations and oscillations
+    for (int k = 0; k < dirty->num_touched; k++) {
+        int i1 = dirty->touched[k];
+        int i2 = i1;
+        int _oscillations, _violations;
+        // oscillations are given by storing dead bits in the usual ALIVE
+        // spot, and live bits in the next bit over. If both are present
+        // the total should be 3 * ALIVE.
+        const int is_osc = 3 * ALIVE;
+        uint16_t b1 = board[i1], b2;
+        if (b1 & FROZEN) {
+            _oscillations = 0;
+            _violations = 0;
+        } else {
+            // Got to loop through layers to check for oscillations
+            b2 = b1;
+            _oscillations = (b1 & ALIVE) + ALIVE;
+            for (int layer=1; layer < board_shape.depth; layer++) {
+                i2 += layer_size;
+                b2 = board[i2];
+                _oscillations |= (b2 & ALIVE) + ALIVE;
             }
-            PRINT("  | ");
-            for (int c=col-2; c <= col+2; c++) {
-                PRINT(" %i", oscillations[_idx(0, r, c, board_shape)]);
+            _violations = check_for_violation(b2, b1, neighbors[i2]);
+        }
+        if (_oscillations == is_osc && !(mask[i1] & CAN_OSCILLATE_MASK)) {
+            _violations += 1;
+        }
+        delta_swap.violations += _violations - violations[i1];
+        delta_swap.oscillations += (_oscillations == is_osc);
+        delta_swap.oscillations -= (oscillations[i1] == is_osc);
+        violations[i1] = _violations;
+        oscillations[i1] = _oscillations;
+        if (bad_idx) {
+            if (_violations && (mask[i1] & INCLUDE_VIOLATIONS_MASK)) {
+                iset_add(bad_idx, i1);
+            } else {
+                iset_discard(bad_idx, i1);
             }
-            PRINT("\n");
         }
-    }*/
+    }
 
     return delta_swap;
 }
@@ -315,8 +364,9 @@ static swap_cells_t swap_cells(
 
 int gen_pattern(
         uint16_t *board, int32_t *mask, int32_t *seeds, board_shape_t shape,
-        double rel_max_iter, double rel_min_fill, double temperature, double osc_bonus,
-        double *cell_penalties) {
+        double rel_max_iter, double rel_min_fill, double rel_max_fill,
+        double temperature, double osc_bonus, double *cell_penalties,
+        volatile int *stop_iter, int *num_iter_out) {
     PRINT("\nStarting the oscillator! (%i %i %i)\n", shape.depth, shape.rows, shape.cols);
 
     // Assume that the board is already filled out in multiple layers.
@@ -326,10 +376,42 @@ int gen_pattern(
     int last_layer_idx = board_size - layer_size;
     int total_area = 0;
 
-    int neighbors[board_size];
-    int oscillations[layer_size];
-    int violations[layer_size];
+    // Note that these are allocated on the heap rather than the stack so
+    // that large boards can be generated on threads with small stacks.
+    int *neighbors = malloc(sizeof(int) * board_size);
+    int *oscillations = calloc(layer_size, sizeof(int));
+    int *violations = malloc(sizeof(int) * layer_size);
+    int *temp = malloc(sizeof(int) * layer_size);
+    int *dirty_lists = malloc(sizeof(int) * 12 * layer_size);
+    uint32_t *dirty_stamps = calloc(2 * layer_size, sizeof(uint32_t));
     int totals[4] = {0, 0, 0, 0};
+    if (!neighbors || !oscillations || !violations || !temp ||
+            !dirty_lists || !dirty_stamps) {
+        free(neighbors);
+        free(oscillations);
+        free(violations);
+        free(temp);
+        free(dirty_lists);
+        free(dirty_stamps);
+        return MEMORY_ERROR;
+    }
+    dirty_cells_t dirty = {
+        layer_size,
+        dirty_lists + 3*layer_size,
+        dirty_lists, dirty_lists + layer_size, dirty_lists + 2*layer_size,
+        0, 0,
+        dirty_stamps, dirty_stamps + layer_size,
+        0, 0
+    };
+    for (int r = 0, i = 0; r < shape.rows; r++) {
+        for (int c = 0; c < shape.cols; c++) {
+            for (int dr = -1; dr <= 1; dr++) {
+                for (int dc = -1; dc <= 1; dc++) {
+                    dirty.neighborhoods[i++] = _idx(0, r+dr, c+dc, shape);
+                }
+            }
+        }
+    }
     iset bad_idx = iset_alloc(layer_size);
     iset unmasked_idx = iset_alloc(layer_size);
     iset seeds_idx = iset_alloc(layer_size);
@@ -337,21 +419,28 @@ int gen_pattern(
     for (int i=0; i < board_size; i++) {
         neighbors[i] = board[i] & ALIVE;
     }
-    memset(oscillations, 0, sizeof(oscillations));
     for (int i=0; i < shape.depth; i++) {
         for (int k=0; k < layer_size; k++) {
             oscillations[k] |= (board[k + i*layer_size] & ALIVE) + ALIVE;
         }
     }
+    for (int k=0; k < layer_size; k++) {
+        // Frozen cells never count as oscillating (same as in swap_cells).
+        if (board[k] & FROZEN) oscillations[k] = 0;
+    }
 
     for (int i=0; i < shape.depth; i++) {
-        int temp[layer_size];
         wrapped_convolve(neighbors + i*layer_size, temp, shape.rows, shape.cols);
     }
 
     for (int i=0; i < layer_size; i++) {
         violations[i] = check_for_violation(
             board[i + last_layer_idx], board[i], neighbors[i + last_layer_idx]);
+        if (oscillations[i] == 3 * ALIVE && !(mask[i] & CAN_OSCILLATE_MASK)) {
+            // Needs to match the violations calculated in swap_cells, since
+            // cells only get recalculated when something nearby changes.
+            violations[i] += 1;
+        }
         if (seeds[i]) {
             iset_add(&seeds_idx, i);
         }
@@ -371,6 +460,7 @@ int gen_pattern(
     //int interior_area = calc_interior_area(mask, shape.rows, shape.cols);
     //double effective_area = 0.75 * interior_area + 0.25 * total_area;
     double min_fill = rel_min_fill * total_area;
+    double max_fill = rel_max_fill * total_area;
     PRINT("Total area: %i; ", total_area);
     // PRINT("Interior area: %i\n", interior_area);
     // if (interior_area < 2) {
@@ -383,11 +473,17 @@ int gen_pattern(
     // And start the loop!
     int num_iter;
     int not_empty = 0;
+    int aborted = 0;
     for (num_iter=0; num_iter < max_iter; num_iter++) {
         not_empty = total_area - totals[EMPTY_IDX];
         if (bad_idx.size == 0 && not_empty >= min_fill) {
             break;  // Success!
         }
+        if (stop_iter && num_iter >= *stop_iter) {
+            // Some other chain has already succeeded in fewer iterations.
+            aborted = 1;
+            break;
+        }
 
         // Sample a point
         int k0, r0, c0;
@@ -439,7 +535,7 @@ int gen_pattern(
                     uint16_t target_type = cell_type_array[j & 3];
                     swap_cells_t delta = swap_cells(
                         board, neighbors, violations, oscillations, mask,
-                        shape, r, c, target_type, NULL);
+                        shape, i1, target_type, NULL, &dirty);
                     delta_violations += delta.violations;
                     delta_oscillations += delta.oscillations;
                     log_probs[num_switched] = delta_violations;
@@ -457,7 +553,7 @@ int gen_pattern(
                 //PRINT("swap back!\n");
                 swap_cells(
                     board, neighbors, violations, oscillations, mask,
-                    shape, r, c, current_cell, NULL);
+                    shape, i1, current_cell, NULL, &dirty);
             }
         }
 
@@ -482,8 +578,7 @@ int gen_pattern(
                 //     cell_idx / shape.cols, cell_idx % shape.cols, mask[cell_idx]);
                 swap_cells(
                     board, neighbors, violations, oscillations, mask,
-                    shape, cell_idx / shape.cols, cell_idx % shape.cols,
-                    new_cell, &bad_idx);
+                    shape, cell_idx, new_cell, &bad_idx, &dirty);
                 totals[idx_for_cell_type(old_cell)]--;
                 totals[idx_for_cell_type(new_cell)]++;
                 break;
@@ -495,11 +590,176 @@ int gen_pattern(
         }
     }
 
+    free(neighbors);
+    free(oscillations);
+    free(violations);
+    free(temp);
+    free(dirty_lists);
+    free(dirty_stamps);
     iset_free(&bad_idx);
     iset_free(&unmasked_idx);
     iset_free(&seeds_idx);
     PRINT("Iterations: %i/%i\n", num_iter, max_iter);
     PRINT("Num alive: %i/%i\n", totals[ALIVE_IDX], total_area);
-    return num_iter == max_iter ? MAX_ITER_ERROR : 0;
+    if (num_iter_out) *num_iter_out = num_iter;
+    if (aborted) return ABORTED_ERROR;
+    if (num_iter == max_iter) return MAX_ITER_ERROR;
+    if (not_empty > max_fill) return OVERFILL_ERROR;
+    return 0;
+}
+
+
+typedef struct {
+    // Inputs
+    uint16_t *board;
+    int32_t *mask;
+    int32_t *seeds;
+    board_shape_t shape;
+    double rel_max_iter;
+    double rel_min_fill;
+    double rel_max_fill;
+    double temperature;
+    double osc_bonus;
+    double *cell_penalties;
+    void *bitgen;
+    // Shared between chains
+    volatile int *best_iter;
+#ifndef _WIN32
+    pthread_mutex_t *lock;
+#endif
+    // Outputs
+    int err_code;
+    int num_iter;
+} chain_t;
+
+
+static void *run_chain(void *arg) {
+    chain_t *chain = arg;
+
+    // Chains may run on the calling thread, so restore its generator after.
+    void *old_bitgen = set_local_bit_generator(chain->bitgen);
+    chain->err_code = gen_pattern(
+        chain->board, chain->mask, chain->seeds, chain->shape,
+        chain->rel_max_iter, chain->rel_min_fill, chain->rel_max_fill,
+        chain->temperature, chain->osc_bonus, chain->cell_penalties,
+        chain->best_iter, &chain->num_iter);
+    set_local_bit_generator(old_bitgen);
+
+    if (chain->err_code == 0) {
+        // Let the other chains know that they can stop once they pass us.
+#ifndef _WIN32
+        pthread_mutex_lock(chain->lock);
+#endif
+        if (chain->num_iter < *chain->best_iter) {
+            *chain->best_iter = chain->num_iter;
+        }
+#ifndef _WIN32
+        pthread_mutex_unlock(chain->lock);
+#endif
+    }
+    return NULL;
+}
+
+
+int gen_pattern_chains(
+        uint16_t *board, int32_t *mask, int32_t *seeds, board_shape_t shape,
+        double rel_max_iter, double rel_min_fill, double rel_max_fill,
+        double *temperatures, void **bitgens, int num_chains,
+        double osc_bonus, double *cell_penalties, int *num_iter_out) {
+    // Run several independent chains (typically at different temperatures),
+    // each with its own bit generator, and keep the result of the chain that
+    // converged in the fewest iterations. Ties go to the lower chain index,
+    // so the output doesn't depend on thread scheduling.
+    // Chains that converge but overfill the board only get returned if no
+    // other chain succeeded, so that the caller can decide what to do.
+    int board_size = shape.depth * shape.rows * shape.cols;
+    int err_code = MAX_ITER_ERROR;
+    volatile int best_iter = INT_MAX;
+    chain_t *chains = calloc(num_chains, sizeof(chain_t));
+    uint16_t *boards = malloc(sizeof(uint16_t) * board_size * num_chains);
+
+    if (!chains || !boards) {
+        free(chains);
+        free(boards);
+        return MEMORY_ERROR;
+    }
+
+#ifndef _WIN32
+    pthread_mutex_t lock;
+    pthread_t *threads = malloc(sizeof(pthread_t) * num_chains);
+    int *started = calloc(num_chains, sizeof(int));
+    if (!threads || !started) {
+        free(chains);
+        free(boards);
+        free(threads);
+        free(started);
+        return MEMORY_ERROR;
+    }
+    pthread_mutex_init(&lock, NULL);
+#endif
+
+    for (int n = 0; n < num_chains; n++) {
+        chain_t *chain = chains + n;
+        chain->board = boards + n * board_size;
+        memcpy(chain->board, board, sizeof(uint16_t) * board_size);
+        chain->mask = mask;
+        chain->seeds = seeds;
+        chain->shape = shape;
+        chain->rel_max_iter = rel_max_iter;
+        chain->rel_min_fill = rel_min_fill;
+        chain->rel_max_fill = rel_max_fill;
+        chain->temperature = temperatures[n];
+        chain->osc_bonus = osc_bonus;
+        chain->cell_penalties = cell_penalties;
+        // Without explicit generators, use the calling thread's generator
+        // (there's only one chain in that case, so it isn't shared).
+        chain->bitgen = bitgens ? bitgens[n] : current_bit_generator_state();
+        chain->best_iter = &best_iter;
+#ifndef _WIN32
+        chain->lock = &lock;
+        // If a thread can't be started, just run the chain on this one.
+        started[n] = !pthread_create(threads + n, NULL, run_chain, chain);
+        if (!started[n]) run_chain(chain);
+#else
+        // No threads on Windows; run the chains one after another.
+        run_chain(chain);
+#endif
+    }
+
+#ifndef _WIN32
+    for (int n = 0; n < num_chains; n++) {
+        if (started[n]) pthread_join(threads[n], NULL);
+    }
+    pthread_mutex_destroy(&lock);
+    free(threads);
+    free(started);
+#endif
+
+    int best = -1;
+    int max_iter = 0;
+    for (int n = 0; n < num_chains; n++) {
+        if (chains[n].num_iter > max_iter) max_iter = chains[n].num_iter;
+        // Successful chains beat overfull chains, and then lowest iteration.
+        int code = chains[n].err_code;
+        if (code != 0 && code != OVERFILL_ERROR) {
+            if (best < 0 && code == MEMORY_ERROR) err_code = MEMORY_ERROR;
+            continue;
+        }
+        if (best < 0 ||
+                (code == 0 && chains[best].err_code != 0) ||
+                (code == chains[best].err_code &&
+                    chains[n].num_iter < chains[best].num_iter)) {
+            best = n;
+        }
+    }
+    if (best >= 0) {
+        memcpy(board, chains[best].board, sizeof(uint16_t) * board_size);
+        err_code = chains[best].err_code;
+    }
+    if (num_iter_out) *num_iter_out = best >= 0 ? chains[best].num_iter : max_iter;
+
+    free(chains);
+    free(boards);
+    return err_code;
 }
 
@@ -4,6 +4,9 @@ enum gen_board_errors {
     MAX_ITER_ERROR = -1,
     PROBABILITY_ERROR = -2,
     AREA_TOO_SMALL_ERROR = -3,
+    OVERFILL_ERROR = -4,
+    ABORTED_ERROR = -5,
+    MEMORY_ERROR = -6,
 };
 
 enum gen_mask_bits {
@@ -20,5 +23,12 @@ typedef struct {
 
 int gen_pattern(
         uint16_t *board, int32_t *mask, int32_t *seeds, board_shape_t shape,
-        double rel_max_iter, double rel_min_fill, double temperature, double osc_bonus,
-        double *cell_penalties);
+        double rel_max_iter, double rel_min_fill, double rel_max_fill,
+        double temperature, double osc_bonus, double *cell_penalties,
+        volatile int *stop_iter, int *num_iter_out);
+
+int gen_pattern_chains(
+        uint16_t *board, int32_t *mask, int32_t *seeds, board_shape_t shape,
+        double rel_max_iter, double rel_min_fill, double rel_max_fill,
+        double *temperatures, void **bitgens, int num_chains,
+        double osc_bonus, double *cell_penalties, int *num_iter_out);
@@ -6,6 +6,11 @@
 #include "wrapped_label.h"
 #include "random.h"
 #include "fast_render.h"
+#include "partition_regions.h"
+#include "build_fence.h"
+#include "render_ansi.h"
+#include "zobrist.h"
+#include "side_effects.h"
 
 #define PY_RUN_ERROR(msg) {PyErr_SetString(PyExc_RuntimeError, msg); goto error;}
 #define PY_VAL_ERROR(msg) {PyErr_SetString(PyExc_ValueError, msg); goto error;}
@@ -17,12 +22,39 @@ static PyObject *BadProbabilityException;
 static PyObject *InsufficientAreaException;
 
 
-static PyObject *advance_board_py(PyObject *self, PyObject *args) {
+static char advance_board_doc[] =
+    "advance_board(board, spawn_prob=0.3, return_neighbors=False)\n--\n\n"
+    "Advances the board one step.\n"
+    "\n"
+    "Parameters\n"
+    "----------\n"
+    "board : ndarray\n"
+    "    Two-dimensional board of cell types.\n"
+    "spawn_prob : float\n"
+    "    Probability that a spawner creates a new cell.\n"
+    "return_neighbors : bool\n"
+    "    If true, also return the number of live cells in each 3x3\n"
+    "    neighborhood (including the center) of the input board.\n"
+    "\n"
+    "Returns\n"
+    "-------\n"
+    "board : ndarray\n"
+    "neighbors : ndarray, dtype uint8\n"
+    "    Only returned if `return_neighbors` is true.\n";
+
+
+static PyObject *advance_board_py(PyObject *self, PyObject *args, PyObject *kw) {
     PyObject *board_obj;
-    PyArrayObject *b1, *b2;
+    PyArrayObject *b1, *b2, *neighbors = NULL;
     float spawn_prob = 0.3;
+    int return_neighbors = 0;
+    static char *kwlist[] = {"board", "spawn_prob", "return_neighbors", NULL};
 
-    if (!PyArg_ParseTuple(args, "O|f", &board_obj, &spawn_prob)) return NULL;
+    if (!PyArg_ParseTupleAndKeywords(
+            args, kw, "O|fp:advance_board", kwlist,
+            &board_obj, &spawn_prob, &return_neighbors)) {
+        return NULL;
+    }
     board_obj = PyArray_FROM_OTF(
         board_obj, NPY_UINT16, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
     if (!board_obj)  return NULL;
@@ -33,16 +65,29 @@ static PyObject *advance_board_py(PyObject *self, PyObject *args) {
     }
     b2 = (PyArrayObject *)PyArray_FROM_OTF(
         board_obj, NPY_UINT16, NPY_ARRAY_ENSURECOPY);
+    if (return_neighbors) {
+        neighbors = (PyArrayObject *)PyArray_SimpleNew(
+            2, PyArray_DIMS(b1), NPY_UINT8);
+        if (!neighbors) {
+            Py_DECREF(board_obj);
+            Py_XDECREF((PyObject *)b2);
+            return NULL;
+        }
+    }
     Py_BEGIN_ALLOW_THREADS
     advance_board(
         (uint16_t *)PyArray_DATA(b1),
         (uint16_t *)PyArray_DATA(b2),
         PyArray_DIM(b1, 0),
         PyArray_DIM(b1, 1),
-        spawn_prob
+        spawn_prob,
+        neighbors ? (uint8_t *)PyArray_DATA(neighbors) : NULL
     );
     Py_END_ALLOW_THREADS
     Py_DECREF(board_obj);
+    if (neighbors) {
+        return Py_BuildValue("NN", b2, neighbors);
+    }
     return (PyObject *)b2;
 }
 
@@ -96,7 +141,8 @@ static PyObject *wrapped_label_py(PyObject *self, PyObject *args) {
 
 static char gen_pattern_doc[] =
     "gen_pattern(board, mask, period, max_iter=40, min_fill=0.2, temperature=0.5, "
-        "alive=(0,0), wall=(100,100), tree=(100,100))\n"
+        "alive=(0,0), wall=(100,100), tree=(100,100), max_fill=1.0, "
+        "bit_generators=None, stats=None)\n"
     "--\n\n"
     "Generate a random (potentially oscillating) pattern.\n"
     "\n"
@@ -114,7 +160,10 @@ static char gen_pattern_doc[] =
     "    Maximum number of iterations to be run, relative to the board size.\n"
     "min_fill : float\n"
     "    Minimum fraction of the (unmasked) board that must be populated.\n"
-    "temperature : float\n"
+    "temperature : float or sequence of floats\n"
+    "    If a sequence, one annealing chain is run for each temperature.\n"
+    "    The chains run concurrently on separate threads, and the pattern\n"
+    "    from the chain that converges in the fewest iterations is returned.\n"
     "osc_bonus : float\n"
     "    Bonus applied to cells that are oscillating. Defaults to 0.3.\n"
     "    Larger bonuses encourage oscillators, as opposed to still lifes, but\n"
@@ -130,17 +179,34 @@ static char gen_pattern_doc[] =
     "tree : (float, float)\n"
     "    Penalties for 'tree' cells. Defaults to (100, 100), basically\n"
     "    guaranteeing that trees don't form.\n"
+    "max_fill : float\n"
+    "    Maximum fraction of the (unmasked) board that should be populated.\n"
+    "    When running multiple chains, chains that converge to an overfull\n"
+    "    pattern are only used if no other chain succeeds.\n"
+    "bit_generators : sequence of numpy.random.BitGenerator\n"
+    "    One independent bit generator per chain. Required if there is more\n"
+    "    than one temperature. If not supplied, the shared bit generator\n"
+    "    is used.\n"
+    "stats : dict\n"
+    "    If supplied, the number of annealing iterations that were run\n"
+    "    (for the returned chain) is stored under the key 'num_iter'.\n"
+    "    This is set even if an exception is raised.\n"
 ;
 
 static PyObject *gen_pattern_py(PyObject *self, PyObject *args, PyObject *kw) {
     PyObject *board_obj, *mask_obj, *seeds_obj = Py_None;
+    PyObject *temperature_obj = NULL, *bitgens_obj = Py_None;
+    PyObject *stats_obj = Py_None;
     PyArrayObject *board = NULL, *mask = NULL, *seeds = NULL;
+    PyArrayObject *temperatures = NULL;
 
     int period = 1;
     double max_iter = 40;
     double min_fill = 0.2;
-    double temperature = 0.5;
+    double max_fill = 1.0;
     double osc_bonus = 0.3;
+    int num_chains = 1;
+    void **bitgens = NULL;
     double cp[8] = {
         // intercept and slope of penalty
         0, 0,  // EMPTY (handled separately by min_fill)
@@ -151,16 +217,20 @@ static PyObject *gen_pattern_py(PyObject *self, PyObject *args, PyObject *kw) {
     static char *kwlist[] = {
         "board", "mask", "period", "seeds", "max_iter", "min_fill",
         "temperature", "osc_bonus", "alive", "wall", "tree",
-        NULL
+        "max_fill", "bit_generators", "stats", NULL
     };
     uint16_t *layers = NULL;
 
     if (!PyArg_ParseTupleAndKeywords(
-            args, kw, "OOi|Odddd(dd)(dd)(dd):gen_still_life",
+            args, kw, "OOi|OddOd(dd)(dd)(dd)dOO:gen_still_life",
             kwlist,
             &board_obj, &mask_obj, &period, &seeds_obj,
-            &max_iter, &min_fill, &temperature, &osc_bonus,
-            cp+4, cp+5, cp+2, cp+3, cp+6, cp+7)) {
+            &max_iter, &min_fill, &temperature_obj, &osc_bonus,
+            cp+4, cp+5, cp+2, cp+3, cp+6, cp+7, &max_fill, &bitgens_obj, &stats_obj)) {
+        return NULL;
+    }
+    if (stats_obj != Py_None && !PyDict_Check(stats_obj)) {
+        PyErr_SetString(PyExc_TypeError, "'stats' must be a dict or None.");
         return NULL;
     }
 
@@ -185,6 +255,42 @@ static PyObject *gen_pattern_py(PyObject *self, PyObject *args, PyObject *kw) {
     if (period <= 0) {
         PY_VAL_ERROR("Pattern period must be larger than 0.");
     }
+    if (temperature_obj) {
+        temperatures = (PyArrayObject *)PyArray_FROM_OTF(
+            temperature_obj, NPY_DOUBLE,
+            NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+        if (!temperatures) goto error;
+    } else {
+        temperatures = (PyArrayObject *)PyArray_SimpleNew(0, NULL, NPY_DOUBLE);
+        if (!temperatures) goto error;
+        *(double *)PyArray_DATA(temperatures) = 0.5;
+    }
+    num_chains = PyArray_SIZE(temperatures);
+    if (num_chains < 1) {
+        PY_VAL_ERROR("Must supply at least one temperature.");
+    }
+    if (bitgens_obj != Py_None) {
+        if (!PySequence_Check(bitgens_obj) ||
+                PySequence_Size(bitgens_obj) != num_chains) {
+            PY_VAL_ERROR("Must supply one bit generator per temperature.");
+        }
+        bitgens = malloc(sizeof(void *) * num_chains);
+        if (!bitgens) {
+            PyErr_NoMemory();
+            goto error;
+        }
+        for (int n = 0; n < num_chains; n++) {
+            // Borrow the states; the generators are kept alive by the
+            // bit_generators argument for the duration of the call.
+            PyObject *bitgen = PySequence_GetItem(bitgens_obj, n);
+            if (!bitgen) goto error;
+            bitgens[n] = get_bit_generator_state(bitgen);
+            Py_DECREF(bitgen);
+            if (!bitgens[n]) goto error;
+        }
+    } else if (num_chains > 1) {
+        PY_VAL_ERROR("Multiple chains require separate bit generators.");
+    }
     if (PyArray_NDIM(board) != 2 || PyArray_NDIM(mask) != 2 || PyArray_NDIM(seeds) != 2) {
         PY_VAL_ERROR("Board, mask, and seeds must all be dimension 2.");
     }
@@ -205,6 +311,7 @@ static PyObject *gen_pattern_py(PyObject *self, PyObject *args, PyObject *kw) {
     int layer_size = board_shape.cols * board_shape.rows;
     int board_size = board_shape.depth * layer_size;
     int err_code;
+    int num_iter = 0;
 
     layers = malloc(sizeof(uint16_t) * board_size);
     if (!layers)  {
@@ -219,22 +326,50 @@ static PyObject *gen_pattern_py(PyObject *self, PyObject *args, PyObject *kw) {
     for (int n = 1; n < board_shape.depth; n++) {
         advance_board(
             layers + (n-1)*layer_size, layers + n*layer_size,
-            board_shape.rows, board_shape.cols, 0.0);
+            board_shape.rows, board_shape.cols, 0.0, NULL);
     }
 
-    err_code = gen_pattern(
-        layers,
-        (int32_t *)PyArray_DATA(mask),
-        (int32_t *)PyArray_DATA(seeds),
-        board_shape, max_iter, min_fill, temperature, osc_bonus, cp
-    );
+    if (bitgens) {
+        err_code = gen_pattern_chains(
+            layers,
+            (int32_t *)PyArray_DATA(mask),
+            (int32_t *)PyArray_DATA(seeds),
+            board_shape, max_iter, min_fill, max_fill,
+            (double *)PyArray_DATA(temperatures), bitgens, num_chains,
+            osc_bonus, cp, &num_iter
+        );
+    } else {
+        err_code = gen_pattern(
+            layers,
+            (int32_t *)PyArray_DATA(mask),
+            (int32_t *)PyArray_DATA(seeds),
+            board_shape, max_iter, min_fill, max_fill,
+            *(double *)PyArray_DATA(temperatures), osc_bonus, cp,
+            NULL, &num_iter
+        );
+    }
 
     Py_END_ALLOW_THREADS
 
+    if (stats_obj != Py_None) {
+        PyObject *val = PyLong_FromLong(num_iter);
+        if (!val || PyDict_SetItemString(stats_obj, "num_iter", val)) {
+            Py_XDECREF(val);
+            goto error;
+        }
+        Py_DECREF(val);
+    }
+
     switch (err_code) {
         case 0:
+        case OVERFILL_ERROR:
+            // Overfull patterns are still returned; it's up to the caller
+            // to decide whether or not to keep them.
             memcpy(PyArray_DATA(board), layers, sizeof(uint16_t) * layer_size);
             goto success;
+        case MEMORY_ERROR:
+            PyErr_NoMemory();
+            goto error;
         case MAX_ITER_ERROR:
             PyErr_SetString(MaxIterException, "Max-iter hit. Aborting!");
             goto error;
@@ -250,6 +385,8 @@ static PyObject *gen_pattern_py(PyObject *self, PyObject *args, PyObject *kw) {
     success:
     Py_DECREF(mask);
     if (seeds_obj != Py_None) Py_DECREF(seeds);
+    Py_DECREF(temperatures);
+    free(bitgens);
     free(layers);
     return (PyObject *)board;
 
@@ -257,11 +394,258 @@ static PyObject *gen_pattern_py(PyObject *self, PyObject *args, PyObject *kw) {
     Py_XDECREF((PyObject *)board);
     Py_XDECREF((PyObject *)mask);
     if (seeds_obj != Py_None) Py_XDECREF(seeds);
+    Py_XDECREF((PyObject *)temperatures);
+    free(bitgens);
     if (layers) free(layers);
     return NULL;
 }
 
 
+static char build_fence_doc[] =
+    "build_fence(mask, shuffle=True)\n--\n\n"
+    "Create a fence around unmasked regions such that nothing inside the\n"
+    "regions can escape.\n"
+    "\n"
+    "Parameters\n"
+    "----------\n"
+    "mask : ndarray\n"
+    "    Binary array denoting regions around which to build fences (1) and\n"
+    "    everything else. Must be two-dimensional.\n"
+    "shuffle : bool\n"
+    "    If true, edge cells are visited in a random order.\n"
+    "\n"
+    "Returns\n"
+    "-------\n"
+    "fence : ndarray\n"
+    "    Binary array indicating fence locations. Same shape as input.\n";
+
+
+static PyObject *build_fence_py(PyObject *self, PyObject *args, PyObject *kw) {
+    PyObject *mask_obj;
+    PyArrayObject *mask, *fence;
+    int shuffle = 1;
+    static char *kwlist[] = {"mask", "shuffle", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(
+            args, kw, "O|p:build_fence", kwlist, &mask_obj, &shuffle)) {
+        return NULL;
+    }
+    mask = (PyArrayObject *)PyArray_FROM_OTF(
+        mask_obj, NPY_INT32, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    if (!mask)  return NULL;
+    if (PyArray_NDIM(mask) != 2 || PyArray_SIZE(mask) == 0) {
+        Py_DECREF((PyObject *)mask);
+        PyErr_SetString(PyExc_ValueError, "Mask must be a non-empty 2d array.");
+        return NULL;
+    }
+    fence = (PyArrayObject *)PyArray_SimpleNew(2, PyArray_DIMS(mask), NPY_INT32);
+    if (!fence) {
+        Py_DECREF((PyObject *)mask);
+        return NULL;
+    }
+
+    int err_code;
+    Py_BEGIN_ALLOW_THREADS
+    err_code = build_fence(
+        (int32_t *)PyArray_DATA(mask),
+        (int32_t *)PyArray_DATA(fence),
+        PyArray_DIM(mask, 0),
+        PyArray_DIM(mask, 1),
+        shuffle
+    );
+    Py_END_ALLOW_THREADS
+
+    Py_DECREF((PyObject *)mask);
+    if (err_code) {
+        Py_DECREF((PyObject *)fence);
+        return PyErr_NoMemory();
+    }
+    return (PyObject *)fence;
+}
+
+
+static char board_hash_doc[] =
+    "board_hash(board, salt=0)\n--\n\n"
+    "Zobrist-style hash of a board.\n"
+    "\n"
+    "The hash is the exclusive-or of a pseudo-random 64-bit key for each\n"
+    "non-empty cell, where the key depends on the cell's location and value.\n"
+    "It can therefore be updated incrementally as individual cells change.\n"
+    "\n"
+    "Parameters\n"
+    "----------\n"
+    "board : ndarray\n"
+    "    Two-dimensional board of cell types.\n"
+    "salt : int\n"
+    "    Unsigned 64-bit value mixed into every key. Use different salts to\n"
+    "    hash different kinds of boards (e.g., goals) independently.\n"
+    "\n"
+    "Returns\n"
+    "-------\n"
+    "int\n";
+
+
+static PyObject *board_hash_py(PyObject *self, PyObject *args, PyObject *kw) {
+    PyObject *board_obj;
+    PyArrayObject *board;
+    unsigned long long salt = 0;
+    uint64_t h;
+    static char *kwlist[] = {"board", "salt", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(
+            args, kw, "O|K:board_hash", kwlist, &board_obj, &salt)) {
+        return NULL;
+    }
+    board = (PyArrayObject *)PyArray_FROM_OTF(
+        board_obj, NPY_UINT16, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    if (!board)  return NULL;
+    if (PyArray_NDIM(board) != 2) {
+        Py_DECREF((PyObject *)board);
+        PyErr_SetString(PyExc_ValueError, "Board must be a 2d array.");
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    h = board_hash(
+        (uint16_t *)PyArray_DATA(board),
+        PyArray_DIM(board, 0),
+        PyArray_DIM(board, 1),
+        salt
+    );
+    Py_END_ALLOW_THREADS
+
+    Py_DECREF((PyObject *)board);
+    return PyLong_FromUnsignedLongLong(h);
+}
+
+
+static char side_effect_count_doc[] =
+    "side_effect_count(board, baseline, goals, exit_mask=None)\n--\n\n"
+    "Count the cells on the board that differ from a baseline.\n"
+    "\n"
+    "Player attributes are ignored, as are changes that earn the agent\n"
+    "points (removing red life, or creating life on blue goals).\n"
+    "\n"
+    "Parameters\n"
+    "----------\n"
+    "board : ndarray\n"
+    "baseline : ndarray\n"
+    "    Board to compare against, e.g. the starting state.\n"
+    "goals : ndarray\n"
+    "exit_mask : ndarray or None\n"
+    "    Boolean array marking cells (the level exits) to ignore.\n"
+    "    All arrays must have the same shape.\n"
+    "\n"
+    "Returns\n"
+    "-------\n"
+    "int\n";
+
+
+static PyObject *side_effect_count_py(PyObject *self, PyObject *args, PyObject *kw) {
+    PyObject *board_obj, *baseline_obj, *goals_obj, *mask_obj = Py_None;
+    PyArrayObject *board = NULL, *baseline = NULL, *goals = NULL, *mask = NULL;
+    int count;
+    static char *kwlist[] = {"board", "baseline", "goals", "exit_mask", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(
+            args, kw, "OOO|O:side_effect_count", kwlist,
+            &board_obj, &baseline_obj, &goals_obj, &mask_obj)) {
+        return NULL;
+    }
+    board = (PyArrayObject *)PyArray_FROM_OTF(
+        board_obj, NPY_UINT16, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    if (!board)  goto error;
+    baseline = (PyArrayObject *)PyArray_FROM_OTF(
+        baseline_obj, NPY_UINT16, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    if (!baseline)  goto error;
+    goals = (PyArrayObject *)PyArray_FROM_OTF(
+        goals_obj, NPY_UINT16, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    if (!goals)  goto error;
+    if (mask_obj != Py_None) {
+        mask = (PyArrayObject *)PyArray_FROM_OTF(
+            mask_obj, NPY_BOOL, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+        if (!mask)  goto error;
+    }
+    if (!PyArray_SAMESHAPE(board, baseline) ||
+            !PyArray_SAMESHAPE(board, goals) ||
+            (mask && !PyArray_SAMESHAPE(board, mask))) {
+        PyErr_SetString(PyExc_ValueError, "Input arrays must be the same shape.");
+        goto error;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    count = side_effect_count(
+        (uint16_t *)PyArray_DATA(board),
+        (uint16_t *)PyArray_DATA(baseline),
+        (uint16_t *)PyArray_DATA(goals),
+        mask ? (uint8_t *)PyArray_DATA(mask) : NULL,
+        PyArray_SIZE(board)
+    );
+    Py_END_ALLOW_THREADS
+
+    Py_DECREF((PyObject *)board);
+    Py_DECREF((PyObject *)baseline);
+    Py_DECREF((PyObject *)goals);
+    Py_XDECREF((PyObject *)mask);
+    return PyLong_FromLong(count);
+
+    error:
+    Py_XDECREF((PyObject *)board);
+    Py_XDECREF((PyObject *)baseline);
+    Py_XDECREF((PyObject *)goals);
+    Py_XDECREF((PyObject *)mask);
+    return NULL;
+}
+
+
+static char make_partioned_regions_doc[] =
+    "make_partioned_regions(shape, alpha=1.0, max_regions=5, min_regions=2)\n"
+    "--\n\n"
+    "Create a board with distinct regions.\n"
+    "\n"
+    "See :func:`safelife.proc_gen.make_partioned_regions`.\n";
+
+
+static PyObject *make_partioned_regions_py(
+        PyObject *self, PyObject *args, PyObject *kw) {
+    int nrow, ncol;
+    double alpha = 1.0;
+    int max_regions = 5;
+    int min_regions = 2;
+    static char *kwlist[] = {
+        "shape", "alpha", "max_regions", "min_regions", NULL
+    };
+
+    if (!PyArg_ParseTupleAndKeywords(
+            args, kw, "(ii)|dii:make_partioned_regions", kwlist,
+            &nrow, &ncol, &alpha, &max_regions, &min_regions)) {
+        return NULL;
+    }
+    if (nrow <= 0 || ncol <= 0) {
+        PyErr_SetString(PyExc_ValueError, "Shape must be positive.");
+        return NULL;
+    }
+
+    npy_intp dims[2] = {nrow, ncol};
+    PyArrayObject *board = (PyArrayObject *)PyArray_SimpleNew(
+        2, dims, NPY_INT16);
+    if (!board)  return NULL;
+
+    int err_code;
+    Py_BEGIN_ALLOW_THREADS
+    err_code = make_partioned_regions(
+        (int16_t *)PyArray_DATA(board), nrow, ncol,
+        alpha, max_regions, min_regions);
+    Py_END_ALLOW_THREADS
+
+    if (err_code) {
+        Py_DECREF((PyObject *)board);
+        return PyErr_NoMemory();
+    }
+    return (PyObject *)board;
+}
+
+
 static PyObject *seed_py(PyObject *self, PyObject *args) {
     unsigned int i;
     if (!PyArg_ParseTuple(args, "I", &i)) return NULL;
@@ -280,18 +664,69 @@ static PyObject *set_bit_generator_py(PyObject *self, PyObject *args) {
 }
 
 
+static PyObject *set_local_bit_generator_py(PyObject *self, PyObject *args) {
+    // Note that only the bit generator's state is saved, not the object
+    // itself, so the caller must keep the generator alive while it's set.
+    PyObject *bit_gen_obj;
+    void *state = NULL;
+    if (!PyArg_ParseTuple(args, "O", &bit_gen_obj)) return NULL;
+    if (bit_gen_obj != Py_None) {
+        state = get_bit_generator_state(bit_gen_obj);
+        if (!state) return NULL;
+    }
+    set_local_bit_generator(state);
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+
+static PyObject *build_tiles_py(PyObject *self, PyObject *args) {
+    PyObject *sprites_obj;
+    PyArrayObject *sprites = NULL, *tiles = NULL;
+    int scale;
+
+    if (!PyArg_ParseTuple(args, "Oi", &sprites_obj, &scale)) {
+        return NULL;
+    }
+    sprites = (PyArrayObject *)PyArray_FROM_OTF(
+        sprites_obj, NPY_FLOAT32, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    if (!sprites) goto error;
+    if (PyArray_SIZE(sprites) != 70*70*4) {
+        PY_VAL_ERROR("Sprites should have shape (70, 70, 4).");
+    }
+    if (scale < 1 || scale > SPRITE_SIZE) {
+        PY_VAL_ERROR("Scale must be between 1 and 14.");
+    }
+    npy_intp dims[6] = {20, 8, 8, scale, scale, 3};
+    tiles = (PyArrayObject *)PyArray_SimpleNew(6, dims, NPY_UINT8);
+    if (!tiles) goto error;
+
+    Py_BEGIN_ALLOW_THREADS
+    build_tiles(
+        (float *)PyArray_DATA(sprites), scale, (uint8_t *)PyArray_DATA(tiles));
+    Py_END_ALLOW_THREADS
+
+    Py_DECREF(sprites);
+    return (PyObject *)tiles;
+
+    error:
+    Py_XDECREF(sprites);
+    return NULL;
+}
+
+
 static PyObject *render_board_py(PyObject *self, PyObject *args) {
-    PyObject *board_obj, *goals_obj, *orientation_obj, *sprites_obj;
+    PyObject *board_obj, *goals_obj, *orientation_obj, *tiles_obj;
     PyArrayObject
         *board = NULL,
         *goals = NULL,
         *orientation = NULL,
-        *sprites = NULL,
+        *tiles = NULL,
         *out = NULL;
 
     if (!PyArg_ParseTuple(
             args, "OOOO",
-            &board_obj, &goals_obj, &orientation_obj, &sprites_obj)) {
+            &board_obj, &goals_obj, &orientation_obj, &tiles_obj)) {
         return NULL;
     }
 
@@ -301,11 +736,11 @@ static PyObject *render_board_py(PyObject *self, PyObject *args) {
         goals_obj, NPY_UINT16, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
     orientation = (PyArrayObject *)PyArray_FROM_OTF(
         orientation_obj, NPY_UINT8, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
-    sprites = (PyArrayObject *)PyArray_FROM_OTF(
-        sprites_obj, NPY_FLOAT32, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    tiles = (PyArrayObject *)PyArray_FROM_OTF(
+        tiles_obj, NPY_UINT8, NPY_ARRAY_IN_ARRAY);
 
     // bunch of error checking
-    if (!board || !goals || !orientation || !sprites) {
+    if (!board || !goals || !orientation || !tiles) {
         PY_VAL_ERROR("All inputs must be numpy arrays.");
     }
     int ndim = PyArray_NDIM(board);
@@ -320,17 +755,21 @@ static PyObject *render_board_py(PyObject *self, PyObject *args) {
     if (PyArray_SIZE(orientation) != depth) {
         PY_VAL_ERROR("Only one orientation allowed per board.");
     }
-    if (PyArray_SIZE(sprites) != 70*70*4) {
-        PY_VAL_ERROR("Sprites should have shape (70, 70, 4).");
+    if (PyArray_NDIM(tiles) != 6 || PyArray_DIM(tiles, 0) != 20 ||
+            PyArray_DIM(tiles, 1) != 8 || PyArray_DIM(tiles, 2) != 8 ||
+            PyArray_DIM(tiles, 3) != PyArray_DIM(tiles, 4) ||
+            PyArray_DIM(tiles, 5) != 3) {
+        PY_VAL_ERROR("Tiles should have shape (20, 8, 8, scale, scale, 3).");
     }
+    int scale = PyArray_DIM(tiles, 3);
 
     // Create the output array
     npy_intp *out_dims = malloc(sizeof(npy_intp) * (ndim+1));
     for (int k=0; k<ndim-2; k++) {
         out_dims[k] = dims[k];
     }
-    out_dims[ndim-2] = dims[ndim-2] * SPRITE_SIZE;
-    out_dims[ndim-1] = dims[ndim-1] * SPRITE_SIZE;
+    out_dims[ndim-2] = dims[ndim-2] * scale;
+    out_dims[ndim-1] = dims[ndim-1] * scale;
     out_dims[ndim] = 3;
     out = (PyArrayObject *)PyArray_SimpleNew(ndim+1, out_dims, NPY_UINT8);
     free(out_dims);
@@ -345,7 +784,7 @@ static PyObject *render_board_py(PyObject *self, PyObject *args) {
         (uint16_t *)PyArray_DATA(goals),
         (uint8_t *)PyArray_DATA(orientation),
         dims[ndim-1], dims[ndim-2], depth,
-        (float *)PyArray_DATA(sprites),
+        (uint8_t *)PyArray_DATA(tiles), scale,
         (uint8_t *)PyArray_DATA(out)
     );
     Py_END_ALLOW_THREADS
@@ -353,23 +792,130 @@ static PyObject *render_board_py(PyObject *self, PyObject *args) {
     Py_DECREF((PyObject *)board);
     Py_DECREF((PyObject *)goals);
     Py_DECREF((PyObject *)orientation);
-    Py_DECREF((PyObject *)sprites);
+    Py_DECREF((PyObject *)tiles);
     return (PyObject *)out;
 
     error:
     Py_XDECREF((PyObject *)board);
     Py_XDECREF((PyObject *)goals);
     Py_XDECREF((PyObject *)orientation);
-    Py_XDECREF((PyObject *)sprites);
+    Py_XDECREF((PyObject *)tiles);
     Py_XDECREF((PyObject *)out);
     return NULL;
 }
 
 
+static char render_ansi_doc[] =
+    "render_ansi(board, goals, orientation=0, edit_loc=None, edit_color=0, "
+        "changed=None, origin=(1, 1))\n--\n\n"
+    "Render a board as ANSI text.\n"
+    "\n"
+    "Parameters\n"
+    "----------\n"
+    "board : ndarray\n"
+    "goals : ndarray\n"
+    "    Same shape as the board.\n"
+    "orientation : int\n"
+    "    Orientation of the agent.\n"
+    "edit_loc : (int, int) or None\n"
+    "    Location (x, y) of the edit cursor, if any.\n"
+    "edit_color : int\n"
+    "    Color index (0-7) of the edit cursor.\n"
+    "changed : ndarray or None\n"
+    "    If supplied, only cells for which `changed` is true are drawn.\n"
+    "    Each cell is drawn at an absolute cursor position, and the board\n"
+    "    border is not drawn. Otherwise the full board and border are drawn\n"
+    "    starting at the current cursor position.\n"
+    "origin : (int, int)\n"
+    "    Terminal row and column (1-based) of the board's top-left corner.\n"
+    "    Only used with `changed`.\n"
+    "\n"
+    "Returns\n"
+    "-------\n"
+    "bytes\n"
+    "    UTF-8 encoded text.\n";
+
+
+static PyObject *render_ansi_py(PyObject *self, PyObject *args, PyObject *kw) {
+    PyObject *board_obj, *goals_obj, *edit_obj = Py_None, *changed_obj = Py_None;
+    PyArrayObject *board = NULL, *goals = NULL, *changed = NULL;
+    PyObject *out = NULL;
+    int orientation = 0, edit_color = 0;
+    int edit_row = -1, edit_col = -1;
+    int origin_row = 1, origin_col = 1;
+    static char *kwlist[] = {
+        "board", "goals", "orientation", "edit_loc", "edit_color",
+        "changed", "origin", NULL
+    };
+
+    if (!PyArg_ParseTupleAndKeywords(
+            args, kw, "OO|iOiO(ii):render_ansi", kwlist,
+            &board_obj, &goals_obj, &orientation, &edit_obj, &edit_color,
+            &changed_obj, &origin_row, &origin_col)) {
+        return NULL;
+    }
+    if (edit_obj != Py_None &&
+            !PyArg_ParseTuple(edit_obj, "ii", &edit_col, &edit_row)) {
+        return NULL;
+    }
+
+    board = (PyArrayObject *)PyArray_FROM_OTF(
+        board_obj, NPY_UINT16, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    goals = (PyArrayObject *)PyArray_FROM_OTF(
+        goals_obj, NPY_UINT16, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    if (!board || !goals) goto error;
+    if (changed_obj != Py_None) {
+        changed = (PyArrayObject *)PyArray_FROM_OTF(
+            changed_obj, NPY_UINT8, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+        if (!changed) goto error;
+    }
+    if (PyArray_NDIM(board) != 2) {
+        PY_VAL_ERROR("Board must be two-dimensional.");
+    }
+    if (!PyArray_SAMESHAPE(board, goals) ||
+            (changed && !PyArray_SAMESHAPE(board, changed))) {
+        PY_VAL_ERROR("Board, goals, and changed must have the same shape.");
+    }
+    int nrow = PyArray_DIM(board, 0);
+    int ncol = PyArray_DIM(board, 1);
+    if (edit_row >= nrow || edit_col >= ncol) {
+        edit_row = edit_col = -1;
+    }
+
+    // Allocate enough space for the worst case, and then shrink it down.
+    out = PyBytes_FromStringAndSize(NULL, ansi_buffer_size(nrow, ncol));
+    if (!out) goto error;
+    size_t num_bytes;
+
+    Py_BEGIN_ALLOW_THREADS
+    num_bytes = render_ansi(
+        (uint16_t *)PyArray_DATA(board),
+        (uint16_t *)PyArray_DATA(goals),
+        changed ? (uint8_t *)PyArray_DATA(changed) : NULL,
+        nrow, ncol, orientation, edit_row, edit_col, edit_color,
+        origin_row, origin_col, PyBytes_AS_STRING(out));
+    Py_END_ALLOW_THREADS
+
+    if (_PyBytes_Resize(&out, num_bytes)) goto error;
+
+    Py_DECREF(board);
+    Py_DECREF(goals);
+    Py_XDECREF(changed);
+    return out;
+
+    error:
+    Py_XDECREF(board);
+    Py_XDECREF(goals);
+    Py_XDECREF(changed);
+    Py_XDECREF(out);
+    return NULL;
+}
+
+
 static PyMethodDef methods[] = {
     {
-        "advance_board", (PyCFunction)advance_board_py, METH_VARARGS,
-        "Advances the board one step."
+        "advance_board", (PyCFunction)advance_board_py,
+        METH_VARARGS | METH_KEYWORDS, advance_board_doc
     },
     {
         "gen_pattern", (PyCFunction)gen_pattern_py,
@@ -379,10 +925,33 @@ static PyMethodDef methods[] = {
         "wrapped_label", (PyCFunction)wrapped_label_py,
         METH_VARARGS | METH_KEYWORDS, wrapped_label_doc
     },
+    {
+        "build_fence", (PyCFunction)build_fence_py,
+        METH_VARARGS | METH_KEYWORDS, build_fence_doc
+    },
+    {
+        "board_hash", (PyCFunction)board_hash_py,
+        METH_VARARGS | METH_KEYWORDS, board_hash_doc
+    },
+    {
+        "side_effect_count", (PyCFunction)side_effect_count_py,
+        METH_VARARGS | METH_KEYWORDS, side_effect_count_doc
+    },
+    {
+        "make_partioned_regions", (PyCFunction)make_partioned_regions_py,
+        METH_VARARGS | METH_KEYWORDS, make_partioned_regions_doc
+    },
+    {
+        "_build_tiles", (PyCFunction)build_tiles_py, METH_VARARGS, NULL
+    },
     {
         "_render_board", (PyCFunction)render_board_py,
         METH_VARARGS | METH_KEYWORDS, NULL
     },
+    {
+        "render_ansi", (PyCFunction)render_ansi_py,
+        METH_VARARGS | METH_KEYWORDS, render_ansi_doc
+    },
     {
         "seed", (PyCFunction)seed_py, METH_VARARGS,
         "Seed the random number generator. (deprecated)"
@@ -394,6 +963,17 @@ static PyMethodDef methods[] = {
         "----------\n"
         "bit_generator : numpy.random.BitGenerator\n"
     },
+    {
+        "set_local_bit_generator", (PyCFunction)set_local_bit_generator_py,
+        METH_VARARGS,
+        "Sets the bit generator for random functions on the current thread.\n\n"
+        "This overrides the global bit generator (see `set_bit_generator`)\n"
+        "until it is set back to None. The generator must be kept alive by\n"
+        "the caller for as long as it is in use.\n\n"
+        "Parameters\n"
+        "----------\n"
+        "bit_generator : numpy.random.BitGenerator or None\n"
+    },
     {NULL, NULL, 0, NULL}  /* Sentinel */
 };
 
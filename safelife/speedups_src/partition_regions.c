@@ -0,0 +1,150 @@
+#include <stdlib.h>
+#include <string.h>
+#include "partition_regions.h"
+#include "iset.h"
+#include "random.h"
+
+
+static int region_conflicts(int patch[5][5], int k) {
+    // Check whether adding the center cell of the patch to region k would
+    // bring it too close to any other region. This mirrors the convolution
+    // check in the original python implementation: none of the 3x3 cells
+    // surrounding (and including) the center may touch a foreign region while
+    // also having more than two non-empty neighbors, and the center cell
+    // itself may not touch a foreign region at all.
+    for (int a = 1; a <= 3; a++) {
+        for (int b = 1; b <= 3; b++) {
+            int num_neighbors = 0;
+            int num_foreign = 0;
+            for (int da = -1; da <= 1; da++) {
+                for (int db = -1; db <= 1; db++) {
+                    if (!da && !db) continue;
+                    int val = patch[a+da][b+db];
+                    num_neighbors += val != 0;
+                    num_foreign += val > 0 && val != k;
+                }
+            }
+            if (num_foreign > 0 && (num_neighbors > 2 || (a == 2 && b == 2))) {
+                return 1;
+            }
+        }
+    }
+    return 0;
+}
+
+
+int make_partioned_regions(
+        int16_t *board, int nrow, int ncol,
+        double alpha, int max_regions, int min_regions) {
+    // Grow regions one cell at a time using a Dirichlet process.
+    // Region 0 is the "new region" pseudo-region; its perimeter initially
+    // contains every cell on the board. Each real region k > 0 keeps track of
+    // its own perimeter and of the cells that have already been tried for it
+    // (its exclusions).
+    int size = nrow * ncol;
+    int num_regions = 0;
+    int max_alloc = 8;
+    int err_code = 0;
+    iset *perimeters = malloc(sizeof(iset) * max_alloc);
+    uint8_t *exclusions = calloc(max_alloc, size);
+    double *weights = malloc(sizeof(double) * max_alloc);
+
+    if (!perimeters || !exclusions || !weights) {
+        err_code = -1;
+        goto done;
+    }
+    memset(board, 0, sizeof(int16_t) * size);
+    perimeters[num_regions++] = iset_alloc(size);
+    for (int i = 0; i < size; i++) {
+        iset_add(perimeters, i);
+    }
+
+    while (1) {
+        // Pick a region in proportion to its perimeter.
+        double total_weight = 0.0;
+        for (int k = 0; k < num_regions; k++) {
+            double w = perimeters[k].size;
+            if (k == 0) {
+                w = num_regions <= max_regions ? (alpha < w ? alpha : w) : 1e-10;
+            } else if (num_regions <= min_regions) {
+                w = 1e-10;
+            }
+            weights[k] = perimeters[k].size > 0 ? w : 0.0;
+            total_weight += weights[k];
+        }
+        if (total_weight <= 0) break;
+
+        double target = random_float() * total_weight;
+        int k = 0;
+        for (int k2 = 0; k2 < num_regions; k2++) {
+            if (weights[k2] <= 0) continue;
+            k = k2;
+            target -= weights[k2];
+            if (target < 0) break;
+        }
+
+        // Pick a cell on that region's perimeter.
+        int idx = iset_sample(perimeters + k);
+        iset_discard(perimeters, idx);
+        iset_discard(perimeters + k, idx);
+        if (exclusions[k * size + idx]) continue;
+        exclusions[idx] = 1;
+        exclusions[k * size + idx] = 1;
+
+        int row = idx / ncol;
+        int col = idx % ncol;
+        int patch[5][5];
+        for (int a = 0; a < 5; a++) {
+            int r = (row + a - 2 + nrow) % nrow;
+            for (int b = 0; b < 5; b++) {
+                int c = (col + b - 2 + ncol) % ncol;
+                patch[a][b] = board[r * ncol + c];
+            }
+        }
+        patch[2][2] = k ? k : -1;
+        if (region_conflicts(patch, k)) continue;
+
+        // Add to the board
+        if (k == 0) {
+            if (num_regions >= max_alloc) {
+                int new_alloc = 2 * max_alloc;
+                iset *p2 = realloc(perimeters, sizeof(iset) * new_alloc);
+                if (p2) perimeters = p2;
+                uint8_t *e2 = realloc(exclusions, (size_t)new_alloc * size);
+                if (e2) exclusions = e2;
+                double *w2 = realloc(weights, sizeof(double) * new_alloc);
+                if (w2) weights = w2;
+                if (!p2 || !e2 || !w2) {
+                    err_code = -1;
+                    goto done;
+                }
+                memset(exclusions + (size_t)max_alloc * size, 0,
+                    (size_t)(new_alloc - max_alloc) * size);
+                max_alloc = new_alloc;
+            }
+            k = num_regions++;
+            perimeters[k] = iset_alloc(size);
+        }
+        board[idx] = k;
+        int adjacent[4] = {
+            ((row + nrow - 1) % nrow) * ncol + col,
+            row * ncol + (col + ncol - 1) % ncol,
+            row * ncol + (col + 1) % ncol,
+            ((row + 1) % nrow) * ncol + col,
+        };
+        for (int n = 0; n < 4; n++) {
+            if (board[adjacent[n]] == 0) {
+                iset_add(perimeters + k, adjacent[n]);
+            }
+        }
+    }
+
+    done:
+    for (int k = 0; k < num_regions; k++) {
+        iset_free(perimeters + k);
+    }
+    free(perimeters);
+    free(exclusions);
+    free(weights);
+    return err_code;
+}
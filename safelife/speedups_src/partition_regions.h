@@ -0,0 +1,5 @@
+#include <stdint.h>
+
+int make_partioned_regions(
+    int16_t *board, int nrow, int ncol,
+    double alpha, int max_regions, int min_regions);
@@ -21,6 +21,14 @@
 static bitgen_t *bitgen_state = NULL;
 static PyObject *bit_generator = NULL;
 
+// Individual threads can override the global bit generator with their own.
+// This is used when running several generation chains in parallel.
+#ifdef _MSC_VER
+    static __declspec(thread) bitgen_t *local_bitgen_state = NULL;
+#else
+    static _Thread_local bitgen_t *local_bitgen_state = NULL;
+#endif
+
 
 int set_bit_generator(PyObject *bitgen) {
     PyObject *capsule = NULL;
@@ -38,6 +46,33 @@ int set_bit_generator(PyObject *bitgen) {
     return 0;
 }
 
+void *get_bit_generator_state(PyObject *bitgen) {
+    // Returns the (borrowed) bit generator state, or NULL on error.
+    // The python object must be kept alive for as long as the state is used.
+    PyObject *capsule = NULL;
+    void *state = NULL;
+
+    if ((capsule = PyObject_GetAttrString(bitgen, "capsule"))) {
+        state = PyCapsule_GetPointer(capsule, "BitGenerator");
+    }
+    Py_XDECREF(capsule);
+    return state;
+}
+
+
+void *set_local_bit_generator(void *state) {
+    // Returns the previous local state, so that it can be restored.
+    void *old_state = local_bitgen_state;
+    local_bitgen_state = state;
+    return old_state;
+}
+
+
+void *current_bit_generator_state(void) {
+    return local_bitgen_state ? local_bitgen_state : bitgen_state;
+}
+
+
 int random_seed(uint32_t seed) {
     PyObject *np_random = NULL,
              *gen_func = NULL,
@@ -74,6 +109,9 @@ int random_seed(uint32_t seed) {
 
 
 double random_float(void) {
+    if (local_bitgen_state) {
+        return local_bitgen_state->next_double(local_bitgen_state->state);
+    }
     if (!bitgen_state) {
         if (!random_seed(0)) {
             return 0.0;
@@ -89,11 +127,13 @@ uint32_t random_int(uint32_t high) {
     // For some reason I'm having a hard time linking to the functions in
     // distributions.h directly.
     uint32_t mask, value;
+    bitgen_t *state = local_bitgen_state ? local_bitgen_state : bitgen_state;
 
-    if (!bitgen_state) {
+    if (!state) {
         if (!random_seed(0)) {
             return 0;
         }
+        state = bitgen_state;
     }
     if (high == 0) {
         return 0;
@@ -109,7 +149,7 @@ uint32_t random_int(uint32_t high) {
     mask |= mask >> 16;
 
     do {
-        value = mask & bitgen_state->next_uint32(bitgen_state->state);
+        value = mask & state->next_uint32(state->state);
     } while (value >= high);
 
     return value;
@@ -3,5 +3,8 @@
 
 int set_bit_generator(PyObject *bit_generator);
 int random_seed(uint32_t seed);
+void *get_bit_generator_state(PyObject *bit_generator);
+void *set_local_bit_generator(void *state);
+void *current_bit_generator_state(void);
 uint32_t random_int(uint32_t high);
 double random_float(void);
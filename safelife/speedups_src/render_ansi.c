@@ -0,0 +1,140 @@
+#include <stdio.h>
+#include <string.h>
+#include "render_ansi.h"
+
+#define COLOR_BIT 9
+#define AGENT 2
+
+// These should match the colors and glyphs in render_text.py.
+
+static const char *background_colors[] = {
+    "\x1b[48;5;251m",  // black / empty
+    "\x1b[48;5;217m",  // red
+    "\x1b[48;5;114m",  // green
+    "\x1b[48;5;229m",  // yellow
+    "\x1b[48;5;117m",  // blue
+    "\x1b[48;5;183m",  // magenta
+    "\x1b[48;5;123m",  // cyan
+    "\x1b[48;5;255m",  // white
+};
+
+static const char *foreground_colors[] = {
+    "\x1b[38;5;0m",  // black
+    "\x1b[38;5;1m",  // red
+    "\x1b[38;5;2m",  // green
+    "\x1b[38;5;172m",  // yellow
+    "\x1b[38;5;12m",  // blue
+    "\x1b[38;5;129m",  // magenta
+    "\x1b[38;5;39m",  // cyan
+    "\x1b[38;5;244m",  // white / gray
+};
+
+static const char *agent_glyphs[] = {
+    "\x1b[1m⋀", "\x1b[1m>", "\x1b[1m⋁", "\x1b[1m<",
+};
+
+static const uint16_t color_mask = 7 << COLOR_BIT;
+
+
+static inline char *append(char *out, const char *str) {
+    size_t n = strlen(str);
+    memcpy(out, str, n);
+    return out + n;
+}
+
+
+static const char *cell_glyph(uint16_t cell, int orientation) {
+    if (cell & AGENT) return agent_glyphs[orientation & 3];
+    switch (cell & ~color_mask) {
+        case 0: return cell & color_mask ? "." : " ";  // empty
+        case 9: return "z";  // life
+        case 1: return "Z";  // hard life
+        case 16: return "#";  // wall
+        case 32788: return "%";  // crate
+        case 32789: return "&";  // plant
+        case 17: return "T";  // tree
+        case 32884: return "=";  // ice cube
+        case 85: return "!";  // parasite
+        case 53: return "@";  // weed
+        case 152: return "s";  // spawner
+        case 144: return "S";  // hard spawner
+        case 272: return "X";  // exit
+        case 48: return "\x1b[1m+";  // fountain
+        default: return "?";
+    }
+}
+
+
+static inline char *render_cell(
+        char *out, uint16_t cell, uint16_t goal, int orientation,
+        int edit_color) {
+    out = append(out, background_colors[(goal & color_mask) >> COLOR_BIT]);
+    if (edit_color < 0) {
+        *out++ = ' ';
+    } else {
+        out = append(out, foreground_colors[edit_color & 7]);
+        out = append(out, "∎");
+    }
+    out = append(out, foreground_colors[(cell & color_mask) >> COLOR_BIT]);
+    out = append(out, cell_glyph(cell, orientation));
+    return append(out, "\x1b[0m");
+}
+
+
+size_t ansi_buffer_size(int nrow, int ncol) {
+    // Each cell plus the border and newlines.
+    return (size_t)nrow * ncol * ANSI_MAX_CELL_BYTES + (size_t)(nrow + ncol + 4) * 8;
+}
+
+
+size_t render_ansi(
+        uint16_t *board, uint16_t *goals, uint8_t *changed,
+        int nrow, int ncol, int orientation,
+        int edit_row, int edit_col, int edit_color,
+        int origin_row, int origin_col, char *out) {
+    // Render the board (with a border) as ANSI text.
+    //
+    // If `changed` is NULL, the whole board is drawn starting at the current
+    // cursor location. Otherwise, only the cells with non-zero `changed`
+    // values are drawn, and each is positioned using absolute cursor
+    // movement. In that case, (origin_row, origin_col) is the 1-based
+    // terminal location of the board's top-left corner (the border).
+    // Returns the number of bytes written to `out`, which must have space
+    // for at least `ansi_buffer_size(nrow, ncol)` bytes.
+    char *start = out;
+
+    if (changed) {
+        int last_idx = -2;
+        for (int r = 0, i = 0; r < nrow; r++) {
+            for (int c = 0; c < ncol; c++, i++) {
+                if (!changed[i]) continue;
+                if (i != last_idx + 1 || c == 0) {
+                    out += sprintf(out, "\x1b[%i;%iH",
+                        origin_row + 1 + r, origin_col + 2 + 2*c);
+                }
+                last_idx = i;
+                int is_edit = r == edit_row && c == edit_col;
+                out = render_cell(out, board[i], goals[i], orientation,
+                    is_edit ? edit_color : -1);
+            }
+        }
+        return out - start;
+    }
+
+    out = append(out, " +");
+    for (int c = 0; c < ncol; c++) out = append(out, " -");
+    out = append(out, " +\n");
+    for (int r = 0, i = 0; r < nrow; r++) {
+        out = append(out, " |");
+        for (int c = 0; c < ncol; c++, i++) {
+            int is_edit = r == edit_row && c == edit_col;
+            out = render_cell(out, board[i], goals[i], orientation,
+                is_edit ? edit_color : -1);
+        }
+        out = append(out, " |\n");
+    }
+    out = append(out, " +");
+    for (int c = 0; c < ncol; c++) out = append(out, " -");
+    out = append(out, " +\n");
+    return out - start;
+}
@@ -0,0 +1,14 @@
+#include <stdint.h>
+#include <stddef.h>
+
+// Upper bound on the number of bytes needed to render a single cell,
+// including the cursor movement needed when only redrawing changed cells.
+#define ANSI_MAX_CELL_BYTES 80
+
+size_t ansi_buffer_size(int nrow, int ncol);
+
+size_t render_ansi(
+    uint16_t *board, uint16_t *goals, uint8_t *changed,
+    int nrow, int ncol, int orientation,
+    int edit_row, int edit_col, int edit_color,
+    int origin_row, int origin_col, char *out);
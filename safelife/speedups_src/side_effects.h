@@ -0,0 +1,5 @@
+#include <stdint.h>
+
+int side_effect_count(
+    uint16_t *board, uint16_t *baseline, uint16_t *goals, uint8_t *exit_mask,
+    int size);
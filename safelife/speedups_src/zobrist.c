@@ -0,0 +1,27 @@
+#include "zobrist.h"
+
+
+uint64_t zobrist_key(uint64_t salt, int row, int col, uint16_t val) {
+    // Rather than storing a (huge) table of random keys for every location
+    // and cell value, generate each key on the fly by running its index
+    // through the splitmix64 finalizer. Empty cells always get a zero key so
+    // that they don't contribute to the hash.
+    // Note that this must exactly match `_zobrist_key()` in safelife_game.py.
+    if (!val) return 0;
+    uint64_t z = salt ^ ((uint64_t)row << 40 | (uint64_t)col << 16 | val);
+    z += 0x9e3779b97f4a7c15ULL;
+    z = (z ^ (z >> 30)) * 0xbf58476d1ce4e5b9ULL;
+    z = (z ^ (z >> 27)) * 0x94d049bb133111ebULL;
+    return z ^ (z >> 31);
+}
+
+
+uint64_t board_hash(uint16_t *board, int nrow, int ncol, uint64_t salt) {
+    uint64_t h = 0;
+    for (int row = 0; row < nrow; row++) {
+        for (int col = 0; col < ncol; col++, board++) {
+            h ^= zobrist_key(salt, row, col, *board);
+        }
+    }
+    return h;
+}
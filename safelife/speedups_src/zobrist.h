@@ -0,0 +1,4 @@
+#include <stdint.h>
+
+uint64_t zobrist_key(uint64_t salt, int row, int col, uint16_t val);
+uint64_t board_hash(uint16_t *board, int nrow, int ncol, uint64_t salt);
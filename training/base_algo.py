@@ -1,6 +1,9 @@
 import os
+import copy
 import glob
+import shutil
 import logging
+import threading
 
 import torch
 import numpy as np
@@ -10,6 +13,29 @@ from .utils import nested_getattr, nested_setattr
 logger = logging.getLogger(__name__)
 
 
+def _cpu_copy(val):
+    """
+    Copy (possibly nested) checkpoint data, moving any tensors to the cpu.
+    """
+    if isinstance(val, torch.Tensor):
+        return val.detach().to('cpu', copy=True)
+    elif isinstance(val, dict):
+        # Shallow copy first to keep the dict type and any attributes
+        # (e.g., the ``_metadata`` of module state dicts).
+        val = copy.copy(val)
+        for key in val:
+            val[key] = _cpu_copy(val[key])
+        return val
+    elif type(val) in (list, tuple):
+        return type(val)(_cpu_copy(v) for v in val)
+    else:
+        return copy.deepcopy(val)
+
+
+def _array_directory(checkpoint_path, attrib):
+    return '%s.%s' % (checkpoint_path[:-len('.data')], attrib)
+
+
 class BaseAlgo(object):
     """
     Common methods for model checkpointing in pytorch.
@@ -32,8 +58,17 @@ class BaseAlgo(object):
         List of attributes on the algorithm that ought to be saved at each
         checkpoint. This should be overridden by subclasses.
         Note that this implicitly contains ``num_steps``.
+    checkpoint_array_attribs : list
+        Attributes containing large amounts of array data (e.g., replay
+        buffers). Each should have ``state_arrays()`` and
+        ``load_state_arrays()`` methods. Their arrays are saved as ``.npy``
+        files in a directory next to each checkpoint, so that they can be
+        memory-mapped when loaded.
+    async_checkpoints : bool
+        If True, checkpoints are written to disk in a background thread.
+        Only the (in-memory) snapshot of the checkpoint data happens on the
+        training thread.
     """
-    checkpoint_directory = None
     data_logger = None
 
     num_steps = 0
@@ -41,9 +76,12 @@ class BaseAlgo(object):
     checkpoint_interval = 100000
     max_checkpoints = 3
     checkpoint_attribs = []
+    checkpoint_array_attribs = []
+    async_checkpoints = True
 
     _last_checkpoint = -1
     _checkpoint_directory = None
+    _checkpoint_thread = None
 
     @property
     def checkpoint_directory(self):
@@ -52,7 +90,7 @@ class BaseAlgo(object):
 
     @checkpoint_directory.setter
     def checkpoint_directory(self, value):
-        self,_checkpoint_directory = value
+        self._checkpoint_directory = value
 
     def get_all_checkpoints(self):
         """
@@ -85,6 +123,8 @@ class BaseAlgo(object):
         if not chkpt_dir:
             return
 
+        # Snapshot everything now, so that training can continue while the
+        # checkpoint is written.
         data = {'num_steps': self.num_steps}
         for attrib in self.checkpoint_attribs:
             try:
@@ -94,17 +134,63 @@ class BaseAlgo(object):
                 continue
             if hasattr(val, 'state_dict'):
                 val = val.state_dict()
-            data[attrib] = val
+            data[attrib] = _cpu_copy(val)
+        array_data = {}
+        for attrib in self.checkpoint_array_attribs:
+            try:
+                array_data[attrib] = nested_getattr(self, attrib).state_arrays()
+            except AttributeError:
+                logger.error("Cannot save attribute '%s'", attrib)
 
         path = os.path.join(chkpt_dir, 'checkpoint-%i.data' % self.num_steps)
-        torch.save(data, path)
         logger.info("Saving checkpoint: '%s'", path)
+        self.wait_for_checkpoint()
+        if self.async_checkpoints:
+            self._checkpoint_thread = threading.Thread(
+                target=self._write_checkpoint, args=(path, data, array_data))
+            self._checkpoint_thread.start()
+        else:
+            self._write_checkpoint(path, data, array_data)
+
+        self._last_checkpoint = self.num_steps
+
+    def wait_for_checkpoint(self):
+        """
+        Block until any checkpoint that's being written in the background
+        is finished.
+        """
+        if self._checkpoint_thread is not None:
+            self._checkpoint_thread.join()
+            self._checkpoint_thread = None
+
+    def _write_checkpoint(self, path, data, array_data):
+        # Everything is written to temporary files first and then renamed,
+        # so an interrupted write never leaves a partial checkpoint behind.
+        # The array directories are moved into place before the main
+        # checkpoint file, which is what marks the checkpoint as complete.
+        try:
+            for attrib, arrays in array_data.items():
+                array_dir = _array_directory(path, attrib)
+                tmp_dir = array_dir + '.tmp'
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                os.makedirs(tmp_dir)
+                for key, val in arrays.items():
+                    np.save(os.path.join(tmp_dir, key + '.npy'), val)
+                shutil.rmtree(array_dir, ignore_errors=True)
+                os.replace(tmp_dir, array_dir)
+            torch.save(data, path + '.tmp')
+            os.replace(path + '.tmp', path)
+        except Exception:
+            logger.exception("Failed to write checkpoint '%s'", path)
+            return
 
         old_checkpoints = self.get_all_checkpoints()
         for old_checkpoint in old_checkpoints[:-self.max_checkpoints]:
             os.remove(old_checkpoint)
-
-        self._last_checkpoint = self.num_steps
+            for attrib in self.checkpoint_array_attribs:
+                shutil.rmtree(
+                    _array_directory(old_checkpoint, attrib),
+                    ignore_errors=True)
 
     def load_checkpoint(self, checkpoint_name=None):
         chkpt_dir = self.checkpoint_directory
@@ -135,6 +221,19 @@ class BaseAlgo(object):
                 except AttributeError:
                     logger.error("Cannot load key '%s'", key)
 
+        for attrib in self.checkpoint_array_attribs:
+            array_dir = _array_directory(path, attrib)
+            obj = nested_getattr(self, attrib, None)
+            if obj is None or not os.path.isdir(array_dir):
+                continue
+            try:
+                obj.load_state_arrays({
+                    os.path.basename(f)[:-4]: np.load(f, mmap_mode='r')
+                    for f in glob.glob(os.path.join(array_dir, '*.npy'))
+                })
+            except (ValueError, KeyError) as err:
+                logger.error("Cannot load key '%s': %s", attrib, err)
+
         self._last_checkpoint = self.num_steps
 
     def tensor(self, data, dtype):
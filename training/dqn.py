@@ -9,7 +9,8 @@ from safelife.helper_utils import load_kwargs
 from safelife.random import get_rng
 
 from .base_algo import BaseAlgo
-from .utils import named_output, round_up
+from .models import InferenceModel
+from .utils import named_output, round_up, SumTree
 
 
 logger = logging.getLogger(__name__)
@@ -36,10 +37,26 @@ class ReplayBuffer(object):
 
 
 class MultistepReplayBuffer(object):
-    def __init__(self, capacity, num_env, n_step, gamma):
+    """
+    Replay buffer that accumulates discounted rewards over multiple steps.
+
+    States are stored once each in a single preallocated array of shape
+    ``(capacity,) + state_shape``, which is created on the first push once the
+    state shape and dtype are known. Each sample refers to a pair of states
+    (the current state and the state `n_step` steps later) by index, and both
+    sets of states are gathered together in a single operation.
+
+    By default the states are kept in host memory and gathered into a reusable
+    staging buffer (pinned, if CUDA is available), so no new host memory needs
+    to be allocated for each batch. Note that this means that the sampled
+    state tensors are overwritten by the next call to ``sample()``.
+    If `device` is given, the states are instead kept in a tensor on that
+    device and sampled states never need to be transferred from the host.
+    """
+    def __init__(self, capacity, num_env, n_step, gamma, device=None):
         self.capacity = capacity
         self.idx = 0
-        self.states = np.zeros(capacity, dtype=object)
+        self.states = None
         self.actions = np.zeros(capacity, dtype=np.int64)
         self.rewards = np.zeros(capacity, dtype=np.float32)
         self.done = np.zeros(capacity, dtype=bool)
@@ -47,42 +64,252 @@ class MultistepReplayBuffer(object):
         self.n_step = n_step
         self.gamma = gamma
         self.tail_length = n_step * num_env
+        self.device = device
+        self._staging = None
+
+    def _allocate_states(self, state_shape, dtype):
+        shape = (self.capacity,) + tuple(state_shape)
+        if self.device is None:
+            self.states = np.zeros(shape, dtype=dtype)
+        else:
+            dtype = torch.from_numpy(np.zeros(0, dtype)).dtype
+            self.states = torch.zeros(shape, dtype=dtype, device=self.device)
 
     def push(self, state, action, reward, done):
-        idx = self.idx % self.capacity
-        self.idx += 1
-        self.states[idx] = state
-        self.actions[idx] = action
-        self.done[idx] = done
-        self.rewards[idx] = reward
-
-        # Now discount the reward and add to prior rewards
-        n = np.arange(1, self.n_step)
-        idx_prior = idx - n * self.num_env
-        prior_done = np.cumsum(self.done[idx_prior]) > 0
-        gamma = self.gamma**(n) * ~prior_done
-        self.rewards[idx_prior] += gamma * reward
-        self.done[idx_prior] = prior_done | done
-
-    @named_output("state action reward next_state done")
-    def sample(self, batch_size):
+        self.push_batch([state], [action], [reward], [done])
+
+    def push_batch(self, states, actions, rewards, dones):
+        """
+        Add one step from each of (up to) `num_env` environments at once.
+
+        The environments should always be pushed in the same order.
+        """
+        states = np.asanyarray(states)
+        rewards = np.asanyarray(rewards, dtype=np.float32)
+        dones = np.asanyarray(dones, dtype=bool)
+        num_new = len(states)
+        if self.states is None:
+            self._allocate_states(states.shape[1:], states.dtype)
+        start = self.idx % self.capacity
+        self.idx += num_new
+        if start + num_new <= self.capacity:
+            idx = slice(start, start + num_new)
+        else:
+            idx = (start + np.arange(num_new)) % self.capacity
+        if self.device is None:
+            self.states[idx] = states
+        else:
+            if not isinstance(idx, slice):
+                idx = torch.from_numpy(idx).to(self.device)
+            self.states[idx] = torch.from_numpy(states).to(self.device)
+        self.actions[idx] = actions
+        self.done[idx] = dones
+        self.rewards[idx] = rewards
+
+        # Now discount the rewards and add to prior rewards.
+        # Each row of idx_prior contains the same step for all of the new
+        # environments, going progressively further into the past.
+        n = np.arange(1, self.n_step)[:, None]
+        idx_prior = (start + np.arange(num_new) - n * self.num_env)
+        idx_prior %= self.capacity
+        prior_done = np.cumsum(self.done[idx_prior], axis=0) > 0
+        gamma = self.gamma**n * ~prior_done
+        self.rewards[idx_prior] += gamma * rewards
+        self.done[idx_prior] = prior_done | dones
+
+    def sample_indices(self, batch_size):
+        """
+        Sample the indices of `batch_size` transitions.
+
+        Returns
+        -------
+        i0 : ndarray
+            Index of each sampled state (and its action, reward and done flag).
+        i1 : ndarray
+            Index of the state `n_step` steps later.
+        """
         assert self.idx >= batch_size + self.tail_length
 
         idx = self.idx % self.capacity
         i1 = idx - 1 - get_rng().choice(len(self), batch_size, replace=False)
-        i0 = i1 - self.tail_length
+        i1 %= self.capacity
+        i0 = (i1 - self.tail_length) % self.capacity
+        return i0, i1
+
+    def gather_states(self, *indices):
+        """
+        Gather the states for one or more index arrays in a single operation.
+
+        Returns one tensor of states for each index array.
+        """
+        idx = np.concatenate(indices)
+        if self.device is not None:
+            states = self.states[torch.from_numpy(idx).to(self.device)]
+        else:
+            shape = idx.shape + self.states.shape[1:]
+            if self._staging is None or self._staging[0].shape != shape:
+                staging = torch.from_numpy(np.zeros(shape, self.states.dtype))
+                if USE_CUDA:
+                    staging = staging.pin_memory()
+                self._staging = (staging, staging.numpy())
+            states, staging_array = self._staging
+            np.take(self.states, idx, axis=0, out=staging_array)
+        return torch.split(states, [len(i) for i in indices])
+
+    def importance_weights(self, idx):
+        """
+        Loss weights for the sampled transitions. Uniform for this buffer.
+        """
+        return np.ones(len(idx), dtype=np.float32)
+
+    def update_priorities(self, idx, errors):
+        """
+        Update sampling priorities using the TD errors of a sampled batch.
+        Does nothing for this (uniformly sampled) buffer.
+        """
+        pass
+
+    @named_output("state action reward next_state done index weight")
+    def sample(self, batch_size):
+        i0, i1 = self.sample_indices(batch_size)
+        state, next_state = self.gather_states(i0, i1)
 
         return (
-            list(self.states[i0]),  # don't want dtype=object in output
+            state,
             self.actions[i0],
             self.rewards[i0],
-            list(self.states[i1]),  # states n steps later
+            next_state,  # states n steps later
             self.done[i0],  # whether or not the episode ended before n steps
+            i0,
+            self.importance_weights(i0),
         )
 
     def __len__(self):
         return max(min(self.idx, self.capacity) - self.tail_length, 0)
 
+    def state_arrays(self):
+        """
+        Copy the contents of the buffer into a dictionary of numpy arrays.
+
+        Used to save the buffer alongside checkpoints.
+        """
+        n = min(self.idx, self.capacity)
+        arrays = {
+            'idx': np.array(self.idx),
+            'capacity': np.array(self.capacity),
+            'tail_length': np.array(self.tail_length),
+            'actions': self.actions[:n].copy(),
+            'rewards': self.rewards[:n].copy(),
+            'done': self.done[:n].copy(),
+        }
+        if self.states is not None and self.device is None:
+            arrays['states'] = self.states[:n].copy()
+        elif self.states is not None:
+            arrays['states'] = self.states[:n].to('cpu', copy=True).numpy()
+        return arrays
+
+    def load_state_arrays(self, arrays):
+        """
+        Restore the buffer from the output of :meth:`state_arrays`.
+
+        The arrays may be memory-mapped; their data is copied into the buffer
+        in chunks.
+        """
+        if (int(arrays['capacity']) != self.capacity or
+                int(arrays['tail_length']) != self.tail_length):
+            raise ValueError("Saved replay buffer has a different size.")
+        self.idx = int(arrays['idx'])
+        n = min(self.idx, self.capacity)
+        self.actions[:n] = arrays['actions']
+        self.rewards[:n] = arrays['rewards']
+        self.done[:n] = arrays['done']
+        if 'states' in arrays:
+            states = arrays['states']
+            self._allocate_states(states.shape[1:], states.dtype)
+            chunk = 4096
+            for i in range(0, n, chunk):
+                data = np.array(states[i:i+chunk])
+                if self.device is not None:
+                    data = torch.from_numpy(data).to(self.device)
+                self.states[i:i+chunk] = data
+
+        # The most recent transitions were still accumulating their multi-step
+        # rewards, but their episodes won't be continued after a restart.
+        # Treat them as having ended.
+        pending = self.idx - 1 - np.arange(min(self.tail_length, self.idx))
+        self.done[pending % self.capacity] = True
+
+
+class PrioritizedReplayBuffer(MultistepReplayBuffer):
+    """
+    Multi-step replay buffer with proportional prioritized sampling.
+
+    Transitions are sampled with probability proportional to their priority
+    ``(|td_error| + epsilon)**alpha``, with importance sampling weights
+    ``(N * P(i))**-beta`` (normalized by the largest weight in the batch) to
+    correct for the bias. New transitions get the largest priority seen so
+    far. Priorities are kept in a sum tree, so both sampling and updates take
+    O(log N) time per transition.
+
+    See Schaul et al., "Prioritized Experience Replay" (2015).
+    """
+    def __init__(
+            self, capacity, num_env, n_step, gamma,
+            alpha=0.6, beta=0.4, epsilon=1e-3, device=None):
+        super().__init__(capacity, num_env, n_step, gamma, device)
+        self.alpha = alpha
+        self.beta = beta
+        self.epsilon = epsilon
+        self.max_priority = 1.0
+        self.priorities = SumTree(capacity)
+
+    def push_batch(self, states, actions, rewards, dones):
+        start = self.idx
+        super().push_batch(states, actions, rewards, dones)
+        new_idx = np.arange(start, self.idx)
+        # Overwritten transitions can no longer be sampled. Transitions that
+        # are now `tail_length` steps old have their full multi-step reward
+        # and can be sampled for the first time.
+        self.priorities[new_idx % self.capacity] = 0.0
+        complete_idx = new_idx[new_idx >= self.tail_length] - self.tail_length
+        self.priorities[complete_idx % self.capacity] = self.max_priority
+
+    def sample_indices(self, batch_size):
+        assert self.idx >= batch_size + self.tail_length
+
+        # Stratified sampling: one sample from each equal slice of the total.
+        total = self.priorities.total
+        targets = np.arange(batch_size) + get_rng().random(batch_size)
+        i0 = self.priorities.find(targets * (total / batch_size))
+        i1 = (i0 + self.tail_length) % self.capacity
+        return i0, i1
+
+    def importance_weights(self, idx):
+        probs = self.priorities[idx] / self.priorities.total
+        weights = (len(self) * probs) ** -self.beta
+        return (weights / weights.max()).astype(np.float32)
+
+    def state_arrays(self):
+        arrays = super().state_arrays()
+        arrays['priorities'] = self.priorities.tree.copy()
+        arrays['max_priority'] = np.array(self.max_priority)
+        return arrays
+
+    def load_state_arrays(self, arrays):
+        super().load_state_arrays(arrays)
+        if 'priorities' in arrays:
+            self.priorities.tree[:] = arrays['priorities']
+            self.max_priority = float(arrays['max_priority'])
+
+    def update_priorities(self, idx, errors):
+        # Skip any transitions that are no longer valid.
+        valid = self.priorities[idx] > 0
+        idx = idx[valid]
+        priorities = (np.abs(errors[valid]) + self.epsilon) ** self.alpha
+        if len(idx) > 0:
+            self.priorities[idx] = priorities
+            self.max_priority = max(self.max_priority, priorities.max())
+
 
 class DQN(BaseAlgo):
     data_logger = None
@@ -101,6 +328,20 @@ class DQN(BaseAlgo):
 
     replay_initial = 40000
     replay_size = 100000
+    replay_on_device = False  # keep the replay buffer on the compute device
+    # Save the replay buffer alongside each checkpoint, so that training can
+    # resume without refilling it. Note that this can take a lot of space.
+    save_replay_buffer = False
+    # Prioritized replay (see PrioritizedReplayBuffer). When enabled, the
+    # loss is weighted by the importance sampling weights and the priorities
+    # are updated with each batch's TD errors.
+    prioritized_replay = False
+    priority_alpha = 0.6  # how strongly priorities affect sampling
+    priority_beta = 0.4  # strength of the importance sampling correction
+    priority_epsilon = 1e-3  # minimum priority, added to each |td_error|
+
+    inference_mode = None  # or 'script' or 'quantized'; see InferenceModel
+    inference_refresh_interval = 1000  # in training steps
     target_update_interval = 10000
 
     report_interval = 256
@@ -124,24 +365,42 @@ class DQN(BaseAlgo):
         self.target_model = target_model.to(self.compute_device)
         self.optimizer = optim.Adam(
             self.training_model.parameters(), lr=self.learning_rate)
-        self.replay_buffer = MultistepReplayBuffer(
-            self.replay_size, len(self.training_envs),
-            self.multi_step_learning, self.gamma)
-
+        replay_device = self.compute_device if self.replay_on_device else None
+        if self.prioritized_replay:
+            self.replay_buffer = PrioritizedReplayBuffer(
+                self.replay_size, len(self.training_envs),
+                self.multi_step_learning, self.gamma,
+                alpha=self.priority_alpha, beta=self.priority_beta,
+                epsilon=self.priority_epsilon, device=replay_device)
+        else:
+            self.replay_buffer = MultistepReplayBuffer(
+                self.replay_size, len(self.training_envs),
+                self.multi_step_learning, self.gamma, device=replay_device)
+
+        if self.save_replay_buffer:
+            self.checkpoint_array_attribs = ('replay_buffer',)
         self.load_checkpoint()
         self.epsilon = self.epsilon_schedule(self.num_steps)
+        self.inference_model = None
+        if self.inference_mode:
+            self.inference_model = InferenceModel(
+                self.training_model, self.inference_mode)
 
     def update_target(self):
         self.target_model.load_state_dict(self.training_model.state_dict())
 
     @named_output('states actions rewards done qvals')
     def take_one_step(self, envs, add_to_replay=False):
-        states = [
+        states = np.array([
             e.last_state if hasattr(e, 'last_state') else e.reset()
             for e in envs
-        ]
-        tensor_states = self.tensor(states, torch.float32)
-        qvals = self.training_model(tensor_states).detach().cpu().numpy()
+        ])
+        model = self.inference_model or self.training_model
+        # Observations are passed to the model in their original (compact)
+        # dtype. It's up to the model to cast them to float.
+        tensor_states = torch.as_tensor(
+            states, device=getattr(model, 'device', self.compute_device))
+        qvals = model(tensor_states).detach().cpu().numpy()
 
         num_states, num_actions = qvals.shape
         actions = np.argmax(qvals, axis=-1)
@@ -156,26 +415,30 @@ class DQN(BaseAlgo):
             if done:
                 next_state = env.reset()
             env.last_state = next_state
-            if add_to_replay:
-                self.replay_buffer.push(state, action, reward, done)
-                self.num_steps += 1
             rewards.append(reward)
             dones.append(done)
 
+        if add_to_replay:
+            self.replay_buffer.push_batch(states, actions, rewards, dones)
+            self.num_steps += len(envs)
+
         return states, actions, rewards, dones, qvals
 
     def optimize(self, report=False):
         if len(self.replay_buffer) < self.replay_initial:
             return
 
-        state, action, reward, next_state, done = \
+        state, action, reward, next_state, done, index, weight = \
             self.replay_buffer.sample(self.training_batch_size)
 
-        state = self.tensor(state, torch.float32)
-        next_state = self.tensor(next_state, torch.float32)
+        # Copy the (compact) states to the device before converting to float.
+        # This is a no-op if the replay buffer is already on the device.
+        state = state.to(self.compute_device, non_blocking=True).float()
+        next_state = next_state.to(self.compute_device, non_blocking=True).float()
         action = self.tensor(action, torch.int64)
         reward = self.tensor(reward, torch.float32)
         done = self.tensor(done, torch.float32)
+        weight = self.tensor(weight, torch.float32)
 
         q_values = self.training_model(state)
         next_q_values = self.target_model(next_state).detach()
@@ -185,11 +448,14 @@ class DQN(BaseAlgo):
         discount = self.gamma**self.multi_step_learning * (1 - done)
         expected_q_value = reward + discount * next_q_value
 
-        loss = torch.mean((q_value - expected_q_value)**2)
+        td_error = q_value - expected_q_value
+        loss = torch.mean(weight * td_error**2)
 
         self.optimizer.zero_grad()
         loss.backward()
         self.optimizer.step()
+        self.replay_buffer.update_priorities(
+            index, td_error.detach().cpu().numpy())
 
         if report and self.data_logger is not None:
             data = {
@@ -213,6 +479,7 @@ class DQN(BaseAlgo):
             num_steps = self.num_steps
             next_opt = round_up(num_steps, self.optimize_interval)
             next_update = round_up(num_steps, self.target_update_interval)
+            next_refresh = round_up(num_steps, self.inference_refresh_interval)
             next_report = round_up(num_steps, self.report_interval)
             next_test = round_up(num_steps, self.test_interval)
 
@@ -234,6 +501,9 @@ class DQN(BaseAlgo):
             if num_steps >= next_update:
                 self.target_model.load_state_dict(self.training_model.state_dict())
 
+            if self.inference_model is not None and num_steps >= next_refresh:
+                self.inference_model.refresh(self.training_model)
+
             self.save_checkpoint_if_needed()
 
             if self.testing_envs and num_steps >= next_test:
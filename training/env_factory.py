@@ -53,6 +53,7 @@ def safelife_env_factory(
         data_logger=None,
         impact_penalty=None,
         penalty_baseline='starting-state',
+        record_perf_stats=False,
         testing=False):
     """
     Factory for creating SafeLifeEnv instances with useful wrappers.
@@ -62,6 +63,7 @@ def safelife_env_factory(
         env = SafeLifeEnv(
             level_iterator,
             view_shape=(25,25),
+            record_perf_stats=record_perf_stats,
             # This is a minor optimization, but a few of the output channels
             # are redundant or unused for normal safelife training levels.
             output_channels=(
@@ -1,5 +1,8 @@
+import copy
+
 import numpy as np
 
+import torch
 from torch import nn
 from torch.nn import functional as F
 
@@ -65,8 +68,10 @@ class SafeLifeQNetwork(nn.Module):
         )
 
     def forward(self, obs):
-        # Switch observation to (c, w, h) instead of (h, w, c)
-        obs = obs.transpose(-1, -3)
+        # Switch observation to (c, w, h) instead of (h, w, c).
+        # Observations can be passed in directly as uint8 (which is much
+        # cheaper to build and transfer); the cast happens here.
+        obs = obs.transpose(-1, -3).float()
         x = self.cnn(obs).flatten(start_dim=1)
         advantages = self.advantages(x)
         value = self.value_func(x)
@@ -90,10 +95,51 @@ class SafeLifePolicyNetwork(nn.Module):
         self.value_func = nn.Linear(512, 1)
 
     def forward(self, obs):
-        # Switch observation to (c, w, h) instead of (h, w, c)
-        obs = obs.transpose(-1, -3)
+        # Switch observation to (c, w, h) instead of (h, w, c).
+        # Observations can be passed in directly as uint8 (which is much
+        # cheaper to build and transfer); the cast happens here.
+        obs = obs.transpose(-1, -3).float()
         x = self.cnn(obs).flatten(start_dim=1)
         x = self.dense(x)
         value = self.value_func(x)[...,0]
         policy = F.softmax(self.logits(x), dim=-1)
         return value, policy
+
+
+class InferenceModel(object):
+    """
+    Frozen CPU copy of a model, optimized for generating rollouts.
+
+    The copy is compiled with TorchScript (``mode='script'``) or has its
+    dense layers dynamically quantized to int8 (``mode='quantized'``), which
+    can substantially speed up inference on machines without a GPU.
+    It does not track the weights of the original model; call ``refresh()``
+    to update it after training.
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+    mode : str
+        Either 'script' or 'quantized'.
+    """
+    device = torch.device('cpu')
+
+    def __init__(self, model, mode='script'):
+        if mode not in ('script', 'quantized'):
+            raise ValueError("Unexpected inference mode '%s'" % mode)
+        self.mode = mode
+        self.refresh(model)
+
+    def refresh(self, model):
+        """Rebuild the inference copy from the current model weights."""
+        model = copy.deepcopy(model).cpu().eval()
+        if self.mode == 'quantized':
+            model = torch.quantization.quantize_dynamic(
+                model, {nn.Linear}, dtype=torch.qint8)
+        else:
+            model = torch.jit.script(model)
+        self.model = model
+
+    def __call__(self, obs):
+        with torch.no_grad():
+            return self.model(obs.to(self.device))
@@ -1,21 +1,107 @@
+import copy
+import queue
 import logging
+import itertools
+import threading
 import numpy as np
 
 import torch
 import torch.optim as optim
 
 from safelife.helper_utils import load_kwargs
-from safelife.random import get_rng
+from safelife.random import get_rng, set_rng
 
-from .utils import named_output, round_up
+from .utils import (
+    named_output, round_up, reverse_discounted_sum, sample_categorical)
 from .base_algo import BaseAlgo
+from .models import InferenceModel
 
 
 logger = logging.getLogger(__name__)
 USE_CUDA = torch.cuda.is_available()
 
 
+class RolloutStorage(object):
+    """
+    Preallocated storage for a batch of rollouts, indexed by ``[step, env]``.
+
+    Each step of data is written in place, so the finished batch can be
+    handed to torch without any further stacking or copying.
+    """
+    def __init__(self, num_steps, num_envs):
+        self.num_steps = num_steps
+        self.num_envs = num_envs
+        self.states = None  # allocated on first insert
+        self.actions = np.zeros((num_steps, num_envs), dtype=np.int64)
+        self.rewards = np.zeros((num_steps, num_envs), dtype=np.float32)
+        self.done = np.zeros((num_steps, num_envs), dtype=bool)
+        self.action_prob = np.zeros((num_steps, num_envs), dtype=np.float32)
+        self.values = np.zeros((num_steps + 1, num_envs), dtype=np.float32)
+
+    def insert(self, step, data):
+        """
+        Store the output of ``PPO.take_one_step()`` at the given step.
+        """
+        states = np.asanyarray(data.states)
+        if self.states is None:
+            self.states = np.empty(
+                self.actions.shape + states.shape[1:], dtype=states.dtype)
+        actions = np.asanyarray(data.actions)
+        self.states[step] = states
+        self.actions[step] = actions
+        self.rewards[step] = data.rewards
+        self.done[step] = data.done
+        self.action_prob[step] = np.take_along_axis(
+            data.policies, actions[:, np.newaxis], axis=-1)[:, 0]
+        self.values[step] = data.values
+
+    def compute_returns(self, final_values, gamma, lmda):
+        """
+        Calculate discounted returns and (generalized) advantages.
+
+        Parameters
+        ----------
+        final_values : ndarray
+            Value estimates for each environment after the last step.
+        gamma : float
+            Reward discount factor.
+        lmda : float
+            Discount factor for the advantage estimates.
+
+        Returns
+        -------
+        returns : ndarray
+        advantages : ndarray
+        """
+        self.values[-1] = final_values
+        values = self.values
+        reward_mask = ~self.done
+        returns = reverse_discounted_sum(
+            self.rewards, gamma * reward_mask, final_values)
+        deltas = self.rewards + gamma * reward_mask * values[1:] - values[:-1]
+        advantages = reverse_discounted_sum(deltas, lmda * reward_mask)
+        return returns, advantages
+
+
 class PPO(BaseAlgo):
+    """
+    Proximal policy optimization.
+
+    By default, the algorithm alternates between generating a batch of
+    rollouts and training on it. If `async_rollouts` is set, rollouts are
+    instead generated in a background actor thread using a (slightly stale)
+    copy of the model, so that the environments keep stepping while the
+    learner trains. Finished batches are passed to the learner through a
+    queue of at most `max_queued_batches`. Batches generated by a policy
+    more than `max_policy_lag` updates behind the learner are discarded
+    (and counted in the logged ``stale_batches``). Since each batch records the action probabilities of the policy that
+    generated it, the clipped PPO ratio between the current and behavior
+    policies serves as the importance correction for moderately stale data.
+
+    Alternatively, `rollout_workers` can be set to a ``RolloutWorkerPool``
+    (see ``rollout_workers.py``), in which case the environments are stepped
+    in separate worker processes and `training_envs` is unused.
+    """
     data_logger = None  # SafeLifeLogger instance
 
     num_steps = 0
@@ -38,6 +124,15 @@ class PPO(BaseAlgo):
     reward_clip = 0.0
     policy_rectifier = 'relu'  # or 'elu' or ...more to come
 
+    async_rollouts = False
+    max_queued_batches = 2
+    max_policy_lag = 2
+
+    rollout_workers = None  # RolloutWorkerPool instance
+
+    inference_mode = None  # or 'script' or 'quantized'; see InferenceModel
+    inference_refresh_interval = 1  # in training batches
+
     report_interval = 960
     test_interval = 100000
 
@@ -50,40 +145,56 @@ class PPO(BaseAlgo):
 
     def __init__(self, model, **kwargs):
         load_kwargs(self, kwargs)
-        assert self.training_envs is not None
+        assert (self.training_envs is not None or
+                self.rollout_workers is not None)
 
         self.model = model.to(self.compute_device)
         self.optimizer = optim.Adam(
             self.model.parameters(), lr=self.learning_rate)
+        self.policy_version = 0  # number of training batches so far
+        self.num_stale_batches = 0
+        self._batch_queue = None  # batches waiting on the learner, if async
+        self._model_lock = threading.Lock()
 
         self.load_checkpoint()
+        self.inference_model = None
+        if self.inference_mode:
+            self.inference_model = InferenceModel(
+                self.model, self.inference_mode)
+
+    def rollout_model(self):
+        """The model used to generate rollouts (and run test episodes)."""
+        return self.inference_model or self.model
 
     @named_output('states actions rewards done policies values')
-    def take_one_step(self, envs):
-        states = [
+    def take_one_step(self, envs, model=None):
+        if model is None:
+            model = self.rollout_model()
+        states = np.array([
             e.last_obs if hasattr(e, 'last_obs') else e.reset()
             for e in envs
-        ]
-        tensor_states = self.tensor(states, torch.float32)
-        values, policies = self.model(tensor_states)
+        ])
+        # Observations are passed to the model in their original (compact)
+        # dtype. It's up to the model to cast them to float.
+        tensor_states = torch.as_tensor(
+            states, device=getattr(model, 'device', self.compute_device))
+        values, policies = model(tensor_states)
         values = values.detach().cpu().numpy()
         policies = policies.detach().cpu().numpy()
-        actions = []
+        actions = sample_categorical(policies, get_rng())
         rewards = []
         dones = []
-        for policy, env in zip(policies, envs):
-            action = get_rng().choice(len(policy), p=policy)
+        for action, env in zip(actions, envs):
             obs, reward, done, info = env.step(action)
             if done:
                 obs = env.reset()
             env.last_obs = obs
-            actions.append(action)
             rewards.append(reward)
             dones.append(done)
         return states, actions, rewards, dones, policies, values
 
     @named_output('states actions action_prob returns advantages values')
-    def gen_training_batch(self, steps_per_env, flat=True):
+    def gen_training_batch(self, steps_per_env, flat=True, model=None):
         """
         Run each environment a number of steps and calculate advantages.
 
@@ -95,46 +206,34 @@ class PPO(BaseAlgo):
             If True, each output tensor will have shape
             ``(steps_per_env * num_env, ...)``.
             Otherwise, shape will be ``(steps_per_env, num_env, ...)``.
+        model : torch.nn.Module or None
+            Model used to generate the rollouts. Defaults to ``self.model``.
         """
-        steps = [
-            self.take_one_step(self.training_envs)
-            for _ in range(steps_per_env)
-        ]
-        final_states = [e.last_obs for e in self.training_envs]
-        tensor_states = self.tensor(final_states, torch.float32)
-        final_vals = self.model(tensor_states)[0].detach().cpu().numpy()
-        values = np.array([s.values for s in steps] + [final_vals])
-        rewards = np.array([s.rewards for s in steps])
-        done = np.array([s.done for s in steps])
-        reward_mask = ~done
-
-        # Calculate the discounted rewards
-        gamma = self.gamma
-        lmda = self.lmda
-        returns = rewards.copy()
-        returns[-1] += gamma * final_vals * reward_mask[-1]
-        advantages = rewards + gamma * reward_mask * values[1:] - values[:-1]
-        for i in range(steps_per_env - 2, -1, -1):
-            returns[i] += gamma * reward_mask[i] * returns[i+1]
-            advantages[i] += lmda * reward_mask[i] * advantages[i+1]
-
-        # Calculate the probability of taking each selected action
-        policies = np.array([s.policies for s in steps])
-        actions = np.array([s.actions for s in steps])
-        probs = np.take_along_axis(
-            policies, actions[..., np.newaxis], axis=-1)[..., 0]
+        if model is None:
+            model = self.rollout_model()
+        envs = self.training_envs
+        rollout = RolloutStorage(steps_per_env, len(envs))
+        for step in range(steps_per_env):
+            rollout.insert(step, self.take_one_step(envs, model))
+        final_states = np.array([e.last_obs for e in envs])
+        tensor_states = torch.as_tensor(
+            final_states, device=getattr(model, 'device', self.compute_device))
+        final_vals = model(tensor_states)[0].detach().cpu().numpy()
+        returns, advantages = rollout.compute_returns(
+            final_vals, self.gamma, self.lmda)
+        return self._batch_tensors(rollout, returns, advantages, flat)
 
+    @named_output('states actions action_prob returns advantages values')
+    def _batch_tensors(self, rollout, returns, advantages, flat=True):
         def t(x, dtype=torch.float32):
             if flat:
-                x = np.asanyarray(x)
                 x = x.reshape(-1, *x.shape[2:])
             return torch.as_tensor(x, device=self.compute_device, dtype=dtype)
 
-        self.num_steps += actions.size
-
         return (
-            t([s.states for s in steps]), t(actions, torch.int64),
-            t(probs), t(returns), t(advantages), t(values[:-1])
+            t(rollout.states, None), t(rollout.actions, torch.int64),
+            t(rollout.action_prob), t(returns), t(advantages),
+            t(rollout.values[:-1])
         )
 
     def calculate_loss(
@@ -173,15 +272,139 @@ class PPO(BaseAlgo):
                 loss.backward()
                 self.optimizer.step()
 
+    def _rollout_worker(self, model, batch_queue, stop_event, rng):
+        """
+        Generate batches in a loop. Runs in a background thread.
+
+        Action sampling uses `rng` rather than the learner's generator.
+        Environments use their own generators; see ``safelife.random``.
+        """
+        version = -1
+        rollout_model = model
+        try:
+            set_rng(rng)  # for this thread only
+            while not stop_event.is_set():
+                with self._model_lock:
+                    if version != self.policy_version:
+                        model.load_state_dict(self.model.state_dict())
+                        version = self.policy_version
+                        if self.inference_mode:
+                            rollout_model = InferenceModel(
+                                model, self.inference_mode)
+                with torch.no_grad():
+                    batch = self.gen_training_batch(
+                        self.steps_per_env, model=rollout_model)
+                while not stop_event.is_set():
+                    try:
+                        batch_queue.put((version, batch), timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+        except BaseException as err:
+            self._rollout_error = err
+            raise
+
+    def async_training_batches(self):
+        """
+        Yield training batches generated by a background actor thread.
+
+        Stale batches are skipped. The actor thread is stopped when the
+        generator is closed.
+        """
+        model = copy.deepcopy(self.model)
+        batch_queue = queue.Queue(self.max_queued_batches)
+        stop_event = threading.Event()
+        self._rollout_error = None
+        self._batch_queue = batch_queue
+        rng = np.random.default_rng(get_rng().integers(2**63))
+        worker = threading.Thread(
+            target=self._rollout_worker, daemon=True,
+            args=(model, batch_queue, stop_event, rng))
+        worker.start()
+        try:
+            while True:
+                try:
+                    version, batch = batch_queue.get(timeout=1.0)
+                except queue.Empty:
+                    if not worker.is_alive():
+                        raise RuntimeError(
+                            "Rollout worker stopped unexpectedly"
+                        ) from self._rollout_error
+                    continue
+                if self.policy_version - version > self.max_policy_lag:
+                    self.num_stale_batches += 1
+                    continue
+                yield batch
+        finally:
+            stop_event.set()
+            worker.join()
+            self._batch_queue = None
+
+    def remote_training_batches(self):
+        """
+        Yield training batches generated by the `rollout_workers` pool.
+
+        Each worker always has a rollout in progress, so the environments
+        keep stepping while the learner trains. As with `async_rollouts`,
+        batches more than `max_policy_lag` updates behind are discarded.
+        """
+        workers = self.rollout_workers
+        if not workers.rollouts_requested:
+            # Otherwise, the weights will be sent after the pending batch.
+            with self._model_lock:
+                workers.broadcast_weights(self.model, self.policy_version)
+        while True:
+            data, version = workers.collect_rollouts(self.steps_per_env)
+            # Start on the next batch right away, with the newest weights.
+            with self._model_lock:
+                workers.broadcast_weights(self.model, self.policy_version)
+            workers.request_rollouts(self.steps_per_env)
+            if self.policy_version - version > self.max_policy_lag:
+                self.num_stale_batches += 1
+                continue
+            rollout = RolloutStorage(*data['actions'].shape)
+            for key, val in data.items():
+                setattr(rollout, key, val)
+            returns, advantages = rollout.compute_returns(
+                rollout.values[-1], self.gamma, self.lmda)
+            yield self._batch_tensors(rollout, returns, advantages)
+
     def train(self, steps):
         max_steps = self.num_steps + steps
 
+        if self.rollout_workers is not None:
+            batches = self.remote_training_batches()
+        elif self.async_rollouts:
+            batches = self.async_training_batches()
+        else:
+            batches = (
+                self.gen_training_batch(self.steps_per_env)
+                for _ in itertools.count()
+            )
+
+        try:
+            self._train_on_batches(batches, max_steps)
+        finally:
+            batches.close()
+
+    def _train_on_batches(self, batches, max_steps):
         while self.num_steps < max_steps:
             next_report = round_up(self.num_steps, self.report_interval)
             next_test = round_up(self.num_steps, self.test_interval)
 
-            batch = self.gen_training_batch(self.steps_per_env)
-            self.train_batch(batch)
+            batch = next(batches)
+            # Steps are only counted once the learner trains on them, so
+            # batches dropped or still queued by an actor don't count.
+            self.num_steps += len(batch.actions)
+            with self._model_lock:
+                self.train_batch(batch)
+                self.policy_version += 1
+
+            # In async mode the actor thread keeps its own inference copy,
+            # but this one is still used for the test episodes.
+            if (self.inference_model is not None and
+                    self.policy_version % self.inference_refresh_interval == 0):
+                self.inference_model.refresh(self.model)
 
             self.save_checkpoint_if_needed()
 
@@ -203,6 +426,10 @@ class PPO(BaseAlgo):
                     "entropy": entropy,
                     "values": values,
                     "advantages": advantages,
+                    "stale_batches": self.num_stale_batches,
+                    "queued_batches": (
+                        0 if self._batch_queue is None
+                        else self._batch_queue.qsize()),
                 }, num_steps, 'ppo')
 
             if self.testing_envs and num_steps >= next_test:
@@ -0,0 +1,371 @@
+"""
+Lightweight multi-process rollout workers.
+
+Each worker process hosts a set of environments along with its own copy of
+the policy network, and generates batches of rollouts on request. Workers
+communicate with the learner over ``multiprocessing.connection``, so they
+can run either as local subprocesses (see ``RolloutWorkerPool``) or on other
+hosts (see ``run_worker()``), without needing a Ray cluster.
+
+To check that everything works on the current machine, run a quick smoke
+test with several local worker processes::
+
+    python -m training.rollout_workers --workers 3
+
+The protocol consists of pickled tuples:
+
+- ``('weights', version, arrays)``: learner to worker. Update the worker's
+  policy with a full copy of the learner's state dict.
+- ``('rollout', num_steps)``: learner to worker. Run all environments for
+  `num_steps` steps and send back the trajectories.
+- ``('rollout', version, payload)``: worker to learner. Compressed
+  trajectory data, generated by the given policy version.
+- ``('error', message)``: worker to learner. The worker failed.
+- ``('close',)``: learner to worker. Shut down.
+"""
+
+import os
+import time
+import zlib
+import pickle
+import logging
+import argparse
+import functools
+import traceback
+import multiprocessing
+from multiprocessing.connection import Listener, Client
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+
+from safelife.random import set_rng
+
+from .ppo import RolloutStorage
+from .utils import sample_categorical
+
+
+logger = logging.getLogger(__name__)
+
+
+def compress_arrays(data):
+    """
+    Serialize and compress a dictionary of arrays.
+
+    Binary uint8 arrays (such as SafeLife observations) are bit-packed along
+    their last axis first, which reduces their size eight-fold even before
+    compression.
+    """
+    packed = {}
+    for key, val in data.items():
+        val = np.asanyarray(val)
+        if val.dtype == np.uint8 and val.size and val.max() <= 1:
+            packed[key] = ('bits', val.shape, np.packbits(val, axis=-1))
+        else:
+            packed[key] = ('raw', val.shape, val)
+    return zlib.compress(pickle.dumps(packed, pickle.HIGHEST_PROTOCOL), 1)
+
+
+def decompress_arrays(payload):
+    """Opposite of :func:`compress_arrays`."""
+    data = {}
+    for key, (kind, shape, val) in pickle.loads(zlib.decompress(payload)).items():
+        if kind == 'bits':
+            val = np.unpackbits(val, axis=-1, count=shape[-1])
+        data[key] = val
+    return data
+
+
+def _run_rollout(model, envs, num_steps, rng):
+    """
+    Step each environment `num_steps` times, sampling actions from the model.
+    """
+    rollout = RolloutStorage(num_steps, len(envs))
+    for step in range(num_steps):
+        states = np.array([e.last_obs for e in envs])
+        with torch.no_grad():
+            values, policies = model(torch.as_tensor(states))
+        values = values.cpu().numpy()
+        policies = policies.cpu().numpy()
+        actions = sample_categorical(policies, rng)
+        rewards = []
+        dones = []
+        for action, env in zip(actions, envs):
+            obs, reward, done, info = env.step(action)
+            if done:
+                obs = env.reset()
+            env.last_obs = obs
+            rewards.append(reward)
+            dones.append(done)
+        rollout.insert(step, SimpleNamespace(
+            states=states, actions=actions, rewards=rewards, done=dones,
+            policies=policies, values=values))
+    states = np.array([e.last_obs for e in envs])
+    with torch.no_grad():
+        rollout.values[-1] = model(torch.as_tensor(states))[0].cpu().numpy()
+    return {
+        'states': rollout.states,
+        'actions': rollout.actions,
+        'rewards': rollout.rewards,
+        'done': rollout.done,
+        'action_prob': rollout.action_prob,
+        'values': rollout.values,
+    }
+
+
+def run_worker(address, authkey, env_factory, model_factory, seed=None):
+    """
+    Main loop for a rollout worker.
+
+    Can be run in a separate process on any host that can reach `address`.
+
+    Parameters
+    ----------
+    address : tuple or str
+        Address of the learner's ``RolloutWorkerPool``.
+    authkey : bytes
+        Authentication key shared with the learner.
+    env_factory : callable
+        Called with no arguments to create a list of environments.
+    model_factory : callable
+        Called with no arguments to create the policy network.
+        Its weights are replaced by the learner before any rollouts.
+    seed : int or numpy.random.SeedSequence or None
+        Seed for the action sampling and environment random number generators.
+    """
+    conn = Client(address, authkey=authkey)
+    try:
+        rng = np.random.default_rng(seed)
+        with set_rng(rng):
+            envs = env_factory()
+            model = model_factory()
+            model.eval()
+            version = -1
+            for env in envs:
+                env.last_obs = env.reset()
+            while True:
+                msg = conn.recv()
+                if msg[0] == 'close':
+                    break
+                elif msg[0] == 'weights':
+                    _, version, arrays = msg
+                    model.load_state_dict({
+                        key: torch.from_numpy(val)
+                        for key, val in arrays.items()
+                    })
+                elif msg[0] == 'rollout':
+                    data = _run_rollout(model, envs, msg[1], rng)
+                    conn.send(('rollout', version, compress_arrays(data)))
+                else:
+                    raise ValueError("Unexpected message '%s'" % (msg[0],))
+    except (EOFError, KeyboardInterrupt):
+        pass  # learner went away
+    except Exception:
+        conn.send(('error', traceback.format_exc()))
+        raise
+    finally:
+        conn.close()
+
+
+class RolloutWorkerPool(object):
+    """
+    Learner-side interface to a set of rollout workers.
+
+    Parameters
+    ----------
+    env_factory : callable
+        Picklable function which creates a list of environments for each
+        worker. Note that the environments live in the worker processes, so
+        any loggers that they use need to work across processes.
+    model_factory : callable
+        Picklable function which creates the policy network.
+    num_workers : int
+        Number of local worker processes to start.
+    num_remote_workers : int
+        Number of additional workers to wait for. These should be started
+        separately with ``run_worker(pool.address, pool.authkey, ...)``.
+    address : tuple or str
+        Address on which to listen for workers. Defaults to a random port on
+        localhost.
+    authkey : bytes or None
+        Authentication key for worker connections. Random if not given.
+    seed : int or numpy.random.SeedSequence or None
+        Used to seed each of the local workers.
+    """
+    def __init__(
+            self, env_factory, model_factory, num_workers=2,
+            num_remote_workers=0, address=('localhost', 0), authkey=None,
+            seed=None):
+        self.authkey = authkey or os.urandom(16)
+        self.listener = Listener(address, authkey=self.authkey)
+        self.address = self.listener.address
+        self.processes = []
+        self.connections = []
+        self._requested_steps = None  # size of the outstanding requests
+
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        # Use spawn rather than fork so that workers don't inherit any
+        # torch or thread state from the learner. Workers can't be daemonic,
+        # since level iterators start their own process pools.
+        ctx = multiprocessing.get_context('spawn')
+        for worker_seed in seed.spawn(num_workers):
+            proc = ctx.Process(
+                target=run_worker, args=(
+                    self.address, self.authkey,
+                    env_factory, model_factory, worker_seed))
+            proc.start()
+            self.processes.append(proc)
+        for _ in range(num_workers + num_remote_workers):
+            self.connections.append(self.listener.accept())
+
+    def broadcast_weights(self, model, version):
+        """
+        Send the current model weights to all workers.
+
+        The full state dict is sent each time. (With an optimizer like Adam
+        nearly every parameter changes on every update, so there's little
+        to gain from only sending the changes.) The message is pickled once
+        and the same bytes are sent to each worker.
+
+        This can't be called while rollouts are outstanding, since the
+        workers won't read the weights until they're done (and large
+        messages in both directions could then block each other).
+        """
+        if self.rollouts_requested:
+            raise RuntimeError(
+                "Can't broadcast weights while rollouts are in progress.")
+        arrays = {
+            key: val.detach().cpu().numpy()
+            for key, val in model.state_dict().items()
+        }
+        msg = pickle.dumps(('weights', version, arrays), pickle.HIGHEST_PROTOCOL)
+        for conn in self.connections:
+            conn.send_bytes(msg)
+
+    @property
+    def rollouts_requested(self):
+        """True if rollouts have been requested but not yet collected."""
+        return self._requested_steps is not None
+
+    def request_rollouts(self, num_steps):
+        """
+        Ask each worker to start a rollout of `num_steps` steps.
+
+        Requests return immediately, so the workers can step their
+        environments while the learner does something else (e.g., trains).
+        Does nothing if rollouts have already been requested.
+        """
+        if not self.rollouts_requested:
+            for conn in self.connections:
+                conn.send(('rollout', num_steps))
+            self._requested_steps = num_steps
+
+    def collect_rollouts(self, num_steps):
+        """
+        Gather one rollout of `num_steps` steps from each of the workers.
+
+        Uses the outstanding requests if there are any (see
+        :meth:`request_rollouts`), and otherwise requests new rollouts and
+        waits for them.
+
+        Returns
+        -------
+        data : dict
+            Arrays of shape ``(num_steps, num_envs, ...)``, with environments
+            from all workers concatenated. The values array has one extra
+            step for the final value estimate.
+        version : int
+            Oldest policy version used by any of the workers.
+        """
+        if self._requested_steps not in (None, num_steps):
+            # The outstanding rollouts are the wrong size. Throw them away.
+            self._receive_all()
+        self.request_rollouts(num_steps)
+        results, versions = self._receive_all()
+        data = {
+            key: np.concatenate([r[key] for r in results], axis=1)
+            for key in results[0]
+        }
+        return data, min(versions)
+
+    def _receive_all(self):
+        results = []
+        versions = []
+        for conn in self.connections:
+            msg = conn.recv()
+            if msg[0] == 'error':
+                raise RuntimeError("Rollout worker failed:\n" + msg[1])
+            versions.append(msg[1])
+            results.append(decompress_arrays(msg[2]))
+        self._requested_steps = None
+        return results, versions
+
+    def close(self):
+        for conn in self.connections:
+            try:
+                conn.send(('close',))
+                conn.close()
+            except OSError:
+                pass
+        for proc in self.processes:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+        self.listener.close()
+        self.connections = []
+        self.processes = []
+        self._requested_steps = None
+
+
+def _smoke_test_envs(level, num_envs):
+    from safelife.level_iterator import SafeLifeLevelIterator
+    from .env_factory import safelife_env_factory
+    return safelife_env_factory(SafeLifeLevelIterator(level), num_envs=num_envs)
+
+
+def main():
+    """
+    Smoke test: run several local workers and collect a few batches.
+    """
+    from .models import SafeLifePolicyNetwork
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--envs-per-worker', type=int, default=4)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--batches', type=int, default=5)
+    parser.add_argument('--level', default='random/append-still-easy')
+    args = parser.parse_args()
+
+    obs_shape = (25, 25, 10)  # see env_factory.safelife_env_factory()
+    model = SafeLifePolicyNetwork(obs_shape)
+    pool = RolloutWorkerPool(
+        functools.partial(_smoke_test_envs, args.level, args.envs_per_worker),
+        functools.partial(SafeLifePolicyNetwork, obs_shape),
+        num_workers=args.workers)
+    num_envs = args.workers * args.envs_per_worker
+    try:
+        pool.broadcast_weights(model, 0)
+        for version in range(args.batches):
+            t0 = time.time()
+            data, data_version = pool.collect_rollouts(args.steps)
+            t1 = time.time()
+            # Change the weights so that workers get a new policy.
+            with torch.no_grad():
+                model.logits.bias.add_(0.01)
+            pool.broadcast_weights(model, version + 1)
+            pool.request_rollouts(args.steps)
+            assert data['actions'].shape == (args.steps, num_envs)
+            assert data['values'].shape == (args.steps + 1, num_envs)
+            assert data['states'].shape == (args.steps, num_envs) + obs_shape
+            assert data_version == version
+            print("batch %i: %i steps in %0.2fs (policy version %i)" % (
+                version, data['actions'].size, t1 - t0, data_version))
+    finally:
+        pool.close()
+    print("ok")
+
+
+if __name__ == '__main__':
+    main()
@@ -118,3 +118,98 @@ def nested_setattr(obj, key, val):
     if obj_key:
         obj = nested_getattr(obj, obj_key)
     setattr(obj, set_key, val)
+
+
+class SumTree(object):
+    """
+    Binary tree of non-negative values where each node holds the sum of its
+    children, allowing for O(log n) updates and proportional sampling.
+
+    All operations are vectorized over arrays of indices.
+
+    Parameters
+    ----------
+    capacity : int
+        Number of leaf values. All values are initially zero.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.depth = max(int(np.ceil(np.log2(capacity))), 0)
+        self.num_leaves = 1 << self.depth
+        self.tree = np.zeros(2 * self.num_leaves, dtype=np.float64)
+
+    @property
+    def total(self):
+        return self.tree[1]
+
+    def __getitem__(self, idx):
+        return self.tree[np.asanyarray(idx) + self.num_leaves]
+
+    def __setitem__(self, idx, values):
+        nodes = np.asanyarray(idx) + self.num_leaves
+        self.tree[nodes] = values
+        nodes = np.unique(nodes)
+        for _ in range(self.depth):
+            nodes = np.unique(nodes >> 1)
+            self.tree[nodes] = self.tree[2*nodes] + self.tree[2*nodes+1]
+
+    def find(self, targets):
+        """
+        Find the leaves at which the cumulative sum first exceeds `targets`.
+
+        Leaves with zero value are never returned (assuming that the total
+        is non-zero).
+        """
+        targets = np.array(targets, dtype=np.float64)
+        nodes = np.ones(targets.shape, dtype=np.int64)
+        tree = self.tree
+        for _ in range(self.depth):
+            left = 2 * nodes
+            left_val = tree[left]
+            # Guard against round-off error pushing us into an empty subtree.
+            go_right = (targets >= left_val) & (tree[left+1] > 0)
+            go_right |= left_val <= 0
+            targets -= left_val * go_right
+            nodes = left + go_right
+        return nodes - self.num_leaves
+
+
+def reverse_discounted_sum(x, discounts, final=0):
+    """
+    Discounted cumulative sum along the first axis, running backwards.
+
+    Computes ``out[t] = x[t] + discounts[t] * out[t+1]``, where
+    ``out[len(x)] = final``. This is vectorized over any remaining axes
+    (e.g., over environments), so only the time axis needs a python loop.
+    Useful for calculating returns and generalized advantage estimates.
+    """
+    x = np.asanyarray(x)
+    discounts = np.broadcast_to(discounts, x.shape)
+    out = np.empty(x.shape, dtype=np.result_type(x, discounts))
+    acc = final
+    for t in range(len(x) - 1, -1, -1):
+        acc = out[t] = x[t] + discounts[t] * acc
+    return out
+
+
+def sample_categorical(probs, rng):
+    """
+    Draw one sample from each row of a batch of categorical distributions.
+
+    This uses inverse-CDF sampling with a single uniform draw per row, which
+    is much faster than calling ``rng.choice()`` separately for each row.
+
+    Parameters
+    ----------
+    probs : ndarray, shape (n, k)
+        Probabilities of each category. Rows needn't be exactly normalized.
+    rng : numpy.random.Generator
+
+    Returns
+    -------
+    ndarray of ints, shape (n,)
+    """
+    cdf = np.cumsum(probs, axis=-1)
+    u = rng.random(cdf.shape[:-1]) * cdf[..., -1]
+    samples = np.sum(cdf <= u[..., np.newaxis], axis=-1)
+    return np.minimum(samples, cdf.shape[-1] - 1)